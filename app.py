@@ -1,18 +1,37 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from flask_cors import CORS
-import firebase_admin
-from firebase_admin import credentials, firestore
 import os
+import threading
 from dotenv import load_dotenv
 from collections import Counter
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import json
-from flasgger import Swagger
 
-# Charger les variables d'environnement
+# Charger les variables d'environnement (avant les modules qui lisent leur configuration)
 load_dotenv()
 
+from book_features import current_book_feature_table, get_book_feature_table
+from content_index import BATCH_CHUNK_SIZE, get_content_index
+from deadline import SHED_RETRY_AFTER, AdmissionControl, Deadline, DeadlineExceeded
+from metrics import METRICS_ENABLED, finish_request, record_degraded, render_metrics, server_timing, span, start_request
+from precompute import (PRECOMPUTED_RECOMMENDATIONS, RECORD_FORMAT, check_precomputed, get_precomputed,
+                        precomputed_books, read_precomputed, user_fingerprint)
+from history_writer import HISTORY_WRITE_BEHIND, get_history_writer
+from hybrid import parse_weights, read_names, recommend_hybrid
+from popularity import ALL_TIME, POPULARITY_WINDOWS, current_popularity_index, get_popularity_index, record_rated_books
+from collection_cache import (REALTIME_CACHE, collection_caches_status, derived_indexes_status,
+                              invalidate_collection_caches, start_collection_caches)
+from response_cache import RESPONSE_CACHE, RESPONSE_CACHE_MAX_AGE, make_entry, response_cache
+from recommendations import (SCORING_CHUNK_SIZE, find_similar_users, recommend_books, recommend_books_batch,
+                             recommend_from_similar_users)
+from storage import create_storage, project_fields
+from user_features import USER_FIELDS, extract_user_preferences, get_user_feature_store, user_feature_store_version
+
+# Démarrage rapide : client Firestore, écouteurs et index créés au premier besoin
+# (première requête ou /ready) au lieu du chargement du module
+FAST_STARTUP = os.getenv('FAST_STARTUP', '0') == '1'
+
+# Sert l'interface Swagger et la spécification /apispec.json
+SWAGGER_UI = os.getenv('SWAGGER_UI', '1') == '1'
+
 # Initialisation de Flask
 app = Flask(__name__)
 CORS(app)
@@ -44,23 +63,94 @@ swagger_config = {
     "specs_route": "/",
 }
 
-swagger = Swagger(app, config=swagger_config, template=swagger_template)
+if SWAGGER_UI:
+    from flasgger import Swagger
+    swagger = Swagger(app, config=swagger_config, template=swagger_template)
 
-# Charger la clé Firebase depuis une variable d'environnement
-firebase_key_json = os.getenv("GOOGLE_APPLICATION_CREDENTIALS_JSON")
-if not firebase_key_json:
-    raise ValueError("La variable d'environnement GOOGLE_APPLICATION_CREDENTIALS_JSON est manquante.")
+# Stockage des données : Firestore, ou mémoire/JSONL pour les tests et mesures hors ligne
+storage = create_storage(lazy=FAST_STARTUP)
 
-firebase_key = json.loads(firebase_key_json)
-cred = credentials.Certificate(firebase_key)
+# Charger les collections en mémoire et les maintenir à jour par des écouteurs temps réel
+if REALTIME_CACHE and not FAST_STARTUP:
+    start_collection_caches(storage)
+
+# Jeton optionnel protégeant les routes d'administration du cache
+CACHE_ADMIN_TOKEN = os.getenv("CACHE_ADMIN_TOKEN")
+
+# Nombre maximum de livres similaires retournés par /similarbooks
+MAX_SIMILAR_BOOKS = 50
+
+# Nombre maximum d'éléments d'une requête des endpoints /batch
+MAX_BATCH_ITEMS = 500
+
+# Requêtes de /recommendations/user en cours dans le processus (délestage au-delà de MAX_QUEUE_DEPTH)
+user_admission = AdmissionControl()
+
+
+def ndjson_response(lines):
+    """Réponse NDJSON : chaque ligne est envoyée dès qu'elle est calculée"""
+    return Response(stream_with_context(app.json.dumps(line) + '\n' for line in lines),
+                    mimetype='application/x-ndjson')
+
+
+def requested_fields():
+    """
+    Champs des documents retournés, demandés par le paramètre fields=a,b,c
+    (None : documents complets).
+    """
+    fields = request.args.get('fields')
+    if fields is None:
+        return None
+    return [field.strip() for field in fields.split(',') if field.strip()]
 
-# Initialisation de Firebase Admin
-if not firebase_admin._apps:
-    firebase_admin.initialize_app(cred, {
-        'projectId': firebase_key['project_id']
-    })
 
-db = firestore.client()
+def cached_response(key, cache_control, compute):
+    """
+    Sert une réponse JSON depuis le cache des réponses, ou la calcule avec compute()
+    et la met en cache si elle réussit. key() retourne la clé : route, paramètres et
+    version des données ; elle est réévaluée après le calcul, qui a pu construire ou
+    rafraîchir les index. Ajoute ETag et Cache-Control, et répond 304 si le client
+    envoie un If-None-Match correspondant.
+    """
+    entry = response_cache.get(key()) if RESPONSE_CACHE else None
+    if entry is None:
+        response = compute()
+        if not isinstance(response, Response) or response.status_code != 200:
+            return response
+        body = response.get_data()
+        entry = response_cache.put(key(), body) if RESPONSE_CACHE else make_entry(body)
+
+    response = Response(entry.body, mimetype='application/json')
+    response.set_etag(entry.etag)
+    response.headers['Cache-Control'] = cache_control
+    return response.make_conditional(request)
+
+
+def project_documents(documents, fields):
+    """Restreint chaque document d'une liste aux champs demandés"""
+    if fields is None:
+        return documents
+    return [project_fields(document, fields) for document in documents]
+
+
+def validate_batch(items, name):
+    """Message d'erreur si la liste d'une requête /batch est invalide, sinon None"""
+    if not isinstance(items, list) or not items:
+        return f"Le paramètre {name} doit être une liste non vide."
+    if len(items) > MAX_BATCH_ITEMS:
+        return f"Le paramètre {name} est limité à {MAX_BATCH_ITEMS} éléments."
+    return None
+
+
+def validate_similarity_params(data):
+    """Retourne (k, min_score, message d'erreur ou None) des paramètres de /similarbooks"""
+    k = data.get('k', 5)
+    min_score = data.get('min_score', 0.0)
+    if isinstance(k, bool) or not isinstance(k, int) or k < 1 or k > MAX_SIMILAR_BOOKS:
+        return k, min_score, f"Le paramètre k doit être un entier entre 1 et {MAX_SIMILAR_BOOKS}."
+    if isinstance(min_score, bool) or not isinstance(min_score, (int, float)):
+        return k, min_score, "Le paramètre min_score doit être un nombre."
+    return k, min_score, None
 
 @app.after_request
 def after_request(response):
@@ -69,22 +159,56 @@ def after_request(response):
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
     return response
 
+if METRICS_ENABLED:
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_token = start_request(request.url_rule.rule if request.url_rule else 'unmatched')
+
+    @app.after_request
+    def finish_request_metrics(response):
+        trace = finish_request(g.pop('metrics_token', None), request.method, response.status_code)
+        if trace is not None and trace.stages:
+            response.headers['Server-Timing'] = server_timing(trace)
+        return response
+
 @app.route('/similarbooks', methods=['POST'])
 def similar_books():
     """
-    Rechercher des livres similaires en fonction du contenu et du titre.
+    Rechercher des livres similaires en fonction du contenu et du titre,
+    ou des livres dont la description correspond à un texte libre.
     ---
     parameters:
       - in: body
         name: book
-        description: Objet contenant le titre du livre
+        description: Objet contenant l'id ou le titre du livre, ou un texte libre
         required: true
         schema:
           type: object
           properties:
+            id:
+              type: string
+              description: Id du document du livre (prioritaire sur le titre)
             title:
               type: string
               example: "Titre du livre"
+              description: Titre du livre, sans tenir compte de la casse ni des accents
+            query:
+              type: string
+              example: "apprentissage des réseaux de neurones"
+              description: Texte libre comparé aux descriptions (utilisé sans id ni titre)
+            k:
+              type: integer
+              example: 5
+              description: Nombre de livres similaires à retourner (défaut 5)
+            min_score:
+              type: number
+              example: 0.1
+              description: Score de similarité minimum entre 0 et 1 (défaut 0)
+      - in: query
+        name: fields
+        type: string
+        required: false
+        description: Champs des documents retournés, séparés par des virgules (ex. id,name,score)
     responses:
       200:
         description: Liste des livres similaires
@@ -94,6 +218,9 @@ def similar_books():
             base_book:
               type: object
               description: Le livre de base utilisé pour la comparaison
+            query:
+              type: string
+              description: Le texte libre recherché (à la place de base_book)
             similar_books:
               type: array
               items:
@@ -102,60 +229,211 @@ def similar_books():
       400:
         description: Erreur de validation (par exemple, titre manquant)
       404:
-        description: Livre non trouvé
+        description: Livre non trouvé, avec des suggestions de titres approchants
       500:
         description: Erreur interne du serveur
     """
     try:
         data = request.get_json()
-        book_title = data.get('title', '').strip()
+        book_id = str(data.get('id') or '').strip()
+        book_title = str(data.get('title') or '').strip()
+        query = str(data.get('query') or '').strip()
 
-        if not book_title:
-            return jsonify({"error": "Le titre du livre est requis."}), 400
+        if not book_id and not book_title and not query:
+            return jsonify({"error": "Le titre, l'id du livre ou un texte libre (query) est requis."}), 400
 
-        # Fetch all books from Firebase
-        books_ref = db.collection('BiblioInformatique')
-        books = books_ref.stream()
+        k, min_score, error = validate_similarity_params(data)
+        if error:
+            return jsonify({"error": error}), 400
+        fields = requested_fields()
 
-        # Construct the books_list, eliminating books without the 'name' attribute
-        books_list = [
-            {"id": book.id, **book.to_dict()}
-            for book in books
-            if 'name' in book.to_dict()  # Only include books with the 'name' field
-        ]
+        # Index TF-IDF partagé, reconstruit uniquement si le catalogue a changé
+        index = get_content_index(storage)
+        books_list = index.books
 
-        if not books_list:
+        if not len(index):
             return jsonify({"error": "Aucun livre avec un champ 'name' trouvé dans la base de données."}), 404
 
-        # Find the book with the given title
-        base_book = next((book for book in books_list if book['name'].lower() == book_title.lower()), None)
-        if not base_book:
-            return jsonify({"error": "Livre non trouvé dans la base de données."}), 404
-
-        # Extract titles and descriptions
-        titles = [book['name'] for book in books_list]
-        descriptions = [book.get('desc', '') for book in books_list]
+        # Texte libre : projeté dans l'espace TF-IDF du catalogue et comparé par l'index inversé
+        if not book_id and not book_title:
+            with span('scoring'):
+                similar_books = [books_list[i] for i, score in index.similar_to_text(query, k=k, min_score=min_score)]
+            with span('serialization'):
+                return jsonify({
+                    "query": query,
+                    "similar_books": project_documents(similar_books, fields)
+                })
+
+        # Find the book by id or normalized title
+        with span('lookup'):
+            base_index = index.find(book_id=book_id, title=book_title)
+        if base_index is None:
+            suggestions = [books_list[i]['name'] for i in index.search_titles(book_title, limit=5)] if book_title else []
+            return jsonify({"error": "Livre non trouvé dans la base de données.", "suggestions": suggestions}), 404
+        base_book = books_list[base_index]
+
+        # Score only the base book against the sparse matrix and keep the top k (excluding the base book)
+        with span('scoring'):
+            similar_books = [books_list[i] for i, score in index.similar(base_index, k=k, min_score=min_score)]
+
+        with span('serialization'):
+            return jsonify({
+                "base_book": project_fields(base_book, fields),
+                "similar_books": project_documents(similar_books, fields)
+            })
 
-        # TF-IDF Vectorization
-        vectorizer = TfidfVectorizer(stop_words='english')
-        tfidf_matrix = vectorizer.fit_transform(descriptions)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        # Compute cosine similarity
-        similarity_matrix = cosine_similarity(tfidf_matrix)
+@app.route('/similarbooks/batch', methods=['POST'])
+def similar_books_batch():
+    """
+    Rechercher les livres similaires de plusieurs livres en une requête.
+    Les livres trouvés par id ou titre sont comparés au catalogue par un seul produit
+    de matrices creuses par paquet ; chaque résultat est envoyé dès qu'il est prêt.
+    ---
+    parameters:
+      - in: body
+        name: batch
+        required: true
+        schema:
+          type: object
+          properties:
+            books:
+              type: array
+              description: Livres recherchés, chacun avec un id, un titre ou un texte libre (query)
+              items:
+                type: object
+                properties:
+                  id:
+                    type: string
+                  title:
+                    type: string
+                  query:
+                    type: string
+            k:
+              type: integer
+              example: 5
+              description: Nombre de livres similaires par livre (défaut 5)
+            min_score:
+              type: number
+              example: 0.1
+              description: Score de similarité minimum entre 0 et 1 (défaut 0)
+      - in: query
+        name: fields
+        type: string
+        required: false
+        description: Champs des documents retournés, séparés par des virgules (ex. id,name,score)
+    produces:
+      - application/x-ndjson
+    responses:
+      200:
+        description: >
+          Une ligne JSON par livre demandé, dans l'ordre de la requête : index, base_book
+          (ou query) et similar_books, ou error et suggestions si le livre est introuvable
+      400:
+        description: Erreur de validation
+      404:
+        description: Catalogue vide
+      500:
+        description: Erreur interne du serveur
+    """
+    try:
+        data = request.get_json() or {}
+        items = data.get('books')
+        error = validate_batch(items, 'books')
+        if error is None:
+            k, min_score, error = validate_similarity_params(data)
+        if error:
+            return jsonify({"error": error}), 400
+        fields = requested_fields()
+
+        index = get_content_index(storage)
+        if not len(index):
+            return jsonify({"error": "Aucun livre avec un champ 'name' trouvé dans la base de données."}), 404
 
-        # Find the index of the base book
-        base_index = titles.index(base_book['name'])
-        similarity_scores = list(enumerate(similarity_matrix[base_index]))
-        similarity_scores = sorted(similarity_scores, key=lambda x: x[1], reverse=True)
+        def results():
+            for start in range(0, len(items), BATCH_CHUNK_SIZE):
+                chunk = list(enumerate(items[start:start + BATCH_CHUNK_SIZE], start))
+                try:
+                    # Résoudre les livres du paquet puis les scorer ensemble
+                    with span('lookup'):
+                        lookups = []
+                        for position, item in chunk:
+                            item = item if isinstance(item, dict) else {}
+                            book_id = str(item.get('id') or '').strip()
+                            book_title = str(item.get('title') or '').strip()
+                            query = str(item.get('query') or '').strip()
+                            row = index.find(book_id=book_id, title=book_title) if book_id or book_title else None
+                            lookups.append((position, book_id, book_title, query, row))
+                    rows = [row for _, _, _, _, row in lookups if row is not None]
+                    with span('scoring'):
+                        similar = iter(index.similar_batch(rows, k=k, min_score=min_score))
+
+                    for position, book_id, book_title, query, row in lookups:
+                        if row is not None:
+                            yield {"index": position, "base_book": project_fields(index.books[row], fields),
+                                   "similar_books": project_documents([index.books[i] for i, score in next(similar)],
+                                                                      fields)}
+                        elif book_id or book_title:
+                            suggestions = [index.books[i]['name'] for i in index.search_titles(book_title, limit=5)] \
+                                if book_title else []
+                            yield {"index": position, "error": "Livre non trouvé dans la base de données.",
+                                   "suggestions": suggestions}
+                        elif query:
+                            with span('scoring'):
+                                similar_to_text = index.similar_to_text(query, k=k, min_score=min_score)
+                            yield {"index": position, "query": query,
+                                   "similar_books": project_documents([index.books[i] for i, score in similar_to_text],
+                                                                      fields)}
+                        else:
+                            yield {"index": position,
+                                   "error": "Le titre, l'id du livre ou un texte libre (query) est requis."}
+                except Exception as e:
+                    # Les autres paquets sont servis malgré l'erreur
+                    yield from ({"index": position, "error": str(e)} for position, _ in chunk)
+
+        return ndjson_response(results())
 
-        # Retrieve top 5 similar books (excluding the base book)
-        similar_books_indices = [i for i, score in similarity_scores if i != base_index][:5]
-        similar_books = [books_list[i] for i in similar_books_indices]
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        return jsonify({
-            "base_book": base_book,
-            "similar_books": similar_books
-        })
+@app.route('/books/search')
+def search_books():
+    """
+    Rechercher des livres par début de titre ou par titre approchant.
+    ---
+    parameters:
+      - in: query
+        name: q
+        type: string
+        required: true
+        description: Début du titre recherché (sans tenir compte de la casse ni des accents)
+      - in: query
+        name: limit
+        type: integer
+        required: false
+        description: Nombre maximum de résultats (défaut 10)
+    responses:
+      200:
+        description: Liste des livres correspondants (id et titre)
+      400:
+        description: Paramètre q manquant
+      500:
+        description: Erreur interne du serveur
+    """
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({"error": "Le paramètre q est requis."}), 400
+        limit = min(request.args.get('limit', 10, type=int), MAX_SIMILAR_BOOKS)
+
+        index = get_content_index(storage)
+        with span('lookup'):
+            books = [{"id": index.books[i]['id'], "name": index.books[i]['name']}
+                     for i in index.search_titles(query, limit=limit)]
+        with span('serialization'):
+            return jsonify({"books": books})
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -227,6 +505,11 @@ def get_similar_users_recommendations(user_email):
         type: string
         required: true
         description: L'email de l'utilisateur pour lequel obtenir les recommandations.
+      - in: query
+        name: fields
+        type: string
+        required: false
+        description: Champs des documents retournés, séparés par des virgules (ex. id,name,score)
     responses:
       200:
         description: Liste des recommandations basées sur les utilisateurs similaires
@@ -245,77 +528,110 @@ def get_similar_users_recommendations(user_email):
     """
     try:
         # Obtenir l'utilisateur cible
-        user_ref = db.collection('BiblioUser').document(user_email)
-        user_doc = user_ref.get()
+        with span('fetch'):
+            user_data = storage.get_user(user_email, USER_FIELDS)
 
-        if not user_doc.exists:
+        if user_data is None:
             return jsonify({'error': 'Utilisateur non trouvé'}), 404
 
-        user_data = user_doc.to_dict()
-
-        # Obtenir tous les utilisateurs
-        users_ref = db.collection('BiblioUser')
-        all_users = users_ref.stream()
-
-        # Calculer la similarité avec chaque utilisateur
-        similar_users = []
-        for other_user in all_users:
-            if other_user.id != user_email:
-                other_user_data = other_user.to_dict()
-                if not isinstance(other_user_data, dict):
-                    continue
-
-                similarity = calculate_user_similarity(user_data, other_user_data)
+        # Servir le précalcul s'il est à jour, sinon calculer la similarité avec tous
+        # les utilisateurs en une passe vectorisée (seuil de 30%, tri par similarité)
+        precomputed = get_precomputed(storage, user_email, user_data)
+        if precomputed is not None:
+            top_recommendations = precomputed['similar_docs'][:10]
+            similar_users = precomputed['similar_users']
+        else:
+            store = get_user_feature_store(storage)
+            top_recommendations, similar_users = recommend_from_similar_users(user_email, user_data, store)
 
-                if similarity > 30.0:  # Seuil minimum de similarité (30%)
-                    similar_users.append({
-                        'user_id': other_user.id,
-                        'similarity': similarity,
-                        'recent_docs': other_user_data.get('docRecent', [])
-                    })
+        with span('serialization'):
+            return jsonify(similar_users_payload(user_data, top_recommendations, similar_users, requested_fields()))
 
-        # Trier par similarité
-        similar_users.sort(key=lambda x: x['similarity'], reverse=True)
+    except Exception as e:
+        print(f"Erreur dans get_similar_users_recommendations: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
-        # Obtenir les recommandations des utilisateurs similaires
-        recommendations = []
-        seen_docs = {str(doc.get('nameDoc', '')) for doc in user_data.get('docRecent', []) if isinstance(doc, dict)}
+def similar_users_payload(user_data, recommendations, similar_users, fields=None):
+    """Corps de réponse des recommandations basées sur les utilisateurs similaires"""
+    return {
+        'recommendations': project_documents(recommendations, fields),
+        'similar_users': similar_users[:5],
+        'user_info': {
+            'departement': user_data.get('departement', ''),
+            'level': user_data.get('level', '')
+        }
+    }
 
-        # Prendre les 5 utilisateurs les plus similaires
-        for similar_user in similar_users[:5]:
-            # Pondérer les recommandations par la similarité
-            weight = float(similar_user['similarity']) / 100.0
-            for doc in similar_user['recent_docs']:
-                if not isinstance(doc, dict):
+@app.route('/recommendations/similar-users/batch', methods=['POST'])
+def get_similar_users_recommendations_batch():
+    """
+    Recommandations basées sur les utilisateurs similaires pour plusieurs utilisateurs.
+    Les utilisateurs sont lus en une requête et comparés au magasin partagé ;
+    chaque résultat est envoyé dès qu'il est prêt.
+    ---
+    parameters:
+      - in: body
+        name: batch
+        required: true
+        schema:
+          type: object
+          properties:
+            user_ids:
+              type: array
+              items:
+                type: string
+              description: Emails des utilisateurs
+      - in: query
+        name: fields
+        type: string
+        required: false
+        description: Champs des documents retournés, séparés par des virgules (ex. id,name,score)
+    produces:
+      - application/x-ndjson
+    responses:
+      200:
+        description: >
+          Une ligne JSON par utilisateur, dans l'ordre de la requête : user_id et la réponse
+          de /recommendations/similar-users/<user_email>, ou error
+      400:
+        description: Erreur de validation
+      500:
+        description: Erreur interne du serveur
+    """
+    try:
+        user_ids = (request.get_json() or {}).get('user_ids')
+        error = validate_batch(user_ids, 'user_ids')
+        if error:
+            return jsonify({'error': error}), 400
+        user_ids = [str(user_id) for user_id in user_ids]
+        fields = requested_fields()
+
+        with span('fetch'):
+            users = storage.get_users(user_ids, USER_FIELDS)
+
+        def results():
+            store = None
+            for user_id in user_ids:
+                user_data = users.get(user_id)
+                if user_data is None:
+                    yield {'user_id': user_id, 'error': 'Utilisateur non trouvé'}
                     continue
-
-                doc_name = str(doc.get('nameDoc', ''))
-                if doc_name and doc_name not in seen_docs:
-                    doc_copy = doc.copy()  # Créer une copie pour ne pas modifier l'original
-                    doc_copy['recommendation_score'] = weight * 100.0
-                    doc_copy['recommended_by'] = similar_user['user_id']
-                    doc_copy['similarity_score'] = similar_user['similarity']
-                    recommendations.append(doc_copy)
-                    seen_docs.add(doc_name)
-
-        # Trier les recommandations par score et prendre les 10 meilleures
-        recommendations.sort(key=lambda x: x.get('recommendation_score', 0), reverse=True)
-        top_recommendations = recommendations[:10]
-
-        return jsonify({
-            'recommendations': top_recommendations,
-            'similar_users': [{
-                'user_id': u['user_id'],
-                'similarity': u['similarity']
-            } for u in similar_users[:5]],
-            'user_info': {
-                'departement': user_data.get('departement', ''),
-                'level': user_data.get('level', '')
-            }
-        })
+                try:
+                    precomputed = get_precomputed(storage, user_id, user_data)
+                    if precomputed is not None:
+                        recommendations = precomputed['similar_docs'][:10]
+                        similar_users = precomputed['similar_users']
+                    else:
+                        store = store or get_user_feature_store(storage)
+                        recommendations, similar_users = recommend_from_similar_users(user_id, user_data, store)
+                    yield {'user_id': user_id,
+                           **similar_users_payload(user_data, recommendations, similar_users, fields)}
+                except Exception as e:
+                    yield {'user_id': user_id, 'error': str(e)}
+
+        return ndjson_response(results())
 
     except Exception as e:
-        print(f"Erreur dans get_similar_users_recommendations: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/')
@@ -341,13 +657,140 @@ def home():
         "endpoints": {
             "test": "/test",
             "recommandations_livres_similaires": "/similarbooks (POST)",
+            "recommandations_livres_similaires_lot": "/similarbooks/batch (POST)",
+            "recherche_livres": "/books/search?q=<titre>",
             "recommandations_utilisateur": "/recommendations/user/<user_id>",
+            "recommandations_utilisateurs_lot": "/recommendations/user/batch (POST)",
             "livres_populaires": "/recommendations/popular",
+            "recommandations_hybrides": "/recommendations/hybrid/<user_id>",
             "mise_a_jour_historique": "/user/<user_id>/history (POST)",
-            "recommandations_similaires": "/recommendations/similar-users/<user_email>"
+            "invalidation_cache": "/cache/invalidate (POST)",
+            "metriques": "/metrics",
+            "disponibilite": "/ready",
+            "recommandations_similaires": "/recommendations/similar-users/<user_email>",
+            "recommandations_similaires_lot": "/recommendations/similar-users/batch (POST)"
         }
     })
 
+@app.route('/cache/invalidate', methods=['POST'])
+def invalidate_cache():
+    """
+    Recharger les collections en cache et reconstruire les index de recommandation.
+    ---
+    parameters:
+      - in: header
+        name: Authorization
+        type: string
+        required: false
+        description: "Bearer <jeton>, requis si CACHE_ADMIN_TOKEN est défini"
+    responses:
+      200:
+        description: Cache invalidé, avec l'état des collections en cache
+      401:
+        description: Jeton d'administration invalide
+      500:
+        description: Erreur interne du serveur
+    """
+    if CACHE_ADMIN_TOKEN and request.headers.get('Authorization') != f"Bearer {CACHE_ADMIN_TOKEN}":
+        return jsonify({"error": "Non autorisé"}), 401
+    try:
+        invalidate_collection_caches(storage)
+        response_cache.clear()
+        return jsonify({"message": "Cache invalidé", "collections": collection_caches_status()})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+_warm_up_lock = threading.Lock()
+_warm_up_thread = None
+_warm_up_error = None
+
+
+def warm_up():
+    """Démarre les écouteurs différés et construit les index partagés (scikit-learn compris)"""
+    if FAST_STARTUP and REALTIME_CACHE:
+        start_collection_caches(storage)
+    get_book_feature_table(storage)
+    get_user_feature_store(storage)
+    get_popularity_index(storage)
+    get_content_index(storage)
+
+
+def _run_warm_up():
+    global _warm_up_error
+    try:
+        warm_up()
+        _warm_up_error = None
+    except Exception as e:
+        _warm_up_error = str(e)
+        print(f"Erreur lors du préchauffage des index: {str(e)}")
+
+
+def start_warm_up():
+    """Lance le préchauffage en arrière-plan, une fois par processus (relancé s'il a échoué)"""
+    global _warm_up_thread
+    thread = _warm_up_thread
+    if thread is not None and (thread.is_alive() or _warm_up_error is None):
+        return
+    with _warm_up_lock:
+        thread = _warm_up_thread
+        if thread is None or (not thread.is_alive() and _warm_up_error is not None):
+            _warm_up_thread = threading.Thread(target=_run_warm_up, name='warm-up', daemon=True)
+            _warm_up_thread.start()
+
+if FAST_STARTUP:
+    @app.before_request
+    def start_deferred_warm_up():
+        start_warm_up()
+
+@app.route('/ready')
+def ready():
+    """
+    Disponibilité de l'instance : prête quand les index de recommandation sont construits.
+    Le premier appel lance leur préchauffage en arrière-plan.
+    ---
+    responses:
+      200:
+        description: Index construits
+        schema:
+          type: object
+          properties:
+            ready:
+              type: boolean
+            indexes:
+              type: object
+              additionalProperties:
+                type: boolean
+              description: Index construits ou non
+            collections:
+              type: object
+              description: État des collections en cache
+      503:
+        description: Préchauffage en cours (ou en échec, voir error)
+    """
+    start_warm_up()
+    indexes = derived_indexes_status()
+    is_ready = all(indexes.values())
+    body = {"ready": is_ready, "indexes": indexes, "collections": collection_caches_status()}
+    if not is_ready and _warm_up_error is not None:
+        body["error"] = _warm_up_error
+    return jsonify(body), 200 if is_ready else 503
+
+@app.route('/metrics')
+def metrics():
+    """
+    Métriques au format texte de Prometheus : latences par route et par étape,
+    documents lus dans le stockage et accès aux caches.
+    ---
+    responses:
+      200:
+        description: Métriques Prometheus
+      404:
+        description: Métriques désactivées (METRICS_ENABLED=0)
+    """
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Métriques désactivées"}), 404
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/test')
 def test():
     """Route de test simple"""
@@ -355,52 +798,202 @@ def test():
 
 @app.route('/recommendations/user/<user_id>')
 def get_user_recommendations(user_id):
-    """Obtient des recommandations personnalisées pour un utilisateur"""
+    """
+    Obtient des recommandations personnalisées pour un utilisateur.
+    La requête dispose d'un budget (REQUEST_BUDGET_MS) : s'il s'épuise, ou si trop de
+    requêtes sont déjà en cours, la réponse vient d'un niveau moins coûteux (précalcul,
+    même périmé, ou livres populaires) et porte le champ degraded.
+    """
     try:
-        # Obtenir les préférences de l'utilisateur
-        user_preferences = get_user_preferences(user_id)
-        if not user_preferences:
-            return jsonify({'error': 'Utilisateur non trouvé'}), 404
+        deadline = Deadline.start(request.headers.get('X-Request-Start'))
+        fields = requested_fields()
+        with user_admission.admit(deadline.waited) as admitted:
+            if not admitted:
+                return degraded_user_response(None, None, fields, 'overloaded')
+
+            user_data = record = None
+            try:
+                # Obtenir l'utilisateur et ses préférences
+                with span('fetch'):
+                    user_data = deadline.call(storage.get_user, user_id, USER_FIELDS)
+                if user_data is None:
+                    return jsonify({'error': 'Utilisateur non trouvé'}), 404
+
+                # Table des caractéristiques de tous les livres
+                table = deadline.call(get_book_feature_table, storage)
+
+                def compute():
+                    nonlocal record
+                    user_preferences = extract_user_preferences(user_data)
+
+                    # Servir le précalcul s'il est à jour et que ses livres existent toujours
+                    record = deadline.call(read_precomputed, storage, user_id)
+                    precomputed = check_precomputed(record, user_data) if PRECOMPUTED_RECOMMENDATIONS else None
+                    recommendations = precomputed_books(precomputed, table) if precomputed is not None else None
+                    if recommendations is not None:
+                        recommendations = recommendations[:10]
+                        similar_users_count = precomputed['similar_users_count']
+                    else:
+                        # Scorer tous les livres pour l'utilisateur et ses utilisateurs similaires
+                        store = deadline.call(get_user_feature_store, storage)
+                        recommendations, similar_users_count = deadline.call(
+                            recommend_books, user_id, user_preferences, store, table)
+
+                    with span('serialization'):
+                        return jsonify(user_recommendations_payload(user_preferences, recommendations,
+                                                                    similar_users_count, fields))
+
+                # La réponse dépend du document de l'utilisateur, des autres utilisateurs et du catalogue
+                fingerprint = user_fingerprint(user_data)
+                def key():
+                    return ('user', user_id, tuple(fields or ()), fingerprint, user_feature_store_version(),
+                            table.version)
+                return cached_response(key, f'private, max-age={RESPONSE_CACHE_MAX_AGE}', compute)
+            except DeadlineExceeded:
+                return degraded_user_response(user_data, record, fields, 'deadline')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def user_recommendations_payload(user_preferences, recommendations, similar_users_count, fields=None):
+    """Corps de réponse des recommandations personnalisées d'un utilisateur"""
+    return {
+        'recommendations': project_documents(recommendations, fields),
+        'user_preferences': {
+            'top_categories': dict(user_preferences['categories'].most_common(3)),
+            'top_types': dict(user_preferences['types'].most_common(3))
+        },
+        'similar_users_count': similar_users_count
+    }
+
+def degraded_user_payload(user_data, record, fields, reason):
+    """
+    Corps dégradé de /recommendations/user, construit sans lecture ni calcul des scores
+    à partir des index déjà construits : le précalcul lu `record` même périmé, sinon les
+    livres les plus populaires que l'utilisateur n'a pas consultés. user_data et record
+    valent None s'ils n'ont pas pu être lus. Retourne None si aucun niveau n'est disponible.
+    """
+    table = current_book_feature_table()
+    popularity_index = current_popularity_index()
+    recommendations = None
+    if table is not None and record and record.get('format') == RECORD_FORMAT:
+        recommendations = precomputed_books(record, table)
+    if recommendations is not None:
+        tier, recommendations, similar_users_count = 'precomputed', recommendations[:10], record['similar_users_count']
+    elif table is not None and popularity_index is not None:
+        read = set(read_names(user_data or {}))
+        popular = [(book_name, count) for book_name, count in popularity_index.most_common(10 + len(read))
+                   if book_name not in read][:10]
+        tier, recommendations, similar_users_count = 'popular', [], 0
+        for (book_name, count), book in zip(popular, table.find_by_names([book_name for book_name, _ in popular])):
+            if book is not None:
+                book_data = dict(book)
+                book_data['popularity_score'] = count
+                recommendations.append(book_data)
+    else:
+        record_degraded('none', reason)
+        return None
+
+    record_degraded(tier, reason)
+    payload = user_recommendations_payload(extract_user_preferences(user_data or {}), recommendations,
+                                           similar_users_count, fields)
+    payload['degraded'] = {'tier': tier, 'reason': reason}
+    return payload
+
+def degraded_user_response(user_data, record, fields, reason):
+    """Réponse dégradée (jamais mise en cache), ou 503 avec Retry-After si aucun niveau n'est disponible"""
+    payload = degraded_user_payload(user_data, record, fields, reason)
+    if payload is None:
+        response = jsonify({'error': 'Service surchargé, réessayez plus tard', 'reason': reason})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(SHED_RETRY_AFTER)
+    else:
+        response = jsonify(payload)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/recommendations/user/batch', methods=['POST'])
+def get_user_recommendations_batch():
+    """
+    Recommandations personnalisées pour plusieurs utilisateurs.
+    Les utilisateurs sont lus en une requête et les livres scorés par paquets
+    d'utilisateurs sur la table partagée ; chaque résultat est envoyé dès qu'il est prêt.
+    ---
+    parameters:
+      - in: body
+        name: batch
+        required: true
+        schema:
+          type: object
+          properties:
+            user_ids:
+              type: array
+              items:
+                type: string
+              description: Identifiants des utilisateurs
+      - in: query
+        name: fields
+        type: string
+        required: false
+        description: Champs des documents retournés, séparés par des virgules (ex. id,name,score)
+    produces:
+      - application/x-ndjson
+    responses:
+      200:
+        description: >
+          Une ligne JSON par utilisateur, dans l'ordre de la requête : user_id et la réponse
+          de /recommendations/user/<user_id>, ou error
+      400:
+        description: Erreur de validation
+      500:
+        description: Erreur interne du serveur
+    """
+    try:
+        user_ids = (request.get_json() or {}).get('user_ids')
+        error = validate_batch(user_ids, 'user_ids')
+        if error:
+            return jsonify({'error': error}), 400
+        user_ids = [str(user_id) for user_id in user_ids]
+        fields = requested_fields()
+
+        with span('fetch'):
+            users = storage.get_users(user_ids, USER_FIELDS)
+        table = get_book_feature_table(storage)
+
+        def results():
+            store = None
+            for start in range(0, len(user_ids), SCORING_CHUNK_SIZE):
+                chunk = user_ids[start:start + SCORING_CHUNK_SIZE]
+                try:
+                    # Servir les précalculs à jour, scorer les autres utilisateurs ensemble
+                    preferences, answers, live = {}, {}, []
+                    for user_id in chunk:
+                        user_data = users.get(user_id)
+                        if user_data is None or user_id in preferences:
+                            continue
+                        preferences[user_id] = extract_user_preferences(user_data)
+                        precomputed = get_precomputed(storage, user_id, user_data)
+                        recommendations = precomputed_books(precomputed, table) if precomputed is not None else None
+                        if recommendations is not None:
+                            answers[user_id] = (recommendations[:10], precomputed['similar_users_count'])
+                        else:
+                            live.append((user_id, preferences[user_id]))
+                    if live:
+                        store = store or get_user_feature_store(storage)
+                        for user_id, recommendations, similar_users_count in recommend_books_batch(live, store, table):
+                            answers[user_id] = (recommendations, similar_users_count)
+
+                    for user_id in chunk:
+                        if user_id not in preferences:
+                            yield {'user_id': user_id, 'error': 'Utilisateur non trouvé'}
+                        else:
+                            yield {'user_id': user_id,
+                                   **user_recommendations_payload(preferences[user_id], *answers[user_id], fields)}
+                except Exception as e:
+                    # Les autres paquets sont servis malgré l'erreur
+                    yield from ({'user_id': user_id, 'error': str(e)} for user_id in chunk)
+
+        return ndjson_response(results())
 
-        # Obtenir les utilisateurs similaires
-        similar_users = get_similar_users(user_id)
-
-        # Obtenir tous les livres
-        books_ref = db.collection('BiblioInformatique')
-        books = books_ref.stream()
-
-        # Calculer les scores pour chaque livre
-        scored_books = []
-        for book in books:
-            base_score = calculate_book_score(book, user_preferences)
-
-            # Bonus basé sur les préférences des utilisateurs similaires
-            similarity_bonus = 0
-            for similar_user in similar_users[:5]:  # Utiliser les 5 utilisateurs les plus similaires
-                sim_score = calculate_book_score(book, similar_user['preferences'])
-                similarity_bonus += (sim_score * similar_user['similarity']) / 10
-
-            final_score = base_score + similarity_bonus
-
-            book_data = book.to_dict()
-            book_data['id'] = book.id
-            book_data['score'] = final_score
-            book_data['base_score'] = base_score
-            book_data['similarity_bonus'] = similarity_bonus
-
-            scored_books.append(book_data)
-
-        # Trier les livres par score et prendre les 10 meilleurs
-        recommendations = sorted(scored_books, key=lambda x: x['score'], reverse=True)[:10]
-
-        return jsonify({
-            'recommendations': recommendations,
-            'user_preferences': {
-                'top_categories': dict(user_preferences['categories'].most_common(3)),
-                'top_types': dict(user_preferences['types'].most_common(3))
-            },
-            'similar_users_count': len(similar_users)
-        })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -409,6 +1002,18 @@ def get_popular_books():
     """
     Obtient les livres les plus populaires basés sur les consultations récentes.
     ---
+    parameters:
+      - in: query
+        name: window
+        type: string
+        enum: [all, 24h, 7d]
+        required: false
+        description: Fenêtre de popularité (défaut all, toutes les consultations)
+      - in: query
+        name: fields
+        type: string
+        required: false
+        description: Champs des documents retournés, séparés par des virgules (ex. id,name,score)
     responses:
       200:
         description: Liste des livres populaires recommandés
@@ -420,47 +1025,143 @@ def get_popular_books():
               items:
                 type: object
                 description: Liste des livres populaires avec leur score de popularité
+      400:
+        description: Fenêtre inconnue
       500:
         description: Erreur interne du serveur
     """
     try:
-        # Obtenir tous les utilisateurs
-        users_ref = db.collection('BiblioUser')
-        users = users_ref.stream()
-
-        # Compter les occurrences de chaque livre
-        book_counts = Counter()
-
-        for user in users:
-            user_data = user.to_dict()
-            if 'docRecent' in user_data:
-                for doc in user_data['docRecent']:
-                    if 'nameDoc' in doc:
-                        book_counts[doc['nameDoc']] += 1
-
-        # Obtenir les détails des livres les plus populaires
-        popular_books = []
-        books_ref = db.collection('BiblioInformatique')
-
-        for book_name, count in book_counts.most_common(10):
-            # Chercher le livre dans la collection
-            query = books_ref.where('name', '==', book_name).limit(1)
-            book_docs = query.stream()
-
-            for book in book_docs:
-                book_data = book.to_dict()
-                book_data['id'] = book.id
-                book_data['popularity_score'] = count
-                popular_books.append(book_data)
+        window = request.args.get('window', ALL_TIME)
+        if window != ALL_TIME and window not in POPULARITY_WINDOWS:
+            return jsonify({'error': f"Fenêtre inconnue : {window}"}), 400
+
+        # Compteurs de popularité maintenus de façon incrémentale
+        popularity_index = get_popularity_index(storage)
+        table = get_book_feature_table(storage)
+        fields = requested_fields()
+
+        def compute():
+            payload = popular_books_payload(popularity_index, table, window, fields)
+            with span('serialization'):
+                return jsonify(payload)
+
+        # Les fenêtres glissantes évoluent sans nouvelle version : le TTL du cache les borne
+        def key():
+            return ('popular', None, (window, tuple(fields or ())), popularity_index.version, table.version)
+        return cached_response(key, f'public, max-age={RESPONSE_CACHE_MAX_AGE}', compute)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/recommendations/hybrid/<user_id>')
+def get_hybrid_recommendations(user_id):
+    """
+    Recommandations hybrides : contenu, préférences, utilisateurs similaires et popularité
+    mélangés en une seule réponse, calculée sur les index partagés.
+    ---
+    parameters:
+      - in: path
+        name: user_id
+        type: string
+        required: true
+        description: L'identifiant (email) de l'utilisateur
+      - in: query
+        name: limit
+        type: integer
+        required: false
+        description: Nombre de livres retournés (défaut 10, maximum 50)
+      - in: query
+        name: weights
+        type: string
+        required: false
+        description: >
+          Poids des signaux content, preference, similar_users et popularity
+          (ex. content:0.5,popularity:0) ; les autres gardent leur poids par défaut
+      - in: query
+        name: window
+        type: string
+        enum: [all, 24h, 7d]
+        required: false
+        description: Fenêtre du signal de popularité (défaut all)
+      - in: query
+        name: fields
+        type: string
+        required: false
+        description: Champs des documents retournés, séparés par des virgules (ex. id,name,score)
+    responses:
+      200:
+        description: Livres recommandés, sans doublon, avec leur score et la valeur de chaque signal
+      400:
+        description: Paramètre invalide
+      404:
+        description: Utilisateur non trouvé
+      500:
+        description: Erreur interne du serveur
+    """
+    try:
+        try:
+            limit = int(request.args.get('limit', 10))
+            weights = parse_weights(request.args.get('weights'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if limit < 1 or limit > MAX_SIMILAR_BOOKS:
+            return jsonify({'error': f"Le paramètre limit doit être un entier entre 1 et {MAX_SIMILAR_BOOKS}."}), 400
+        window = request.args.get('window', ALL_TIME)
+        if window != ALL_TIME and window not in POPULARITY_WINDOWS:
+            return jsonify({'error': f"Fenêtre inconnue : {window}"}), 400
+        fields = requested_fields()
+
+        with span('fetch'):
+            user_data = storage.get_user(user_id, USER_FIELDS)
+        if user_data is None:
+            return jsonify({'error': 'Utilisateur non trouvé'}), 404
 
-        return jsonify({'popular_books': popular_books})
+        # Les quatre signaux sont lus dans les index partagés : aucune relecture de collection
+        table = get_book_feature_table(storage)
+        index = get_content_index(storage)
+        store = get_user_feature_store(storage)
+        popularity_index = get_popularity_index(storage)
+
+        def compute():
+            recommendations, similar_users = recommend_hybrid(user_id, user_data, table, index, store,
+                                                              popularity_index, limit, weights, window)
+            with span('serialization'):
+                return jsonify({
+                    'recommendations': project_documents(recommendations, fields),
+                    'similar_users': similar_users,
+                    'weights': weights
+                })
+
+        fingerprint = user_fingerprint(user_data)
+        def key():
+            return ('hybrid', user_id, (limit, tuple(sorted(weights.items())), window, tuple(fields or ())),
+                    fingerprint, store.version, table.version, index.version, popularity_index.version)
+        return cached_response(key, f'private, max-age={RESPONSE_CACHE_MAX_AGE}', compute)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def popular_books_payload(popularity_index, table, window, fields=None):
+    """Corps de réponse des livres les plus populaires d'une fenêtre"""
+    with span('ranking'):
+        popular = popularity_index.most_common(10, window=window)
+
+    # Obtenir les détails des livres les plus populaires en une seule recherche
+    with span('lookup'):
+        books = table.find_by_names([book_name for book_name, count in popular])
+
+    popular_books = []
+    for (book_name, count), book in zip(popular, books):
+        if book is not None:
+            book_data = dict(book)
+            book_data['popularity_score'] = count
+            popular_books.append(book_data)
+    return {'popular_books': project_documents(popular_books, fields)}
+
 @app.route('/user/<user_id>/history', methods=['POST'])
 def update_reading_history(user_id):
     """
     Mettre à jour l'historique des livres d'un utilisateur.
+    Les notes sont journalisées puis écrites par lots en arrière-plan
+    (les notes répétées d'un même livre sont regroupées).
     ---
     parameters:
       - in: path
@@ -470,16 +1171,27 @@ def update_reading_history(user_id):
         description: L'ID de l'utilisateur dont l'historique doit être mis à jour.
       - in: body
         name: history
-        description: Liste des livres à ajouter à l'historique
+        description: Une note (bookId et rating) ou une liste de notes à ajouter à l'historique
         required: true
         schema:
           type: object
           properties:
+            bookId:
+              type: string
+              description: Id du livre noté
+            rating:
+              type: number
+              description: Note entre 0 et 5
             history:
               type: array
               items:
                 type: object
-                description: Détails des livres à ajouter à l'historique
+                properties:
+                  bookId:
+                    type: string
+                  rating:
+                    type: number
+                description: Notes à ajouter à l'historique (la dernière note d'un livre l'emporte)
     responses:
       200:
         description: Historique mis à jour avec succès
@@ -492,18 +1204,27 @@ def update_reading_history(user_id):
     """
     try:
         data = request.get_json()
-        book_id = data.get('bookId')
-        rating = data.get('rating')
-
-        if not book_id or not isinstance(rating, (int, float)) or rating < 0 or rating > 5:
+        entries = data.get('history') if 'history' in data else [data]
+        if not isinstance(entries, list) or not entries or len(entries) > MAX_BATCH_ITEMS:
             return jsonify({"error": "Données invalides"}), 400
 
-        user_ref = db.collection('users').document(user_id)
-        user_ref.set({
-            'readingHistory': {
-                book_id: rating
-            }
-        }, merge=True)
+        ratings = {}
+        for entry in entries:
+            book_id = entry.get('bookId') if isinstance(entry, dict) else None
+            rating = entry.get('rating') if isinstance(entry, dict) else None
+            if not book_id or not isinstance(rating, (int, float)) or rating < 0 or rating > 5:
+                return jsonify({"error": "Données invalides"}), 400
+            ratings[book_id] = rating
+
+        with span('write'):
+            if HISTORY_WRITE_BEHIND:
+                # Journalisée avant la réponse, la note est écrite par le prochain lot
+                get_history_writer(storage, subscribers=[record_rated_books]).submit(user_id, ratings)
+            else:
+                storage.save_ratings(user_id, ratings)
+                record_rated_books(storage, {user_id: ratings})
+        # Les réponses en cache de cet utilisateur ne doivent plus être servies
+        response_cache.invalidate_user(user_id)
 
         return jsonify({"message": "Historique mis à jour avec succès"})
 
@@ -512,27 +1233,12 @@ def update_reading_history(user_id):
 
 def get_user_preferences(user_id):
     """Obtient les préférences de l'utilisateur basées sur son historique"""
-    user_ref = db.collection('BiblioUser').document(user_id)
-    user_doc = user_ref.get()
+    user_data = storage.get_user(user_id, ['docRecentRegarder'])
 
-    if not user_doc.exists:
+    if user_data is None:
         return None
 
-    user_data = user_doc.to_dict()
-    preferences = {
-        'categories': Counter(),
-        'types': Counter()
-    }
-
-    # Analyse des documents récemment regardés
-    if 'docRecentRegarder' in user_data:
-        for doc in user_data['docRecentRegarder']:
-            if 'cathegorieDoc' in doc:
-                preferences['categories'][doc['cathegorieDoc']] += 1
-            if 'type' in doc:
-                preferences['types'][doc['type']] += 1
-
-    return preferences
+    return extract_user_preferences(user_data)
 
 def calculate_book_score(book, user_preferences):
     """Calcule un score de pertinence pour un livre basé sur les préférences de l'utilisateur"""
@@ -563,39 +1269,19 @@ def calculate_book_score(book, user_preferences):
 
     return score
 
-def get_similar_users(user_id):
-    """Trouve des utilisateurs similaires basés sur leurs préférences de lecture"""
-    users_ref = db.collection('BiblioUser')
-    users = users_ref.stream()
-
+def get_similar_users(user_id, target_preferences=None):
+    """
+    Trouve des utilisateurs similaires basés sur leurs préférences de lecture.
+    Les préférences des autres utilisateurs proviennent du magasin partagé :
+    aucune lecture Firestore par utilisateur.
+    """
     # Obtenir les préférences de l'utilisateur cible
-    target_preferences = get_user_preferences(user_id)
+    if target_preferences is None:
+        target_preferences = get_user_preferences(user_id)
     if not target_preferences:
         return []
 
-    similar_users = []
-    for user in users:
-        if user.id != user_id:
-            user_prefs = get_user_preferences(user.id)
-            if user_prefs:
-                similarity = 0
-                # Comparer les catégories préférées
-                for category in target_preferences['categories']:
-                    similarity += min(target_preferences['categories'][category],
-                                   user_prefs['categories'].get(category, 0))
-                # Comparer les types préférés
-                for type_ in target_preferences['types']:
-                    similarity += min(target_preferences['types'][type_],
-                                   user_prefs['types'].get(type_, 0))
-
-                if similarity > 0:
-                    similar_users.append({
-                        'user_id': user.id,
-                        'similarity': similarity,
-                        'preferences': user_prefs
-                    })
-
-    return sorted(similar_users, key=lambda x: x['similarity'], reverse=True)
+    return find_similar_users(user_id, target_preferences, get_user_feature_store(storage))
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,171 @@
+import contextlib
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import time
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows : pas de verrou, deux processus peuvent construire la même version
+    fcntl = None
+
+# Répertoire partagé des index dérivés sérialisés (de préférence sur tmpfs, ex. /dev/shm/recommendation) ;
+# vide : chaque processus construit et garde ses propres index
+ARTIFACTS_DIR = os.getenv('ARTIFACTS_DIR', '')
+
+# Nombre de versions gardées sur disque par index (les plus anciennes sont supprimées)
+ARTIFACTS_KEEP = int(os.getenv('ARTIFACTS_KEEP', '3'))
+
+# Délai (en secondes) avant de republier un index modifié par les écouteurs temps réel :
+# les modifications rapprochées sont regroupées en une seule construction partagée
+ARTIFACTS_REPUBLISH_DELAY = float(os.getenv('ARTIFACTS_REPUBLISH_DELAY', '30'))
+
+# Version du format des artefacts : un changement de format donne de nouveaux répertoires
+ARTIFACT_FORMAT = 3
+
+
+def content_digest(items):
+    """Empreinte du contenu d'une collection lue : identique dans tous les processus pour les mêmes données"""
+    digest = hashlib.sha1()
+    for item in items:
+        digest.update(json.dumps(item, sort_keys=True, default=str, ensure_ascii=False).encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def sparse_arrays(prefix, matrix):
+    """Tableaux (data, indices, indptr) d'une matrice creuse, nommés avec un préfixe"""
+    return {f'{prefix}_data': matrix.data, f'{prefix}_indices': matrix.indices, f'{prefix}_indptr': matrix.indptr}
+
+
+def sparse_matrix(arrays, prefix, shape, fmt='csr'):
+    """Matrice creuse reconstruite sans copie à partir des tableaux de sparse_arrays"""
+    from scipy.sparse import csc_matrix, csr_matrix
+
+    matrix_class = csr_matrix if fmt == 'csr' else csc_matrix
+    return matrix_class((arrays[f'{prefix}_data'], arrays[f'{prefix}_indices'], arrays[f'{prefix}_indptr']),
+                        shape=shape, copy=False)
+
+
+def _load_array(path):
+    try:
+        return np.load(path, mmap_mode='r', allow_pickle=False)
+    except ValueError:
+        # Un tableau vide ne peut pas être projeté en mémoire
+        return np.load(path, allow_pickle=False)
+
+
+class ArtifactStore:
+    """
+    Versions sérialisées d'un index dérivé, partagées par les processus d'un serveur.
+    Chaque version est un répertoire nommé d'après l'empreinte des données sources,
+    contenant un fichier .npy par tableau (matrices creuses CSR/CSC en data, indices,
+    indptr) et meta.pkl (vocabulaires, dimensions). Les tableaux sont projetés en
+    mémoire en lecture seule : tous les processus partagent une seule copie physique.
+    Une version est écrite dans un répertoire temporaire puis publiée par un renommage
+    atomique ; un verrou par index garantit qu'un seul processus la construit.
+    La classe de l'index fournit to_artifact() -> (tableaux, méta) et
+    from_artifact(items, version, tableaux, méta).
+    """
+
+    def __init__(self, name, index_class, directory=None, keep=None):
+        self.name = name
+        self.index_class = index_class
+        self.directory = ARTIFACTS_DIR if directory is None else directory
+        self.keep = ARTIFACTS_KEEP if keep is None else keep
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    @property
+    def root(self):
+        return os.path.join(self.directory, self.name)
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def versions(self):
+        """Clés des versions publiées, de la plus ancienne à la plus récente"""
+        try:
+            entries = [entry for entry in os.scandir(self.root) if entry.is_dir() and not entry.name.startswith('.')]
+        except FileNotFoundError:
+            return []
+        return [entry.name for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime)]
+
+    @contextlib.contextmanager
+    def _locked(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, '.lock'), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def load(self, key):
+        """Retourne (tableaux projetés en mémoire, méta) d'une version publiée, ou None"""
+        path = self.path(key)
+        try:
+            with open(os.path.join(path, 'meta.pkl'), 'rb') as file:
+                meta = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        arrays = {name: _load_array(os.path.join(path, f'{name}.npy')) for name in meta['arrays']}
+        return arrays, meta['meta']
+
+    def publish(self, key, arrays, meta):
+        """Écrit une version puis la rend visible d'un seul coup (renommage du répertoire)"""
+        os.makedirs(self.root, exist_ok=True)
+        staging = os.path.join(self.root, f'.{key}-{os.getpid()}-{time.time_ns()}')
+        os.makedirs(staging)
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(staging, f'{name}.npy'), np.ascontiguousarray(array), allow_pickle=False)
+            with open(os.path.join(staging, 'meta.pkl'), 'wb') as file:
+                pickle.dump({'arrays': list(arrays), 'meta': meta}, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(staging, self.path(key))
+        except OSError:
+            # Version déjà publiée par un autre processus, ou écriture impossible
+            shutil.rmtree(staging, ignore_errors=True)
+            if not os.path.isdir(self.path(key)):
+                raise
+        self._prune(key)
+
+    def _prune(self, current):
+        # Les processus qui projettent encore une ancienne version la gardent jusqu'à son remplacement
+        versions = [key for key in self.versions() if key != current]
+        for key in versions[:max(0, len(versions) - self.keep + 1)]:
+            shutil.rmtree(self.path(key), ignore_errors=True)
+
+    def build(self, items, version, build):
+        """
+        Retourne l'index des données `items` projeté depuis sa version publiée ; la
+        construit avec build(items, version) et la publie si elle n'existe pas encore.
+        Sans répertoire configuré, ou si le disque est inutilisable, l'index est
+        simplement construit en mémoire.
+        """
+        if not self.enabled:
+            return build(items, version)
+
+        key = f'{ARTIFACT_FORMAT}-{content_digest(items)}'
+        index = None
+        try:
+            with self._locked():
+                loaded = self.load(key)
+                if loaded is None:
+                    index = build(items, version)
+                    self.publish(key, *index.to_artifact())
+                    loaded = self.load(key)
+                else:
+                    os.utime(self.path(key))
+        except OSError as e:
+            print(f"Artefacts {self.name} indisponibles, index gardé en mémoire: {str(e)}")
+            return index if index is not None else build(items, version)
+        return self.index_class.from_artifact(items, version, *loaded)
@@ -0,0 +1,377 @@
+import asyncio
+import contextvars
+import functools
+import io
+import os
+import re
+import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import app as api
+from book_features import get_book_feature_table
+from collection_cache import get_document_async
+from deadline import SHED_RETRY_AFTER, Deadline, DeadlineExceeded
+from metrics import finish_request, server_timing, span, start_request
+from popularity import ALL_TIME, POPULARITY_WINDOWS, get_popularity_index
+from precompute import PRECOMPUTED_RECOMMENDATIONS, check_precomputed, precomputed_books, user_fingerprint
+from recommendations import recommend_books, recommend_from_similar_users
+from response_cache import RESPONSE_CACHE, RESPONSE_CACHE_MAX_AGE, make_entry, response_cache
+from storage import RECOMMENDATIONS_COLLECTION, create_async_storage
+from user_features import USER_FIELDS, extract_user_preferences, get_user_feature_store, user_feature_store_version
+
+# Nombre de threads du calcul des scores (NumPy/SciPy libèrent le GIL) : borne les calculs
+# simultanés d'un processus, les requêtes suivantes attendent sans bloquer la boucle
+SCORING_WORKERS = int(os.getenv('SCORING_WORKERS', str(os.cpu_count() or 1)))
+
+_scoring_executor = ThreadPoolExecutor(max_workers=SCORING_WORKERS, thread_name_prefix='scoring')
+
+Request = namedtuple('Request', ['method', 'path', 'query', 'headers'])
+
+# En-têtes ajoutés à toutes les réponses, comme after_request de app.py
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'Content-Type,Authorization'),
+    (b'access-control-allow-methods', b'GET,PUT,POST,DELETE,OPTIONS'),
+]
+
+
+async def score(func, *args):
+    """Exécute un calcul sur l'exécuteur borné des scores, dans le contexte (métriques) de la requête"""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _scoring_executor, functools.partial(context.run, func, *args))
+
+
+_async_storage = None
+
+
+def get_async_storage():
+    """Stockage asynchrone lisant les données du stockage de l'API (recréé si celui-ci change)"""
+    global _async_storage
+    if _async_storage is None or _async_storage[0] is not api.storage:
+        _async_storage = (api.storage, create_async_storage(api.storage))
+    return _async_storage[1]
+
+
+async def fetch_precomputed(storage, async_storage, user_id):
+    """Document précalculé d'un utilisateur, lu sans vérification (None si le précalcul est désactivé)"""
+    if not PRECOMPUTED_RECOMMENDATIONS:
+        return None
+    return await get_document_async(storage, async_storage, RECOMMENDATIONS_COLLECTION, user_id)
+
+
+def json_response(payload, status=200):
+    """Réponse (statut, en-têtes, corps) dont le corps est identique à celui de jsonify"""
+    body = api.app.json.response(payload).get_data()
+    return status, [(b'content-type', b'application/json')], body
+
+
+def requested_fields(request):
+    """Champs des documents retournés, demandés par le paramètre fields=a,b,c (None : documents complets)"""
+    fields = request.query.get('fields')
+    if fields is None:
+        return None
+    return [field.strip() for field in fields[0].split(',') if field.strip()]
+
+
+def etag_matches(request, etag):
+    """Vrai si l'en-tête If-None-Match du client désigne cet ETag"""
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    for value in header.split(','):
+        value = value.strip()
+        if value == '*' or value.removeprefix('W/').strip('"') == etag:
+            return True
+    return False
+
+
+async def cached_response(request, key, cache_control, compute):
+    """
+    Équivalent asynchrone de cached_response (app.py) : mêmes clés et mêmes corps,
+    le cache des réponses est partagé par les deux modes de service.
+    """
+    entry = response_cache.get(key()) if RESPONSE_CACHE else None
+    if entry is None:
+        status, headers, body = await compute()
+        if status != 200:
+            return status, headers, body
+        entry = response_cache.put(key(), body) if RESPONSE_CACHE else make_entry(body)
+
+    headers = [(b'content-type', b'application/json'),
+               (b'etag', f'"{entry.etag}"'.encode('latin-1')),
+               (b'cache-control', cache_control.encode('latin-1'))]
+    if etag_matches(request, entry.etag):
+        return 304, headers, b''
+    return 200, headers, entry.body
+
+
+async def similar_users_recommendations(request, user_email):
+    storage, async_storage = api.storage, get_async_storage()
+
+    # Utilisateur cible, précalcul et magasin des autres utilisateurs sont lus en même temps
+    with span('fetch'):
+        user_data, record, store = await asyncio.gather(
+            async_storage.get_user(user_email, USER_FIELDS),
+            fetch_precomputed(storage, async_storage, user_email),
+            asyncio.to_thread(get_user_feature_store, storage))
+    if user_data is None:
+        return json_response({'error': 'Utilisateur non trouvé'}, 404)
+
+    precomputed = check_precomputed(record, user_data) if PRECOMPUTED_RECOMMENDATIONS else None
+    if precomputed is not None:
+        top_recommendations = precomputed['similar_docs'][:10]
+        similar_users = precomputed['similar_users']
+    else:
+        top_recommendations, similar_users = await score(recommend_from_similar_users, user_email, user_data, store)
+
+    with span('serialization'):
+        return json_response(api.similar_users_payload(user_data, top_recommendations, similar_users,
+                                                       requested_fields(request)))
+
+
+def _result(task):
+    # Résultat d'une lecture terminée avant l'échéance, sinon None
+    if task.done() and not task.cancelled() and task.exception() is None:
+        return task.result()
+    return None
+
+
+def degraded_response(user_data, record, fields, reason):
+    """Équivalent asynchrone de degraded_user_response (app.py)"""
+    payload = api.degraded_user_payload(user_data, record, fields, reason)
+    if payload is None:
+        status, headers, body = json_response({'error': 'Service surchargé, réessayez plus tard', 'reason': reason},
+                                              503)
+        headers.append((b'retry-after', str(SHED_RETRY_AFTER).encode('latin-1')))
+    else:
+        status, headers, body = json_response(payload)
+    headers.append((b'cache-control', b'no-store'))
+    return status, headers, body
+
+
+async def user_recommendations(request, user_id):
+    storage, async_storage = api.storage, get_async_storage()
+    deadline = Deadline.start(request.headers.get('x-request-start'))
+    fields = requested_fields(request)
+    with api.user_admission.admit(deadline.waited) as admitted:
+        if not admitted:
+            return degraded_response(None, None, fields, 'overloaded')
+
+        with span('fetch'):
+            reads = [asyncio.ensure_future(read) for read in (
+                async_storage.get_user(user_id, USER_FIELDS),
+                fetch_precomputed(storage, async_storage, user_id),
+                asyncio.to_thread(get_book_feature_table, storage),
+                asyncio.to_thread(get_user_feature_store, storage))]
+            try:
+                user_data, record, table, store = await deadline.wait(asyncio.gather(*reads))
+            except DeadlineExceeded:
+                return degraded_response(_result(reads[0]), _result(reads[1]), fields, 'deadline')
+        if user_data is None:
+            return json_response({'error': 'Utilisateur non trouvé'}, 404)
+
+        async def compute():
+            user_preferences = extract_user_preferences(user_data)
+            precomputed = check_precomputed(record, user_data) if PRECOMPUTED_RECOMMENDATIONS else None
+            recommendations = precomputed_books(precomputed, table) if precomputed is not None else None
+            if recommendations is not None:
+                recommendations = recommendations[:10]
+                similar_users_count = precomputed['similar_users_count']
+            else:
+                recommendations, similar_users_count = await deadline.wait(
+                    score(recommend_books, user_id, user_preferences, store, table))
+
+            with span('serialization'):
+                return json_response(api.user_recommendations_payload(user_preferences, recommendations,
+                                                                      similar_users_count, fields))
+
+        fingerprint = user_fingerprint(user_data)
+        def key():
+            return ('user', user_id, tuple(fields or ()), fingerprint, user_feature_store_version(), table.version)
+        try:
+            return await cached_response(request, key, f'private, max-age={RESPONSE_CACHE_MAX_AGE}', compute)
+        except DeadlineExceeded:
+            return degraded_response(user_data, record, fields, 'deadline')
+
+
+async def popular_books(request):
+    window = request.query.get('window', [ALL_TIME])[0]
+    if window != ALL_TIME and window not in POPULARITY_WINDOWS:
+        return json_response({'error': f"Fenêtre inconnue : {window}"}, 400)
+
+    storage = api.storage
+    popularity_index, table = await asyncio.gather(
+        asyncio.to_thread(get_popularity_index, storage),
+        asyncio.to_thread(get_book_feature_table, storage))
+    fields = requested_fields(request)
+
+    async def compute():
+        payload = await score(api.popular_books_payload, popularity_index, table, window, fields)
+        with span('serialization'):
+            return json_response(payload)
+
+    def key():
+        return ('popular', None, (window, tuple(fields or ())), popularity_index.version, table.version)
+    return await cached_response(request, key, f'public, max-age={RESPONSE_CACHE_MAX_AGE}', compute)
+
+
+# Routes servies nativement (règle Flask pour les métriques, motif du chemin, fonction) ;
+# les autres requêtes sont transmises à l'application Flask
+ROUTES = [
+    ('/recommendations/similar-users/<user_email>', re.compile(r'/recommendations/similar-users/([^/]+)'),
+     similar_users_recommendations),
+    ('/recommendations/user/<user_id>', re.compile(r'/recommendations/user/([^/]+)'), user_recommendations),
+    ('/recommendations/popular', re.compile(r'/recommendations/popular'), popular_books),
+]
+
+
+def match_route(method, path):
+    """Retourne (règle, fonction, paramètres du chemin) d'une route native, ou None"""
+    if method not in ('GET', 'HEAD'):
+        return None
+    for rule, pattern, handler in ROUTES:
+        match = pattern.fullmatch(path)
+        if match:
+            return rule, handler, match.groups()
+    return None
+
+
+async def send_response(send, status, headers, body, head=False):
+    headers = headers + CORS_HEADERS + [(b'content-length', str(len(body)).encode('latin-1'))]
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': b'' if head else body})
+
+
+async def handle_native(scope, send, rule, handler, params):
+    request = Request(scope['method'], scope['path'], parse_qs(scope['query_string'].decode('latin-1')),
+                      {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']})
+    token = start_request(rule)
+    try:
+        status, headers, body = await handler(request, *params)
+    except Exception as e:
+        print(f"Erreur dans {handler.__name__}: {str(e)}")
+        status, headers, body = json_response({'error': str(e)}, 500)
+    trace = finish_request(token, request.method, status)
+    if trace is not None and trace.stages:
+        headers.append((b'server-timing', server_timing(trace).encode('latin-1')))
+    await send_response(send, status, headers, body, head=request.method == 'HEAD')
+
+
+def wsgi_environ(scope, body):
+    """Environnement WSGI (PEP 3333) d'une requête ASGI"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def handle_wsgi(scope, receive, send):
+    """
+    Transmet une requête à l'application Flask, exécutée sur un thread.
+    La réponse est itérée sur ce même thread (le contexte de stream_with_context y reste
+    valide) et chaque morceau est envoyé dès qu'il est produit : les réponses NDJSON
+    des endpoints /batch restent diffusées.
+    """
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    environ = wsgi_environ(scope, bytes(body))
+
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+    def run():
+        try:
+            result = api.app(environ, start_response)
+            try:
+                for chunk in result:
+                    if chunk:
+                        loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        finally:
+            loop.call_soon_threadsafe(chunks.put_nowait, None)
+
+    worker = asyncio.ensure_future(asyncio.to_thread(run))
+    chunk = await chunks.get()
+    if not started:
+        await worker
+        return
+    await send({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+    while chunk is not None:
+        if scope['method'] != 'HEAD':
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        chunk = await chunks.get()
+    await send({'type': 'http.response.body', 'body': b''})
+    await worker
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            _scoring_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """
+    Application ASGI : les routes de recommandation GET sont servies en asynchrone
+    (lectures Firestore concurrentes par AsyncClient, calcul des scores sur un exécuteur
+    borné) ; les autres routes sont servies par l'application Flask sur un thread.
+    """
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        raise ValueError(f"Type de connexion non pris en charge : {scope['type']}")
+
+    route = match_route(scope['method'], scope['path'])
+    if route is None:
+        await handle_wsgi(scope, receive, send)
+    else:
+        # Les routes natives ne passent pas par before_request : le préchauffage différé
+        # du démarrage rapide est lancé ici, comme pour les routes Flask
+        if api.FAST_STARTUP:
+            api.start_warm_up()
+        await handle_native(scope, send, *route)
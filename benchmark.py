@@ -0,0 +1,367 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+# Les mesures tournent sur le stockage en mémoire, sans Firebase
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+
+# Mesurer le calcul complet des routes : pas d'échéance ni de réponse dégradée, et pas de
+# cache des réponses (les requêtes chaudes répétées ne mesureraient que ses accès)
+os.environ.setdefault('REQUEST_BUDGET_MS', '0')
+os.environ.setdefault('RESPONSE_CACHE', '0')
+
+from synthetic_data import generate_storage
+
+# Échelles prédéfinies : (nombre de livres, nombre d'utilisateurs)
+SCALES = {
+    'small': (1000, 1000),
+    'medium': (100000, 50000),
+    'large': (1000000, 500000),
+}
+
+PERCENTILES = (50, 90, 95, 99)
+
+# Marge (en proportion) au-delà de laquelle une latence est considérée en régression
+DEFAULT_TOLERANCE = 0.2
+
+# Budget (en ms) de l'import de app.py en démarrage rapide
+IMPORT_BUDGET_MS = 400
+
+# Modes de démarrage dont l'import est mesuré : variables d'environnement de chacun
+STARTUP_MODES = {
+    'default': {},
+    'fast': {'FAST_STARTUP': '1', 'SWAGGER_UI': '0'},
+}
+
+
+def endpoint_requests(books, users, rng):
+    """
+    Générateurs de requêtes pour chaque endpoint mesuré :
+    {nom: fonction retournant (méthode, url, corps JSON)}.
+    """
+    book_ids = list(books)
+    user_ids = list(users)
+
+    def similar_books():
+        book_id = rng.choice(book_ids)
+        # Une requête sur deux par titre pour mesurer aussi la recherche du livre de base
+        if rng.random() < 0.5:
+            return 'POST', '/similarbooks', {'id': book_id, 'k': 5}
+        return 'POST', '/similarbooks', {'title': books[book_id]['name'], 'k': 5}
+
+    return {
+        'similarbooks': similar_books,
+        'similar_users': lambda: ('GET', f'/recommendations/similar-users/{rng.choice(user_ids)}', None),
+        'user_recommendations': lambda: ('GET', f'/recommendations/user/{rng.choice(user_ids)}', None),
+        'popular': lambda: ('GET', '/recommendations/popular', None),
+        'hybrid': lambda: ('GET', f'/recommendations/hybrid/{rng.choice(user_ids)}', None),
+    }
+
+
+def percentile(sorted_values, p):
+    """Percentile par interpolation linéaire d'une liste triée"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * p / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def peak_rss_mb():
+    """Mémoire résidente maximale du processus depuis son démarrage, en Mo"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss est en octets sur macOS et en kilo-octets ailleurs
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _call(client, method, url, body):
+    if method == 'POST':
+        return client.post(url, json=body)
+    return client.get(url)
+
+
+def measure_endpoint(client, make_request, n_requests):
+    """
+    Mesure un endpoint : la première requête (construction des index, allocations
+    suivies par tracemalloc) puis n_requests requêtes chaudes.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    response = _call(client, *make_request())
+    cold_ms = (time.perf_counter() - start) * 1000
+    cold_peak_alloc = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies = []
+    statuses = {str(response.status_code): 1}
+    started = time.perf_counter()
+    for _ in range(n_requests):
+        method, url, body = make_request()
+        start = time.perf_counter()
+        response = _call(client, method, url, body)
+        latencies.append((time.perf_counter() - start) * 1000)
+        statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        'requests': n_requests,
+        'cold_ms': cold_ms,
+        'cold_peak_alloc_mb': cold_peak_alloc / (1024 * 1024),
+        'mean_ms': sum(latencies) / len(latencies) if latencies else None,
+        'max_ms': latencies[-1] if latencies else None,
+        'throughput_rps': n_requests / elapsed if elapsed > 0 else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'status_codes': statuses,
+    }
+    for p in PERCENTILES:
+        result[f'p{p}_ms'] = percentile(latencies, p)
+    return result
+
+
+def measure_similar_users_recall(store, users, sample_size=100, k=5, seed=0):
+    """
+    Compare la recherche d'utilisateurs similaires par l'index LSH au parcours exact
+    sur un échantillon d'utilisateurs : rappel des k premiers (par id, et par score
+    pour ne pas pénaliser les ex-aequo), latences et nombre moyen de candidats.
+    """
+    sample = random.Random(seed).sample(users, min(sample_size, len(users)))
+    id_recall, score_recall, candidates = [], [], []
+    exact_s = approximate_s = 0.0
+    for user_id, user_data in sample:
+        start = time.perf_counter()
+        exact = store.most_similar(user_id, user_data, threshold=30.0, limit=k, exact=True)
+        exact_s += time.perf_counter() - start
+        start = time.perf_counter()
+        approximate = store.most_similar(user_id, user_data, threshold=30.0, limit=k, exact=False)
+        approximate_s += time.perf_counter() - start
+
+        rows = store.candidates(user_data)
+        candidates.append(0 if rows is None else len(rows))
+        if exact:
+            id_recall.append(len({row for row, _ in exact} & {row for row, _ in approximate}) / len(exact))
+            matched = sum(1 for (_, a), (_, b) in zip(exact, approximate) if a == b)
+            score_recall.append(matched / len(exact))
+
+    return {
+        'sample': len(sample),
+        'k': k,
+        'recall': sum(id_recall) / len(id_recall) if id_recall else None,
+        'score_recall': sum(score_recall) / len(score_recall) if score_recall else None,
+        'exact_mean_ms': exact_s / len(sample) * 1000 if sample else None,
+        'lsh_mean_ms': approximate_s / len(sample) * 1000 if sample else None,
+        'mean_candidates': sum(candidates) / len(candidates) if candidates else None,
+    }
+
+
+def measure_content_updates(books, n_edits=20, seed=0):
+    """
+    Applique n_edits modifications de description, une par une, à l'index de contenu
+    et compare leur durée à celle d'un réajustement complet ; l'écart des similarités
+    avec le réajustement (refit_error) est mesuré sur un échantillon de livres.
+    """
+    from content_index import ContentIndex, refit_error
+
+    catalog = [{"id": book_id, **book_data} for book_id, book_data in books.items() if 'name' in book_data]
+    started = time.perf_counter()
+    index = ContentIndex(catalog)
+    refit_s = time.perf_counter() - started
+
+    rng = random.Random(seed)
+    edited = rng.sample(catalog, min(n_edits, len(catalog)))
+    started = time.perf_counter()
+    for book in edited:
+        index = index.apply_changes([(book['id'], {**book, 'desc': (book.get('desc') or '') + ' mise à jour'})])
+    update_s = time.perf_counter() - started
+
+    sample = [book['id'] for book in rng.sample(catalog, min(50, len(catalog)))]
+    return {
+        'edits': len(edited),
+        'update_mean_ms': update_s / len(edited) * 1000 if edited else None,
+        'refit_ms': refit_s * 1000,
+        'idf_drift': index.idf_drift,
+        'refit_error': refit_error(index, sample),
+    }
+
+
+def run_scale(n_books, n_users, n_requests, seed=0, endpoints=None):
+    """Génère un jeu de données et mesure chaque endpoint dessus"""
+    import app as app_module
+    from collection_cache import invalidate_collection_caches
+    from user_features import get_user_feature_store
+
+    started = time.perf_counter()
+    storage = generate_storage(n_books, n_users, seed=seed)
+    generation_s = time.perf_counter() - started
+
+    # Servir l'application depuis le jeu de données et repartir d'index vides
+    app_module.storage = storage
+    invalidate_collection_caches(storage)
+
+    rng = random.Random(seed)
+    users = {user_id: data for user_id, data, _ in storage.stream_users()}
+    requests = endpoint_requests({book_id: data for book_id, data, _ in storage.stream_books()}, users, rng)
+    results = {}
+    with app_module.app.test_client() as client:
+        for name, make_request in requests.items():
+            if endpoints and name not in endpoints:
+                continue
+            results[name] = measure_endpoint(client, make_request, n_requests)
+            print(f"  {name}: p50={results[name]['p50_ms']:.2f} ms p95={results[name]['p95_ms']:.2f} ms "
+                  f"{results[name]['throughput_rps']:.1f} req/s (à froid {results[name]['cold_ms']:.0f} ms)")
+
+    # Rappel de l'index LSH des utilisateurs similaires par rapport au parcours exact
+    recall = measure_similar_users_recall(get_user_feature_store(storage), list(users.items()), seed=seed)
+    if recall['recall'] is not None:
+        print(f"  rappel LSH@{recall['k']}: {recall['recall']:.3f} ({recall['mean_candidates']:.0f} candidats, "
+              f"{recall['lsh_mean_ms']:.2f} ms contre {recall['exact_mean_ms']:.2f} ms exact)")
+
+    # Mises à jour incrémentales de l'index de contenu par rapport à un réajustement complet
+    content_updates = measure_content_updates({book_id: data for book_id, data, _ in storage.stream_books()},
+                                              seed=seed)
+    print(f"  mise à jour du contenu : {content_updates['update_mean_ms']:.2f} ms par livre contre "
+          f"{content_updates['refit_ms']:.0f} ms de réajustement (écart {content_updates['refit_error']:.4f})")
+
+    return {
+        'books': n_books,
+        'users': n_users,
+        'seed': seed,
+        'generation_s': generation_s,
+        'endpoints': results,
+        'similar_users_recall': recall,
+        'content_updates': content_updates,
+    }
+
+
+def measure_import_ms(env=None, runs=3):
+    """
+    Durée (en ms) de l'import de app.py dans un nouvel interpréteur, la meilleure de
+    `runs` mesures : c'est le temps de démarrage d'un worker avant sa première requête.
+    """
+    code = "import time; started = time.perf_counter(); import app; print(time.perf_counter() - started)"
+    durations = []
+    for _ in range(runs):
+        completed = subprocess.run([sys.executable, '-c', code], env={**os.environ, **(env or {})},
+                                   cwd=os.path.dirname(os.path.abspath(__file__)),
+                                   capture_output=True, text=True, check=True)
+        durations.append(float(completed.stdout.strip().splitlines()[-1]) * 1000)
+    return min(durations)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE, metrics=('p50_ms', 'p95_ms')):
+    """
+    Compare deux fichiers de résultats et retourne la liste des régressions :
+    latences et durées d'import qui dépassent celles de référence de plus de tolerance.
+    """
+    regressions = []
+    for mode, value in results.get('import_ms', {}).items():
+        reference_value = baseline.get('import_ms', {}).get(mode)
+        if reference_value and value > reference_value * (1 + tolerance):
+            regressions.append({'books': None, 'users': None, 'endpoint': f'import:{mode}', 'metric': 'import_ms',
+                                'baseline': reference_value, 'value': value})
+    baseline_runs = {(run['books'], run['users']): run for run in baseline.get('runs', [])}
+    for run in results.get('runs', []):
+        reference = baseline_runs.get((run['books'], run['users']))
+        if reference is None:
+            continue
+        for name, measures in run['endpoints'].items():
+            reference_measures = reference['endpoints'].get(name)
+            if reference_measures is None:
+                continue
+            for metric in metrics:
+                value, reference_value = measures.get(metric), reference_measures.get(metric)
+                if value is not None and reference_value and value > reference_value * (1 + tolerance):
+                    regressions.append({
+                        'books': run['books'],
+                        'users': run['users'],
+                        'endpoint': name,
+                        'metric': metric,
+                        'baseline': reference_value,
+                        'value': value,
+                    })
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mesure la latence, le débit et la mémoire des endpoints de recommandation")
+    parser.add_argument('--scale', action='append', choices=sorted(SCALES),
+                        help="Échelle prédéfinie (répétable, défaut small)")
+    parser.add_argument('--books', type=int, help="Nombre de livres (remplace --scale)")
+    parser.add_argument('--users', type=int, help="Nombre d'utilisateurs (remplace --scale)")
+    parser.add_argument('--requests', type=int, default=200, help="Requêtes chaudes par endpoint")
+    parser.add_argument('--endpoint', action='append', help="Limiter aux endpoints nommés (répétable)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="Fichier JSON de résultats (défaut benchmark_results/<date>.json)")
+    parser.add_argument('--compare', help="Fichier de résultats de référence pour détecter les régressions")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--import-budget', type=float, default=IMPORT_BUDGET_MS,
+                        help="Durée maximale (ms) de l'import de app.py en démarrage rapide")
+    parser.add_argument('--import-runs', type=int, default=3, help="Mesures de l'import par mode de démarrage")
+    args = parser.parse_args(argv)
+
+    # Mesurer l'import avant que ce processus ne charge l'application
+    import_ms = {mode: measure_import_ms(env, args.import_runs) for mode, env in STARTUP_MODES.items()}
+    print("Import de app.py : " + ", ".join(f"{mode} {value:.0f} ms" for mode, value in import_ms.items()))
+
+    if args.books or args.users:
+        scales = [(args.books or SCALES['small'][0], args.users or SCALES['small'][1])]
+    else:
+        scales = [SCALES[name] for name in (args.scale or ['small'])]
+
+    runs = []
+    for n_books, n_users in scales:
+        print(f"{n_books} livres, {n_users} utilisateurs")
+        runs.append(run_scale(n_books, n_users, args.requests, seed=args.seed, endpoints=args.endpoint))
+
+    results = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'requests_per_endpoint': args.requests,
+        'import_ms': import_ms,
+        'import_budget_ms': args.import_budget,
+        'runs': runs,
+    }
+
+    output = args.output or os.path.join(
+        'benchmark_results', datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ') + '.json')
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Résultats écrits dans {output}")
+
+    failed = import_ms['fast'] > args.import_budget
+    if failed:
+        print(f"Budget d'import dépassé : {import_ms['fast']:.0f} ms > {args.import_budget:.0f} ms")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), tolerance=args.tolerance)
+        for regression in regressions:
+            scale = f" ({regression['books']} livres)" if regression['books'] is not None else ''
+            print(f"Régression {regression['endpoint']}{scale} : {regression['metric']} "
+                  f"{regression['baseline']:.2f} -> {regression['value']:.2f} ms")
+        failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+import bisect
+import copy
+import os
+
+import numpy as np
+
+from collection_cache import read_collection, subscribe
+from content_index import top_k_indices
+from index_cache import SharedIndex
+
+# Durée (en secondes) pendant laquelle la table des livres est servie sans relire le catalogue
+BOOK_FEATURES_TTL = float(os.getenv('BOOK_FEATURES_TTL', '300'))
+
+# Pondération des critères de calculate_book_score
+CATEGORY_WEIGHT = 3
+TYPE_WEIGHT = 2
+RATING_WEIGHT = 4
+AVAILABILITY_BONUS = 1
+
+
+def _code(vocabulary, value):
+    """Retourne le code entier d'une valeur hachable, en l'ajoutant au vocabulaire si besoin, ou -1"""
+    try:
+        code = vocabulary.get(value)
+    except TypeError:
+        return -1
+    if code is None:
+        code = vocabulary[value] = len(vocabulary)
+    return code
+
+
+def average_rating(book_data):
+    """Moyenne des notes des commentaires d'un livre, ou None s'il n'y en a pas"""
+    comments = book_data.get('commentaire')
+    if not isinstance(comments, list):
+        return None
+    notes = [c.get('note', 0) for c in comments if isinstance(c, dict)]
+    if not notes:
+        return None
+    try:
+        return float(sum(notes) / len(notes))
+    except TypeError:
+        return None
+
+
+def is_available(book_data):
+    """Indique si au moins un exemplaire du livre est disponible"""
+    try:
+        return 'exemplaire' in book_data and book_data['exemplaire'] > 0
+    except TypeError:
+        return False
+
+
+class BookFeatureTable:
+    """
+    Table compacte des caractéristiques de chaque livre du catalogue :
+    code de catégorie, code de type, note moyenne et disponibilité.
+    Permet de calculer le score de calculate_book_score pour tous les livres
+    et plusieurs jeux de préférences en une seule passe.
+    """
+
+    def __init__(self, books, version=None):
+        self.books = []
+        self.version = version
+        self.row_by_id = {}
+        self.rows_by_name = {}
+        self.category_codes = {}
+        self.type_codes = {}
+
+        self.active = np.empty(0, dtype=bool)
+        self.categories = np.empty(0, dtype=np.intp)
+        self.types = np.empty(0, dtype=np.intp)
+        self.rating_scores = np.empty(0)
+        self.availability_scores = np.empty(0)
+        self._patch((book['id'], book) for book in books)
+
+    def _patch(self, changes):
+        """
+        Écrit les caractéristiques des livres modifiés (id, données ou None si supprimé).
+        Les nouveaux livres sont ajoutés en fin de table ; un livre supprimé garde sa
+        ligne, marquée inactive, jusqu'à la prochaine reconstruction.
+        Les tableaux sont remplacés et non modifiés en place.
+        """
+        n_before = len(self.books)
+        updates = []
+        for book_id, book_data in dict(changes).items():
+            row = self.row_by_id.get(book_id)
+            if row is not None:
+                self._unindex_name(row)
+            if book_data is None:
+                if row is not None:
+                    del self.row_by_id[book_id]
+                    updates.append((row, None))
+                continue
+            if row is None:
+                row = len(self.books)
+                self.books.append(None)
+                self.row_by_id[book_id] = row
+            self.books[row] = {**book_data, "id": book_id}
+            self._index_name(row)
+            updates.append((row, self.books[row]))
+
+        grow = len(self.books) - n_before
+        active = np.concatenate([self.active, np.zeros(grow, dtype=bool)])
+        categories = np.concatenate([self.categories, np.full(grow, -1, dtype=np.intp)])
+        types = np.concatenate([self.types, np.full(grow, -1, dtype=np.intp)])
+        rating_scores = np.concatenate([self.rating_scores, np.zeros(grow)])
+        availability_scores = np.concatenate([self.availability_scores, np.zeros(grow)])
+
+        for row, book in updates:
+            active[row] = book is not None
+            if book is None:
+                continue
+            categories[row] = _code(self.category_codes, book['cathegorie']) if 'cathegorie' in book else -1
+            types[row] = _code(self.type_codes, book['type']) if 'type' in book else -1
+            rating = average_rating(book)
+            rating_scores[row] = 0.0 if rating is None else rating * RATING_WEIGHT
+            availability_scores[row] = AVAILABILITY_BONUS if is_available(book) else 0.0
+
+        self.active = active
+        self.categories = categories
+        self.types = types
+        self.rating_scores = rating_scores
+        self.availability_scores = availability_scores
+
+    def _unindex_name(self, row):
+        book = self.books[row]
+        if 'name' not in book:
+            return
+        try:
+            rows = [other for other in self.rows_by_name.get(book['name'], []) if other != row]
+        except TypeError:
+            return
+        if rows:
+            self.rows_by_name[book['name']] = rows
+        else:
+            del self.rows_by_name[book['name']]
+
+    def _index_name(self, row):
+        # Lignes de chaque nom dans l'ordre du catalogue, pour résoudre les titres populaires
+        book = self.books[row]
+        if 'name' not in book:
+            return
+        try:
+            rows = list(self.rows_by_name.get(book['name'], []))
+        except TypeError:
+            return
+        bisect.insort(rows, row)
+        self.rows_by_name[book['name']] = rows
+
+    def apply_changes(self, changes):
+        """Retourne une nouvelle table intégrant un lot de modifications du catalogue"""
+        patched = copy.copy(self)
+        patched.books = list(self.books)
+        patched.row_by_id = dict(self.row_by_id)
+        patched.rows_by_name = dict(self.rows_by_name)
+        patched.category_codes = dict(self.category_codes)
+        patched.type_codes = dict(self.type_codes)
+        patched._patch(changes)
+        return patched
+
+    def __len__(self):
+        return len(self.books)
+
+    def find_by_names(self, names):
+        """Résout une liste de noms en livres en une seule recherche ; None pour un nom inconnu"""
+        books = []
+        for name in names:
+            rows = self.rows_by_name.get(name)
+            books.append(self.books[rows[0]] if rows else None)
+        return books
+
+    def top(self, scores, k):
+        """Retourne les lignes des k meilleurs scores parmi les livres actifs"""
+        scores = np.where(self.active, scores, -np.inf)
+        rows = top_k_indices(scores, k)
+        return rows[np.isfinite(scores[rows])]
+
+    def _preference_matrix(self, counters, vocabulary):
+        # Une colonne supplémentaire à zéro reçoit les livres sans catégorie ou type (code -1)
+        matrix = np.zeros((len(counters), len(vocabulary) + 1))
+        for row, counter in enumerate(counters):
+            for value, count in counter.items():
+                code = vocabulary.get(value)
+                if code is not None:
+                    matrix[row, code] = count
+        return matrix
+
+    def scores(self, preferences_list):
+        """
+        Calcule le score de chaque livre pour chaque jeu de préférences.
+        Retourne une matrice (nombre de préférences × nombre de livres).
+        """
+        categories = self._preference_matrix([p['categories'] for p in preferences_list], self.category_codes)
+        types = self._preference_matrix([p['types'] for p in preferences_list], self.type_codes)
+
+        scores = categories[:, self.categories] * CATEGORY_WEIGHT
+        scores += types[:, self.types] * TYPE_WEIGHT
+        scores += self.rating_scores
+        scores += self.availability_scores
+        return scores
+
+
+def load_books(storage):
+    """Lit toute la collection BiblioInformatique et retourne (livres, version)"""
+    items, version = read_collection(storage, 'BiblioInformatique')
+    books = [{**book_data, "id": book_id} for book_id, book_data in items]
+    return books, version
+
+
+_book_feature_table = SharedIndex(load=load_books, build=BookFeatureTable, ttl=BOOK_FEATURES_TTL,
+                                  name='book_features')
+subscribe('BiblioInformatique', _book_feature_table)
+
+
+def get_book_feature_table(storage, ttl=None):
+    """
+    Retourne la table des caractéristiques des livres partagée par le processus.
+    Le catalogue n'est relu qu'après expiration du TTL.
+    """
+    return _book_feature_table.get(storage, ttl)
+
+
+def current_book_feature_table():
+    """Table partagée, sans relire le catalogue (None si elle n'est pas construite)"""
+    return _book_feature_table.current()
+
+
+def invalidate_book_feature_table():
+    """Force la relecture du catalogue au prochain appel de get_book_feature_table"""
+    _book_feature_table.invalidate()
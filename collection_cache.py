@@ -0,0 +1,267 @@
+import hashlib
+import os
+import threading
+import time
+
+from metrics import record_cache
+
+# Active le cache temps réel des collections (écouteurs on_snapshot)
+REALTIME_CACHE = os.getenv('REALTIME_CACHE', '1') == '1'
+
+# Durée (en secondes) pendant laquelle le cache reste servi après une déconnexion de l'écouteur
+CACHE_MAX_STALENESS = float(os.getenv('CACHE_MAX_STALENESS', '60'))
+
+# Nombre maximum de documents gardés en mémoire par collection
+CACHE_MAX_DOCUMENTS = int(os.getenv('CACHE_MAX_DOCUMENTS', '200000'))
+
+# Attente maximale (en secondes) du premier instantané au démarrage
+CACHE_INITIAL_TIMEOUT = float(os.getenv('CACHE_INITIAL_TIMEOUT', '30'))
+
+# Délai minimum (en secondes) entre deux tentatives de reconnexion de l'écouteur
+CACHE_RETRY_INTERVAL = float(os.getenv('CACHE_RETRY_INTERVAL', '30'))
+
+
+class CollectionCache:
+    """
+    Copie en mémoire d'une collection maintenue à jour par un écouteur (on_snapshot sur Firestore).
+    Chaque lot de modifications est transmis aux index dérivés abonnés pour qu'ils
+    se mettent à jour de façon incrémentale au lieu d'être reconstruits.
+    """
+
+    def __init__(self, name, max_documents=CACHE_MAX_DOCUMENTS, max_staleness=CACHE_MAX_STALENESS):
+        self.name = name
+        self.max_documents = max_documents
+        self.max_staleness = max_staleness
+        self.documents = {}
+        self.subscribers = []
+        self.generation = 0
+        self.sequence = 0
+        self.over_limit = False
+        self.disconnected_at = None
+        self._storage = None
+        self._watch = None
+        self._started_at = 0.0
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    @property
+    def version(self):
+        """Version des données : change à chaque lot de modifications ou redémarrage"""
+        return f"cache:{self.generation}:{self.sequence}"
+
+    def start(self, storage, wait=True):
+        """Démarre (ou redémarre) l'écouteur ; le premier instantané charge toute la collection"""
+        self.stop()
+        with self._lock:
+            self._storage = storage
+            self.generation += 1
+            self.sequence = 0
+            self.documents = {}
+            self.over_limit = False
+            self.disconnected_at = None
+            self._ready.clear()
+            self._started_at = time.monotonic()
+            generation = self.generation
+        self._watch = storage.listen(self.name, lambda changes: self._on_snapshot(generation, changes))
+        if wait:
+            self._ready.wait(CACHE_INITIAL_TIMEOUT)
+
+    def stop(self):
+        """Arrête l'écouteur ; les lectures repassent directement par Firestore"""
+        watch, self._watch = self._watch, None
+        if watch is not None:
+            try:
+                watch.unsubscribe()
+            except Exception as e:
+                print(f"Erreur lors de l'arrêt de l'écouteur {self.name}: {str(e)}")
+
+    def _on_snapshot(self, generation, changes):
+        batch = []
+        with self._lock:
+            # Ignorer les notifications tardives d'un écouteur remplacé
+            if generation != self.generation:
+                return
+            for document_id, data in changes:
+                if data is None:
+                    self.documents.pop(document_id, None)
+                else:
+                    self.documents[document_id] = data
+                batch.append((document_id, data))
+
+            if len(self.documents) > self.max_documents:
+                # Limite mémoire dépassée : abandonner le cache et revenir aux lectures directes
+                print(f"Cache {self.name}: plus de {self.max_documents} documents, cache désactivé")
+                self.over_limit = True
+                self.documents = {}
+                self._ready.set()
+                threading.Thread(target=self.stop, daemon=True).start()
+                return
+
+            initial = not self._ready.is_set()
+            previous_version = self.version
+            self.sequence += 1
+            self.disconnected_at = None
+            version = self.version
+
+        self._ready.set()
+        # Le premier instantané est la charge initiale : les index se construisent à la demande
+        if initial:
+            return
+        for subscriber in self.subscribers:
+            try:
+                subscriber.apply_changes(batch, previous_version, version)
+            except Exception as e:
+                print(f"Erreur lors de la mise à jour d'un index depuis {self.name}: {str(e)}")
+
+    @property
+    def listening(self):
+        watch = self._watch
+        return watch is not None and getattr(watch, 'is_active', True)
+
+    def serves(self, storage):
+        """Indique si le cache reflète ce stockage"""
+        return self._storage is storage
+
+    def usable(self):
+        """
+        Indique si le cache peut être servi : premier instantané reçu, limite mémoire
+        respectée et écouteur actif ou déconnecté depuis moins de max_staleness secondes.
+        """
+        if self.over_limit or not self._ready.is_set():
+            return False
+        if self.listening:
+            return True
+
+        now = time.monotonic()
+        if self.disconnected_at is None:
+            self.disconnected_at = now
+        self._maybe_restart(now)
+        return now - self.disconnected_at < self.max_staleness
+
+    def _maybe_restart(self, now):
+        if self._storage is None or now - self._started_at < CACHE_RETRY_INTERVAL:
+            return
+        self._started_at = now
+        threading.Thread(target=self._restart, daemon=True).start()
+
+    def _restart(self):
+        try:
+            self.start(self._storage, wait=False)
+        except Exception as e:
+            print(f"Erreur lors de la reconnexion de l'écouteur {self.name}: {str(e)}")
+
+    def get(self, document_id):
+        with self._lock:
+            return self.documents.get(document_id)
+
+    def items(self):
+        """Retourne les documents (id, données) triés par id, comme une lecture de la collection"""
+        with self._lock:
+            return sorted(self.documents.items(), key=lambda item: item[0])
+
+    def status(self):
+        return {
+            'documents': len(self.documents),
+            'ready': self._ready.is_set(),
+            'listening': self.listening,
+            'over_limit': self.over_limit,
+            'version': self.version,
+        }
+
+
+_caches = {
+    'BiblioInformatique': CollectionCache('BiblioInformatique'),
+    'BiblioUser': CollectionCache('BiblioUser'),
+    'BiblioRecommendations': CollectionCache('BiblioRecommendations'),
+}
+
+
+def subscribe(collection_name, index):
+    """Abonne un index dérivé (objet avec apply_changes) aux modifications d'une collection"""
+    _caches[collection_name].subscribers.append(index)
+
+
+def start_collection_caches(storage, wait=True):
+    """Charge les collections et démarre les écouteurs ; en cas d'échec, les lectures restent directes"""
+    for cache in _caches.values():
+        try:
+            cache.start(storage, wait=wait)
+        except Exception as e:
+            print(f"Impossible de démarrer l'écouteur {cache.name}: {str(e)}")
+
+
+def invalidate_collection_caches(storage):
+    """Recharge les collections et force la reconstruction de tous les index dérivés"""
+    for cache in _caches.values():
+        for subscriber in cache.subscribers:
+            subscriber.invalidate()
+    if REALTIME_CACHE:
+        start_collection_caches(storage)
+
+
+def collection_caches_status():
+    return {name: cache.status() for name, cache in _caches.items()}
+
+
+def usable_cache(storage, collection_name):
+    """Cache temps réel d'une collection s'il sert ce stockage et peut être lu, sinon None"""
+    cache = _caches.get(collection_name)
+    if cache is not None and cache.serves(storage) and cache.usable():
+        return cache
+    return None
+
+
+def derived_indexes_status():
+    """Index dérivés abonnés aux collections : {nom: construit ou non}"""
+    return {subscriber.name: subscriber.current() is not None
+            for cache in _caches.values() for subscriber in cache.subscribers}
+
+
+def read_collection(storage, collection_name, fields=None):
+    """
+    Retourne ([(id, données)], version) pour une collection : depuis le cache
+    temps réel s'il est utilisable, sinon par une lecture directe du stockage.
+    La version d'une lecture directe est une empreinte des ids et dates de mise à jour.
+    Une lecture directe ne récupère que les champs `fields` (tous si None) ; le cache,
+    partagé par tous les index, garde les documents complets.
+    """
+    cache = usable_cache(storage, collection_name)
+    if cache is not None:
+        record_cache(f'collection:{collection_name}', 'hit')
+        return cache.items(), cache.version
+
+    record_cache(f'collection:{collection_name}', 'miss')
+    items = []
+    fingerprint = hashlib.sha1()
+    for document_id, data, update_time in storage.stream(collection_name, fields):
+        items.append((document_id, data))
+        fingerprint.update(f"{document_id}:{update_time};".encode('utf-8'))
+    return items, fingerprint.hexdigest()
+
+
+def get_document(storage, collection_name, document_id, fields=None):
+    """
+    Retourne les données d'un document (ou None) : depuis le cache temps réel
+    s'il est utilisable, sinon par une lecture directe des champs `fields` du stockage.
+    """
+    cache = usable_cache(storage, collection_name)
+    if cache is not None:
+        record_cache(f'collection:{collection_name}', 'hit')
+        return cache.get(document_id)
+
+    record_cache(f'collection:{collection_name}', 'miss')
+    return storage.get(collection_name, document_id, fields)
+
+
+async def get_document_async(storage, async_storage, collection_name, document_id, fields=None):
+    """
+    Comme get_document, mais une lecture directe passe par le stockage asynchrone
+    `async_storage` (mode ASGI) ; `storage` identifie le stockage servi par le cache.
+    """
+    cache = usable_cache(storage, collection_name)
+    if cache is not None:
+        record_cache(f'collection:{collection_name}', 'hit')
+        return cache.get(document_id)
+
+    record_cache(f'collection:{collection_name}', 'miss')
+    return await async_storage.get(collection_name, document_id, fields)
@@ -0,0 +1,19 @@
+import os
+import tempfile
+
+import pytest
+
+# Les tests utilisent le stockage en mémoire : aucun accès à Firestore n'est nécessaire
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+
+# Les journaux de l'écriture différée de l'historique restent hors du dépôt
+os.environ.setdefault('HISTORY_LOG_DIR', tempfile.mkdtemp(prefix='history_log_'))
+
+
+@pytest.fixture(autouse=True)
+def empty_response_cache():
+    # Chaque test calcule ses réponses au lieu de servir celles d'un test précédent
+    from response_cache import response_cache
+    response_cache.clear()
+    yield
+    response_cache.clear()
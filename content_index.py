@@ -0,0 +1,577 @@
+import bisect
+import copy
+import difflib
+import heapq
+import os
+import time
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+from artifacts import ArtifactStore, sparse_arrays, sparse_matrix
+from collection_cache import read_collection, subscribe
+from index_cache import SharedIndex, replace_sparse_rows
+
+# Durée (en secondes) pendant laquelle l'index est servi sans revérifier le catalogue
+CONTENT_INDEX_TTL = float(os.getenv('CONTENT_INDEX_TTL', '300'))
+
+# Part du catalogue modifiée de façon incrémentale au-delà de laquelle le modèle est réajusté en arrière-plan
+CONTENT_REFIT_RATIO = float(os.getenv('CONTENT_REFIT_RATIO', '0.1'))
+
+# Écart relatif maximum entre les IDF courantes et celles qui pondèrent les lignes non modifiées
+# (termes encore présents) : au-delà, le modèle est réajusté en arrière-plan
+CONTENT_IDF_TOLERANCE = float(os.getenv('CONTENT_IDF_TOLERANCE', '0.1'))
+
+# Durée (en secondes) au-delà de laquelle un index modifié de façon incrémentale est réajusté en arrière-plan
+CONTENT_REBUILD_INTERVAL = float(os.getenv('CONTENT_REBUILD_INTERVAL', '3600'))
+
+# Nombre de lignes évaluées par produit matriciel dans les calculs par lots
+BATCH_CHUNK_SIZE = 256
+
+# À partir de ce nombre de livres, la recherche de similaires passe par l'index inversé
+CONTENT_INVERTED_MIN_BOOKS = int(os.getenv('CONTENT_INVERTED_MIN_BOOKS', '5000'))
+
+# Nombre maximum de titres parcourus dans les listes de trigrammes par recherche approchante
+TITLE_FUZZY_BUDGET = 20000
+
+# Nombre de titres partageant le plus de trigrammes avec la requête comparés par difflib
+TITLE_FUZZY_CANDIDATES = 50
+
+# Marge absorbant les erreurs d'arrondi dans la comparaison des bornes de score
+_BOUND_EPSILON = 1e-9
+
+
+def top_k_indices(scores, k):
+    """
+    Sélectionne les k meilleurs indices d'un vecteur de scores par sélection partielle.
+    Les ex-aequo sont départagés par indice croissant, comme un tri stable décroissant.
+    """
+    if k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.intp)
+    if k < scores.size:
+        kth = scores[np.argpartition(-scores, k - 1)[:k]].min()
+        # Garder tous les ex-aequo du k-ième score pour départager par indice
+        candidates = np.flatnonzero(scores >= kth)
+    else:
+        candidates = np.arange(scores.size)
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order][:k]
+
+
+def inverse_document_frequencies(df, n_documents):
+    """IDF lissées de TfidfVectorizer : ln((1 + n) / (1 + df)) + 1"""
+    idf = np.full_like(df, n_documents + 1, dtype=np.float64)
+    idf /= df + 1.0
+    np.log(idf, out=idf)
+    idf += 1.0
+    return idf
+
+
+def weigh(counts, idf):
+    """Lignes TF-IDF normalisées (L2) de comptes de termes, comme TfidfTransformer"""
+    from sklearn.preprocessing import normalize
+
+    weighted = counts.astype(np.float64, copy=True)
+    weighted.data *= idf[weighted.indices]
+    return normalize(weighted, norm='l2', copy=False)
+
+
+def normalize_title(title):
+    """Normalise un titre pour la recherche : sans accents, casse repliée, espaces compactés"""
+    text = unicodedata.normalize('NFKD', str(title))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(text.casefold().split())
+
+
+def title_trigrams(title):
+    """Trigrammes d'un titre normalisé, bordé d'espaces pour compter les débuts et fins de mots"""
+    padded = f'  {title} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ContentIndex:
+    """
+    Index de contenu construit une seule fois à partir du catalogue :
+    vectoriseur ajusté, matrice TF-IDF creuse et correspondance id <-> ligne.
+    Un index inversé (terme -> lignes et poids) est dérivé de la matrice au premier
+    besoin pour ne scorer que les livres qui peuvent entrer dans le top k.
+    Les comptes de termes et les fréquences documentaires (df) sont gardés : une
+    modification du catalogue ne recalcule que les lignes concernées et les IDF,
+    le vocabulaire étant complété par les nouveaux termes. Les autres lignes restent
+    pondérées par les IDF du dernier ajustement complet, jusqu'au suivant.
+    """
+
+    def __init__(self, books, version=None):
+        # scikit-learn n'est importé qu'à la première construction : le démarrage n'en paie pas le coût
+        from sklearn.feature_extraction.text import CountVectorizer
+
+        self._index_catalog(books, version)
+        # Mêmes comptes que TfidfVectorizer : la pondération est celle de weigh()
+        self.vectorizer = CountVectorizer(stop_words='english', dtype=np.float64)
+        self.matrix = None
+        self._inverted = None
+        if books:
+            counts = self.vectorizer.fit_transform([book.get('desc') or '' for book in books])
+            df = np.bincount(counts.indices, minlength=counts.shape[1]).astype(np.float64)
+            self._fit(counts, df, dict(self.vectorizer.vocabulary_))
+            self.matrix = weigh(counts, self.idf)
+
+    def _fit(self, counts, df, terms):
+        self.counts = counts
+        self.df = df
+        self.terms = terms
+        self.idf = inverse_document_frequencies(df, len(self))
+        # IDF de pondération des lignes non modifiées depuis l'ajustement
+        self.fitted_idf = self.idf
+        self.idf_drift = 0.0
+        self.fitted_at = time.monotonic()
+
+    def _index_catalog(self, books, version):
+        self.books = books
+        self.version = version
+        self.ids = [book['id'] for book in books]
+        self.row_by_id = {book_id: row for row, book_id in enumerate(self.ids)}
+        self.active = np.ones(len(books), dtype=bool)
+        self.patched_rows = 0
+        self._analyzer = None
+
+        # Index des titres normalisés : un titre peut correspondre à plusieurs lignes
+        self.rows_by_title = {}
+        for row, book in enumerate(books):
+            self.rows_by_title.setdefault(normalize_title(book['name']), []).append(row)
+        self.sorted_titles = sorted(self.rows_by_title)
+        self._title_grams = None
+
+    def to_artifact(self):
+        """
+        Tableaux et méta de l'index pour ArtifactStore : matrice TF-IDF, comptes de termes,
+        df, index inversé (construit d'avance sur un grand catalogue) et vectoriseur ajusté.
+        """
+        if self.matrix is None:
+            return {}, {'vectorizer': self.vectorizer}
+        arrays = {**sparse_arrays('matrix', self.matrix), **sparse_arrays('counts', self.counts), 'df': self.df}
+        meta = {'vectorizer': self.vectorizer, 'terms': self.terms, 'shape': self.matrix.shape}
+        if len(self.books) >= CONTENT_INVERTED_MIN_BOOKS:
+            postings, max_weights = self.inverted_index()
+            arrays.update(sparse_arrays('postings', postings), max_weights=max_weights)
+        return arrays, meta
+
+    @classmethod
+    def from_artifact(cls, books, version, arrays, meta):
+        """Index des livres `books` dont la matrice est lue (projetée en mémoire) depuis un artefact"""
+        index = cls.__new__(cls)
+        index._index_catalog(books, version)
+        index.vectorizer = meta['vectorizer']
+        index.matrix = None
+        index._inverted = None
+        if 'shape' in meta:
+            index._fit(sparse_matrix(arrays, 'counts', meta['shape']), arrays['df'], meta['terms'])
+            index.matrix = sparse_matrix(arrays, 'matrix', meta['shape'])
+        if 'postings_data' in arrays:
+            index._inverted = (sparse_matrix(arrays, 'postings', meta['shape'], 'csc'), arrays['max_weights'])
+        return index
+
+    def __len__(self):
+        return int(self.active.sum())
+
+    def _unindex_title(self, row):
+        title = normalize_title(self.books[row]['name'])
+        rows = [other for other in self.rows_by_title.get(title, []) if other != row]
+        if rows:
+            self.rows_by_title[title] = rows
+        else:
+            self.rows_by_title.pop(title, None)
+            position = bisect.bisect_left(self.sorted_titles, title)
+            if position < len(self.sorted_titles) and self.sorted_titles[position] == title:
+                del self.sorted_titles[position]
+            if self._title_grams is not None:
+                # Listes remplacées et non modifiées : l'index d'origine garde les siennes
+                for gram in title_trigrams(title):
+                    titles = self._title_grams.get(gram, set()) - {title}
+                    if titles:
+                        self._title_grams[gram] = titles
+                    else:
+                        self._title_grams.pop(gram, None)
+
+    def _index_title(self, row):
+        title = normalize_title(self.books[row]['name'])
+        rows = list(self.rows_by_title.get(title, []))
+        if not rows:
+            bisect.insort(self.sorted_titles, title)
+            if self._title_grams is not None:
+                for gram in title_trigrams(title):
+                    self._title_grams[gram] = self._title_grams.get(gram, set()) | {title}
+        bisect.insort(rows, row)
+        self.rows_by_title[title] = rows
+
+    def analyzer(self):
+        """Découpage d'un texte en termes du vectoriseur (minuscules, sans mots vides)"""
+        if self._analyzer is None:
+            self._analyzer = self.vectorizer.build_analyzer()
+        return self._analyzer
+
+    def count_terms(self, texts, grow=False):
+        """
+        Comptes de termes de textes sur le vocabulaire de l'index, comme vectorizer.transform.
+        Avec grow, les termes inconnus sont ajoutés au vocabulaire (nouvelles colonnes).
+        """
+        from scipy.sparse import csr_matrix
+
+        analyze = self.analyzer()
+        indptr, indices, data = [0], [], []
+        for text in texts:
+            counts = Counter()
+            for term in analyze(text):
+                column = self.terms.get(term)
+                if column is None:
+                    if not grow:
+                        continue
+                    column = self.terms[term] = len(self.terms)
+                counts[column] += 1
+            indices.extend(counts)
+            data.extend(counts.values())
+            indptr.append(len(indices))
+        counts = csr_matrix((np.array(data, dtype=np.float64), np.array(indices, dtype=np.int64), indptr),
+                            shape=(len(texts), len(self.terms)))
+        counts.sort_indices()
+        return counts
+
+    def transform(self, texts):
+        """Vecteurs TF-IDF de textes libres avec le vocabulaire et les IDF courants"""
+        return weigh(self.count_terms(texts), self.idf)
+
+    def apply_changes(self, changes):
+        """
+        Retourne un nouvel index intégrant un lot de modifications du catalogue
+        (id, données ou None si supprimé). Seules les lignes modifiées sont recalculées :
+        leurs comptes de termes mettent à jour les df, et elles sont pondérées par les
+        IDF qui en résultent. L'écart des IDF par rapport à celles des autres lignes est
+        suivi dans idf_drift ; needs_rebuild demande alors un réajustement complet.
+        """
+        if self.matrix is None:
+            return None
+
+        patched = copy.copy(self)
+        patched.books = list(self.books)
+        patched.ids = list(self.ids)
+        patched.row_by_id = dict(self.row_by_id)
+        patched.rows_by_title = dict(self.rows_by_title)
+        patched.sorted_titles = list(self.sorted_titles)
+        patched._title_grams = None if self._title_grams is None else dict(self._title_grams)
+        patched.terms = dict(self.terms)
+        active = list(self.active)
+
+        rows, descriptions = [], []
+        for book_id, data in dict(changes).items():
+            row = patched.row_by_id.get(book_id)
+            if row is not None:
+                patched._unindex_title(row)
+
+            # Un livre supprimé ou sans champ 'name' sort de l'index
+            if data is None or 'name' not in data:
+                if row is not None:
+                    del patched.row_by_id[book_id]
+                    active[row] = False
+                    rows.append(row)
+                    descriptions.append('')
+                continue
+
+            if row is None:
+                row = len(patched.books)
+                patched.books.append(None)
+                patched.ids.append(book_id)
+                patched.row_by_id[book_id] = row
+                active.append(True)
+
+            patched.books[row] = {"id": book_id, **data}
+            active[row] = True
+            patched._index_title(row)
+            rows.append(row)
+            descriptions.append(patched.books[row].get('desc') or '')
+
+        patched.active = np.array(active, dtype=bool)
+        if rows:
+            # Retirer des df les termes des anciennes versions des lignes, puis ajouter les nouveaux
+            counts = patched.count_terms(descriptions, grow=True)
+            df = np.zeros(len(patched.terms))
+            df[:len(self.df)] = self.df
+            previous = [row for row in rows if row < self.counts.shape[0]]
+            np.subtract.at(df, self.counts[previous].indices, 1.0)
+            np.add.at(df, counts.indices, 1.0)
+            patched.df = df
+            patched.idf = inverse_document_frequencies(df, len(patched))
+
+            n_rows = len(patched.books)
+            patched._inverted = None
+            patched.counts = replace_sparse_rows(self.counts, n_rows, rows, counts)
+            patched.matrix = replace_sparse_rows(self.matrix, n_rows, rows, weigh(counts, patched.idf))
+
+            # Les nouveaux termes sont comparés aux IDF de la première ligne pondérée avec eux ;
+            # les termes qui ne sont plus dans aucun livre ne pèsent sur aucune similarité
+            fitted = patched.fitted_idf = np.concatenate([self.fitted_idf, patched.idf[len(self.fitted_idf):]])
+            used = df > 0
+            drift = np.abs(patched.idf[used] - fitted[used]) / fitted[used]
+            patched.idf_drift = float(np.max(drift, initial=0.0))
+        patched.patched_rows = self.patched_rows + len(rows)
+        return patched
+
+    @property
+    def needs_rebuild(self):
+        """
+        Vrai si l'index modifié de façon incrémentale doit être réajusté : trop de lignes
+        modifiées, IDF trop éloignées de celles des lignes non modifiées, ou dernier
+        ajustement trop ancien.
+        """
+        if not self.patched_rows:
+            return False
+        return (self.patched_rows > CONTENT_REFIT_RATIO * max(1, len(self))
+                or self.idf_drift > CONTENT_IDF_TOLERANCE
+                or time.monotonic() - self.fitted_at > CONTENT_REBUILD_INTERVAL)
+
+    def rebuild_items(self):
+        """Livres actifs, dans l'ordre des lignes, pour réajuster l'index complètement"""
+        return [book for book, active in zip(self.books, self.active) if active]
+
+    def row_of(self, book_id):
+        """Retourne la ligne de la matrice correspondant à un id de document, ou None"""
+        return self.row_by_id.get(book_id)
+
+    def rows_for_title(self, title):
+        """Retourne les lignes dont le titre normalisé est identique, dans l'ordre du catalogue"""
+        return self.rows_by_title.get(normalize_title(title), [])
+
+    def find(self, book_id=None, title=None):
+        """
+        Retourne la ligne d'un livre désigné par son id ou par son titre.
+        Pour un titre partagé par plusieurs livres, la première ligne du catalogue est retenue.
+        """
+        if book_id:
+            return self.row_of(book_id)
+        rows = self.rows_for_title(title) if title else []
+        return rows[0] if rows else None
+
+    def search_titles(self, query, limit=10):
+        """
+        Retourne jusqu'à `limit` lignes dont le titre commence par la requête,
+        complétées par des titres approchants si les préfixes ne suffisent pas.
+        """
+        query = normalize_title(query)
+        if not query or limit <= 0:
+            return []
+
+        matches = []
+        start = bisect.bisect_left(self.sorted_titles, query)
+        for title in self.sorted_titles[start:]:
+            if not title.startswith(query) or len(matches) >= limit:
+                break
+            matches.append(title)
+
+        if len(matches) < limit:
+            for title in difflib.get_close_matches(query, self._fuzzy_candidates(query), n=limit, cutoff=0.6):
+                if title not in matches:
+                    matches.append(title)
+
+        rows = [row for title in matches for row in self.rows_by_title[title]]
+        return rows[:limit]
+
+    def title_grams(self):
+        """Listes des titres normalisés par trigramme, construites au premier besoin"""
+        grams = self._title_grams
+        if grams is None:
+            grams = {}
+            for title in self.sorted_titles:
+                for gram in title_trigrams(title):
+                    grams.setdefault(gram, set()).add(title)
+            self._title_grams = grams
+        return grams
+
+    def _fuzzy_candidates(self, query):
+        """
+        Titres partageant le plus de trigrammes avec la requête. Les listes sont parcourues
+        de la plus courte (trigrammes les plus discriminants) à la plus longue, dans la
+        limite de TITLE_FUZZY_BUDGET titres : le coût ne dépend pas de la taille du catalogue.
+        """
+        grams = self.title_grams()
+        postings = sorted((grams[gram] for gram in title_trigrams(query) if gram in grams), key=len)
+        shared, visited = Counter(), 0
+        for titles in postings:
+            if visited and visited + len(titles) > TITLE_FUZZY_BUDGET:
+                break
+            shared.update(titles)
+            visited += len(titles)
+        best = heapq.nsmallest(TITLE_FUZZY_CANDIDATES, shared.items(), key=lambda item: (-item[1], item[0]))
+        return [title for title, _ in best]
+
+    def _select(self, scores, row, k, min_score):
+        # Exclure le livre de base, les livres supprimés et les scores sous le seuil avant la sélection
+        if row is not None:
+            scores[row] = -np.inf
+        scores[~self.active] = -np.inf
+        scores[scores < min_score] = -np.inf
+        top = top_k_indices(scores, k)
+        top = top[np.isfinite(scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def inverted_index(self):
+        """
+        Retourne (postings, poids maximum par terme) : la matrice TF-IDF au format CSC,
+        dont chaque colonne liste les lignes contenant le terme et leur poids.
+        """
+        inverted = self._inverted
+        if inverted is None:
+            postings = self.matrix.tocsc()
+            postings.sort_indices()
+            max_weights = postings.max(axis=0).toarray().ravel()
+            inverted = self._inverted = (postings, max_weights)
+        return inverted
+
+    def _retrieve(self, query, row, k, min_score):
+        """
+        Top k exact d'un vecteur requête par l'index inversé, avec élagage sur bornes
+        (méthode MaxScore) : les listes des termes sont cumulées par contribution maximale
+        décroissante. Un livre absent des listes des m premiers termes ne peut dépasser la
+        somme des bornes des termes restants ; dès que cette somme passe sous le k-ième
+        score partiel, seuls les livres déjà rencontrés sont complétés par les autres termes.
+        """
+        postings, max_weights = self.inverted_index()
+        terms, weights = query.indices, query.data
+        bounds = weights * max_weights[terms]
+        order = np.argsort(-bounds, kind='stable')
+        terms, weights, bounds = terms[order], weights[order], bounds[order]
+        # remaining[m] : score maximum d'un livre qui ne contient aucun des m premiers termes
+        remaining = np.append(np.cumsum(bounds[::-1])[::-1], 0.0)
+
+        # Scores partiels (minorants des scores complets) ; les livres exclus restent à -inf
+        partial = np.zeros(len(self.books))
+        partial[~self.active] = -np.inf
+        if row is not None:
+            partial[row] = -np.inf
+        m, checkpoint = 0, 1
+        while m < len(terms):
+            start, end = postings.indptr[terms[m]], postings.indptr[terms[m] + 1]
+            # Les lignes d'une même liste sont distinctes : l'addition indexée est sûre
+            partial[postings.indices[start:end]] += weights[m] * postings.data[start:end]
+            m += 1
+            if m == checkpoint:
+                checkpoint *= 2
+                seen = partial[partial > 0]
+                kth = np.partition(seen, len(seen) - k)[len(seen) - k] if len(seen) >= k > 0 else -np.inf
+                if remaining[m] + _BOUND_EPSILON < max(kth, min_score):
+                    break
+
+        candidates = np.flatnonzero(partial > 0)
+        if len(candidates) < k and min_score <= 0:
+            # Trop peu de livres partagent un terme : les livres de score nul complètent le top k
+            return self._select((self.matrix @ query.T).toarray().ravel(), row, k, min_score)
+        # Scores complets des seuls livres rencontrés
+        scores = np.full(len(self.books), -np.inf)
+        scores[candidates] = self.matrix[candidates] @ query.toarray().ravel()
+        return self._select(scores, row, k, min_score)
+
+    def similar(self, row, k=5, min_score=0.0):
+        """
+        Retourne les k livres les plus proches de la ligne donnée sous forme de
+        liste de (ligne, score). Seule la ligne demandée est comparée à la matrice :
+        les lignes TF-IDF étant normalisées, le produit scalaire est la similarité cosinus.
+        Sur un grand catalogue, l'index inversé limite le calcul aux candidats utiles.
+        """
+        query = self.matrix[row]
+        if len(self.books) >= CONTENT_INVERTED_MIN_BOOKS:
+            return self._retrieve(query, row, k, min_score)
+        scores = (self.matrix @ query.T).toarray().ravel()
+        return self._select(scores, row, k, min_score)
+
+    def similar_to_text(self, text, k=5, min_score=0.0):
+        """
+        Retourne les k livres dont la description est la plus proche d'un texte libre,
+        projeté avec le vocabulaire et les IDF de l'index, sous forme de (ligne, score).
+        """
+        if self.matrix is None:
+            return []
+        query = self.transform([text])
+        if len(self.books) >= CONTENT_INVERTED_MIN_BOOKS:
+            return self._retrieve(query, None, k, min_score)
+        scores = (self.matrix @ query.T).toarray().ravel()
+        return self._select(scores, None, k, min_score)
+
+    def similar_batch(self, rows, k=5, min_score=0.0):
+        """
+        Variante par lots de similar(). Sur un grand catalogue, chaque ligne passe par l'index
+        inversé ; sinon les lignes de base sont comparées au catalogue par un produit de
+        matrices creuses par paquet de BATCH_CHUNK_SIZE lignes, gardé creux : le top k de
+        chaque ligne est choisi parmi ses seuls livres de score non nul (tranche indptr).
+        """
+        if len(self.books) >= CONTENT_INVERTED_MIN_BOOKS:
+            return [self._retrieve(self.matrix[row], row, k, min_score) for row in rows]
+
+        results = []
+        for start in range(0, len(rows), BATCH_CHUNK_SIZE):
+            chunk = list(rows[start:start + BATCH_CHUNK_SIZE])
+            products = (self.matrix[chunk] @ self.matrix.T).tocsr()
+            products.sort_indices()
+            for position, row in enumerate(chunk):
+                begin, end = products.indptr[position], products.indptr[position + 1]
+                results.append(self._select_sparse(products.indices[begin:end], products.data[begin:end],
+                                                   row, k, min_score))
+        return results
+
+    def _select_sparse(self, columns, scores, row, k, min_score):
+        """
+        Équivalent de _select pour les scores non nuls d'une ligne (colonnes croissantes).
+        Une ligne ayant moins de k livres de score positif est complétée par les livres
+        de score nul, comme _select, à partir de ses scores complets.
+        """
+        keep = (columns != row) & self.active[columns] & (scores >= min_score) & (scores > 0)
+        columns, scores = columns[keep], scores[keep]
+        if len(columns) < k and min_score <= 0:
+            return self._select((self.matrix @ self.matrix[row].T).toarray().ravel(), row, k, min_score)
+        top = top_k_indices(scores, k)
+        return [(int(columns[i]), float(scores[i])) for i in top]
+
+
+def refit_error(index, sample=None):
+    """
+    Écart maximum entre les similarités cosinus de l'index (mis à jour de façon
+    incrémentale) et celles d'un réajustement complet sur les mêmes livres, mesuré
+    depuis les livres `sample` (ids ; tous par défaut) vers tous les autres.
+    """
+    books = index.rebuild_items()
+    reference = ContentIndex(books)
+    ids = [book['id'] for book in books] if sample is None else list(sample)
+    if not ids or reference.matrix is None:
+        return 0.0
+    columns = [index.row_of(book_id) for book_id in reference.ids]
+    scores = (index.matrix[[index.row_of(book_id) for book_id in ids]] @ index.matrix[columns].T).toarray()
+    expected = (reference.matrix[[reference.row_of(book_id) for book_id in ids]] @ reference.matrix.T).toarray()
+    return float(np.abs(scores - expected).max())
+
+
+def load_catalog(storage):
+    """
+    Lit la collection BiblioInformatique et retourne (livres, version).
+    La version ne change que si le catalogue a été modifié.
+    """
+    items, version = read_collection(storage, 'BiblioInformatique')
+    # Ignorer les livres sans champ 'name'
+    books = [{"id": book_id, **book_data} for book_id, book_data in items if 'name' in book_data]
+    return books, version
+
+
+_content_index = SharedIndex(load=load_catalog, build=ContentIndex, ttl=CONTENT_INDEX_TTL,
+                             name='content_index', artifacts=ArtifactStore('content_index', ContentIndex))
+subscribe('BiblioInformatique', _content_index)
+
+
+def get_content_index(storage, ttl=None):
+    """
+    Retourne l'index de contenu partagé par le processus.
+    Le catalogue n'est relu qu'après expiration du TTL, et le modèle n'est
+    réajusté que si la version du catalogue a changé.
+    """
+    return _content_index.get(storage, ttl)
+
+
+def invalidate_content_index():
+    """Force la relecture du catalogue au prochain appel de get_content_index"""
+    _content_index.invalidate()
@@ -0,0 +1,157 @@
+import asyncio
+import contextlib
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# Budget (en millisecondes) d'une requête de recommandation personnalisée, attente dans
+# la file du routeur comprise (en-tête X-Request-Start) ; 0 désactive les échéances
+REQUEST_BUDGET_MS = float(os.getenv('REQUEST_BUDGET_MS', '2000'))
+
+# Part du budget (en millisecondes) gardée pour servir le niveau dégradé et sérialiser la réponse
+DEGRADED_RESERVE_MS = float(os.getenv('DEGRADED_RESERVE_MS', '50'))
+
+# Nombre maximum de requêtes de recommandation en cours ou en attente par processus ;
+# au-delà, les requêtes sont délestées vers le niveau dégradé (0 : pas de limite)
+MAX_QUEUE_DEPTH = int(os.getenv('MAX_QUEUE_DEPTH', '64'))
+
+# Attente maximale (en millisecondes) dans la file du routeur (X-Request-Start) avant délestage :
+# seule mesure de la file avec des workers synchrones, qui ne traitent qu'une requête à la fois (0 : pas de limite)
+MAX_QUEUE_TIME_MS = float(os.getenv('MAX_QUEUE_TIME_MS', '1000'))
+
+# Délai (en secondes) conseillé aux clients délestés sans niveau dégradé disponible (Retry-After)
+SHED_RETRY_AFTER = int(os.getenv('SHED_RETRY_AFTER', '1'))
+
+# Threads exécutant les étapes soumises à une échéance (lectures, index, calcul des scores) ;
+# une étape abandonnée termine sur son thread sans bloquer la requête
+DEADLINE_WORKERS = int(os.getenv('DEADLINE_WORKERS', str(4 * (os.cpu_count() or 1))))
+
+# Attente dans la file au-delà de laquelle l'en-tête X-Request-Start est jugé incohérent (horloges décalées)
+IMPLAUSIBLE_QUEUE_TIME = 60.0
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class DeadlineExceeded(Exception):
+    """Le budget de la requête est épuisé avant la fin d'une étape"""
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=DEADLINE_WORKERS, thread_name_prefix='deadline')
+    return _executor
+
+
+def queue_time(request_start, now=None):
+    """
+    Temps (en secondes) passé par la requête dans la file du routeur, d'après l'en-tête
+    X-Request-Start (t=secondes, millisecondes ou microsecondes depuis l'époque).
+    Retourne 0 si l'en-tête est absent ou incohérent.
+    """
+    if not request_start:
+        return 0.0
+    try:
+        started = float(request_start.strip().removeprefix('t='))
+    except ValueError:
+        return 0.0
+    # L'unité se déduit de l'ordre de grandeur de l'horodatage
+    if started > 1e14:
+        started /= 1e6
+    elif started > 1e11:
+        started /= 1e3
+    waited = (time.time() if now is None else now) - started
+    return waited if 0.0 <= waited <= IMPLAUSIBLE_QUEUE_TIME else 0.0
+
+
+class Deadline:
+    """
+    Échéance d'une requête : son budget moins l'attente dans la file et la réserve du
+    niveau dégradé. Les étapes coûteuses sont exécutées sur un thread ; si le budget
+    s'épuise avant leur fin, DeadlineExceeded est levée et la requête répond avec un
+    niveau dégradé pendant que l'étape termine en arrière-plan (un index construit
+    sert aux requêtes suivantes). Sans budget, les étapes sont appelées directement.
+    """
+
+    def __init__(self, budget, waited=0.0, reserve=0.0):
+        self.budget = budget
+        self.waited = waited
+        self.expires_at = None if budget is None else time.monotonic() + budget - waited - reserve
+
+    @classmethod
+    def start(cls, request_start=None):
+        """Échéance d'une nouvelle requête selon REQUEST_BUDGET_MS et son en-tête X-Request-Start"""
+        waited = queue_time(request_start)
+        if REQUEST_BUDGET_MS <= 0:
+            return cls(None, waited)
+        return cls(REQUEST_BUDGET_MS / 1000, waited, DEGRADED_RESERVE_MS / 1000)
+
+    def remaining(self):
+        """Temps restant en secondes (infini sans budget)"""
+        if self.expires_at is None:
+            return float('inf')
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def call(self, func, *args):
+        """Appelle func(*args) dans le contexte (métriques) de la requête, au plus jusqu'à l'échéance"""
+        if self.expires_at is None:
+            return func(*args)
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(func.__name__)
+        future = _get_executor().submit(contextvars.copy_context().run, func, *args)
+        try:
+            return future.result(timeout=remaining)
+        except FutureTimeoutError:
+            # Une étape pas encore commencée n'occupera pas de thread
+            future.cancel()
+            raise DeadlineExceeded(func.__name__)
+
+    async def wait(self, awaitable):
+        """Attend un awaitable au plus jusqu'à l'échéance (il est annulé au-delà)"""
+        if self.expires_at is None:
+            return await awaitable
+        try:
+            return await asyncio.wait_for(awaitable, timeout=self.remaining())
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded('wait')
+
+
+class AdmissionControl:
+    """
+    Admission d'une route au calcul complet, selon deux mesures de la file :
+    - sa profondeur dans le processus (requêtes en cours ou en attente), limitée à
+      `limit` : significative avec des workers à threads ou en mode ASGI ;
+    - l'attente de la requête dans la file du routeur avant d'atteindre le processus,
+      limitée à `max_wait` secondes : seule mesure visible d'un worker synchrone.
+    Une limite nulle ne s'applique pas.
+    """
+
+    def __init__(self, limit=None, max_wait=None):
+        self.limit = MAX_QUEUE_DEPTH if limit is None else limit
+        self.max_wait = MAX_QUEUE_TIME_MS / 1000 if max_wait is None else max_wait
+        self.depth = 0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def admit(self, waited=0.0):
+        """
+        Contexte d'une requête ayant attendu `waited` secondes dans la file du routeur :
+        vaut True si elle est admise, False si elle doit être délestée.
+        """
+        with self._lock:
+            admitted = ((self.limit <= 0 or self.depth < self.limit)
+                        and (self.max_wait <= 0 or waited <= self.max_wait))
+            if admitted:
+                self.depth += 1
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                with self._lock:
+                    self.depth -= 1
@@ -0,0 +1,227 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows : pas de verrou, les journaux orphelins ne sont pas repris
+    fcntl = None
+
+# Active l'écriture différée des notes de /user/<user_id>/history
+HISTORY_WRITE_BEHIND = os.getenv('HISTORY_WRITE_BEHIND', '1') == '1'
+
+# Nombre d'utilisateurs en attente qui déclenche une écriture groupée
+HISTORY_FLUSH_SIZE = int(os.getenv('HISTORY_FLUSH_SIZE', '500'))
+
+# Délai maximum (en secondes) entre une note acceptée et son écriture
+HISTORY_FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', '1.0'))
+
+# Répertoire des journaux des notes acceptées mais pas encore écrites
+HISTORY_LOG_DIR = os.getenv('HISTORY_LOG_DIR', 'history_log')
+
+# Force l'écriture du journal sur disque (fsync) avant d'accepter une note : survit à
+# un arrêt de la machine, et pas seulement à celui du processus
+HISTORY_LOG_FSYNC = os.getenv('HISTORY_LOG_FSYNC', '0') == '1'
+
+
+def _lock(file):
+    """Verrouille un journal ; retourne False s'il est déjà tenu par un autre écrivain"""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+class HistoryWriter:
+    """
+    File d'écriture différée des notes de lecture.
+    Les notes acceptées sont ajoutées à un journal local puis regroupées par
+    utilisateur (la dernière note d'un livre l'emporte) ; elles sont écrites par lots
+    quand flush_size utilisateurs sont en attente ou après flush_interval secondes.
+    Chaque écrivain tient un verrou sur ses journaux : au démarrage, les journaux
+    non verrouillés, laissés par un processus arrêté, sont relus et réécrits.
+    """
+
+    def __init__(self, storage, log_dir=HISTORY_LOG_DIR, flush_size=HISTORY_FLUSH_SIZE,
+                 flush_interval=HISTORY_FLUSH_INTERVAL, fsync=HISTORY_LOG_FSYNC):
+        self.storage = storage
+        self.log_dir = log_dir
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.subscribers = []
+        self._pending = {}
+        self._segments = []
+        self._segment = None
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = None
+
+        os.makedirs(log_dir, exist_ok=True)
+        recovered = self._recover()
+        self._open_segment()
+        if recovered:
+            print(f"Historique : {recovered} notes reprises des journaux d'un processus arrêté")
+            self._wake.set()
+
+    def _open_segment(self):
+        while True:
+            self._sequence += 1
+            path = os.path.join(self.log_dir, f"history-{os.getpid()}-{time.time_ns()}-{self._sequence}.log")
+            file = open(path, 'a', encoding='utf-8')
+            if _lock(file):
+                break
+            # Journal verrouillé par un autre écrivain (reprise au démarrage, nom partagé) :
+            # il le supprimera après son écriture, on en ouvre un autre
+            file.close()
+        self._segment = (path, file)
+
+    def _recover(self):
+        """Relit les journaux orphelins ; ils sont supprimés après la prochaine écriture réussie"""
+        count = 0
+        for path in sorted(glob.glob(os.path.join(self.log_dir, 'history-*.log'))):
+            try:
+                file = open(path, 'r+', encoding='utf-8')
+            except OSError:
+                continue
+            if not _lock(file):
+                file.close()
+                continue
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Dernière ligne tronquée par l'arrêt du processus : la note n'avait pas été acceptée
+                    continue
+                self._merge(entry['user_id'], entry['ratings'])
+                count += len(entry['ratings'])
+            self._segments.append((path, file))
+        return count
+
+    def _merge(self, user_id, ratings):
+        self._pending.setdefault(user_id, {}).update(ratings)
+
+    def submit(self, user_id, ratings):
+        """
+        Accepte des notes {id du livre: note} d'un utilisateur : elles sont écrites dans le
+        journal avant le retour, puis en base lors de la prochaine écriture groupée.
+        """
+        line = json.dumps({'user_id': user_id, 'ratings': ratings}, ensure_ascii=False) + '\n'
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("La file d'écriture de l'historique est fermée.")
+            file = self._segment[1]
+            file.write(line)
+            file.flush()
+            if self.fsync:
+                os.fsync(file.fileno())
+            self._merge(user_id, dict(ratings))
+            full = len(self._pending) >= self.flush_size
+        self._ensure_thread()
+        if full:
+            self._wake.set()
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Erreur lors de l'écriture groupée de l'historique: {str(e)}")
+
+    def flush(self):
+        """Écrit les notes en attente par lots ; retourne le nombre d'utilisateurs écrits"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                pending, self._pending = self._pending, {}
+                segments = self._segments + [self._segment]
+                self._segments = []
+                self._open_segment()
+
+            try:
+                self.storage.save_ratings_many(pending)
+            except Exception:
+                with self._lock:
+                    # Remettre en attente sans écraser les notes acceptées depuis
+                    for user_id, ratings in pending.items():
+                        self._pending[user_id] = {**ratings, **self._pending.get(user_id, {})}
+                    self._segments = segments + self._segments
+                raise
+
+            # Écritures confirmées : les journaux correspondants ne servent plus
+            for path, file in segments:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                file.close()
+
+        for subscriber in self.subscribers:
+            try:
+                subscriber(self.storage, pending)
+            except Exception as e:
+                print(f"Erreur lors de la notification d'une écriture de l'historique: {str(e)}")
+        return len(pending)
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def close(self):
+        """Écrit les notes en attente et arrête le thread d'écriture"""
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                self._closed = True
+                # Journal courant vide : rien à reprendre au prochain démarrage
+                path, file = self._segment
+                if not self._pending:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                    file.close()
+            self._wake.set()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_history_writer(storage, subscribers=()):
+    """
+    Retourne la file d'écriture du processus pour ce stockage, créée au premier appel
+    (les notes en attente d'un stockage précédent sont d'abord écrites).
+    `subscribers` reçoivent le stockage et chaque lot écrit {utilisateur: {livre: note}}.
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None or _writer.storage is not storage:
+            if _writer is not None:
+                # Les index partagés servent désormais l'autre stockage : ne plus les alimenter
+                _writer.subscribers.clear()
+                _writer.close()
+            _writer = HistoryWriter(storage)
+            _writer.subscribers.extend(subscribers)
+            atexit.register(_writer.close)
+        return _writer
@@ -0,0 +1,179 @@
+import os
+
+import numpy as np
+
+from metrics import span
+from popularity import ALL_TIME
+from recommendations import find_similar_users, preference_scores
+from user_features import extract_user_preferences
+
+# Signaux mélangés par les recommandations hybrides
+SIGNALS = ('content', 'preference', 'similar_users', 'popularity')
+
+# Poids par défaut de chaque signal (chaque signal est ramené entre 0 et 1 avant le mélange)
+HYBRID_WEIGHTS = {
+    'content': float(os.getenv('HYBRID_CONTENT_WEIGHT', '0.3')),
+    'preference': float(os.getenv('HYBRID_PREFERENCE_WEIGHT', '0.3')),
+    'similar_users': float(os.getenv('HYBRID_SIMILAR_USERS_WEIGHT', '0.25')),
+    'popularity': float(os.getenv('HYBRID_POPULARITY_WEIGHT', '0.15')),
+}
+
+# Nombre de livres les plus populaires pris en compte par le signal de popularité
+HYBRID_POPULAR_CANDIDATES = int(os.getenv('HYBRID_POPULAR_CANDIDATES', '1000'))
+
+
+def parse_weights(text):
+    """
+    Poids d'une requête au format signal:poids séparés par des virgules
+    (ex. content:0.5,popularity:0), complétés par les poids par défaut.
+    Lève ValueError pour un signal inconnu ou un poids invalide.
+    """
+    weights = dict(HYBRID_WEIGHTS)
+    if not text:
+        return weights
+    for item in text.split(','):
+        name, _, value = item.partition(':')
+        name = name.strip()
+        if name not in weights:
+            raise ValueError(f"Signal inconnu : {name}")
+        try:
+            weight = float(value)
+        except ValueError:
+            raise ValueError(f"Poids invalide pour {name} : {value}")
+        if not np.isfinite(weight) or weight < 0:
+            raise ValueError(f"Poids invalide pour {name} : {value}")
+        weights[name] = weight
+    return weights
+
+
+def read_names(user_data):
+    """Noms des documents consultés par un utilisateur (docRecent et docRecentRegarder)"""
+    names = []
+    for field in ('docRecent', 'docRecentRegarder'):
+        docs = user_data.get(field, [])
+        if not isinstance(docs, list):
+            continue
+        for doc in docs:
+            if isinstance(doc, dict) and getattr(type(doc.get('nameDoc')), '__hash__', None) is not None:
+                names.append(doc['nameDoc'])
+    return names
+
+
+def _first_rows(table, names):
+    # Première ligne du catalogue de chaque nom connu, comme find_by_names
+    rows = []
+    for name in names:
+        matches = table.rows_by_name.get(name)
+        if matches:
+            rows.append(matches[0])
+    return rows
+
+
+def _normalized(scores, active):
+    scores = np.where(active, scores, 0.0)
+    top = scores.max(initial=0.0)
+    return scores / top if top > 0 else scores
+
+
+_content_rows = (None, None, None)
+
+
+def content_rows(index, table):
+    """Ligne de la table des livres de chaque ligne de l'index de contenu (-1 si absente), gardée pour la paire"""
+    global _content_rows
+    cached_index, cached_table, rows = _content_rows
+    if cached_index is not index or cached_table is not table:
+        rows = np.array([table.row_by_id.get(book_id, -1) for book_id in index.ids], dtype=np.intp)
+        _content_rows = (index, table, rows)
+    return rows
+
+
+def content_signal(index, table, names):
+    """Similarité cosinus de chaque livre avec le profil TF-IDF des livres lus par l'utilisateur"""
+    scores = np.zeros(len(table))
+    if index.matrix is None:
+        return scores
+    read = [row for name in set(names) if isinstance(name, str) for row in index.rows_for_title(name)[:1]]
+    read = [row for row in read if index.active[row]]
+    if not read:
+        return scores
+    profile = np.asarray(index.matrix[read].sum(axis=0)).ravel()
+    similarities = index.matrix @ profile
+    rows = content_rows(index, table)
+    mapped = (rows >= 0) & index.active
+    scores[rows[mapped]] = similarities[mapped]
+    return scores
+
+
+def similar_users_signal(user_id, user_data, store, table):
+    """
+    Livres consultés (docRecent) par les 5 utilisateurs les plus similaires (au moins 30%),
+    pondérés par leur similarité. Retourne (scores, [(id, similarité)]).
+    """
+    scores = np.zeros(len(table))
+    similar_users = store.most_similar(user_id, user_data, threshold=30.0, limit=5)
+    for row, similarity in similar_users:
+        names = read_names({'docRecent': store.recent_documents(row)})
+        for book_row in _first_rows(table, dict.fromkeys(names)):
+            scores[book_row] += similarity / 100.0
+    return scores, [{'user_id': store.ids[row], 'similarity': similarity} for row, similarity in similar_users]
+
+
+def popularity_signal(popularity, table, window=ALL_TIME):
+    """Nombre de consultations des livres les plus populaires de la fenêtre"""
+    scores = np.zeros(len(table))
+    for name, count in popularity.most_common(HYBRID_POPULAR_CANDIDATES, window=window):
+        rows = table.rows_by_name.get(name)
+        if rows:
+            scores[rows[0]] += count
+    return scores
+
+
+def recommend_hybrid(user_id, user_data, table, index, store, popularity, limit=10, weights=None, window=ALL_TIME):
+    """
+    Recommandations hybrides d'un utilisateur en une passe sur les index partagés :
+    contenu (profil TF-IDF des livres lus), préférences (score de /recommendations/user
+    avec le bonus des utilisateurs aux préférences proches), livres lus par les
+    utilisateurs similaires et popularité. Chaque signal est ramené entre 0 et 1 puis
+    mélangé selon `weights` ; les livres déjà consultés sont exclus et chaque titre
+    n'apparaît qu'une fois.
+    Retourne (livres recommandés avec leur score et leurs signaux, utilisateurs similaires).
+    """
+    weights = HYBRID_WEIGHTS if weights is None else weights
+    names = read_names(user_data)
+
+    with span('scoring'):
+        preferences = extract_user_preferences(user_data)
+        similar = find_similar_users(user_id, preferences, store)
+        _, _, preference = preference_scores([preferences], [similar], store, table)[0]
+        similar_users, similar_users_list = similar_users_signal(user_id, user_data, store, table)
+        signals = {
+            'content': content_signal(index, table, names),
+            'preference': preference,
+            'similar_users': similar_users,
+            'popularity': popularity_signal(popularity, table, window),
+        }
+        signals = {name: _normalized(scores, table.active) for name, scores in signals.items()}
+        final = sum(weights[name] * signals[name] for name in SIGNALS)
+
+        # Exclure les livres déjà consultés
+        seen = [row for name in dict.fromkeys(names) for row in table.rows_by_name.get(name, [])]
+        final[seen] = -np.inf
+
+    with span('ranking'):
+        recommendations, titles = [], set()
+        # Marge pour les titres en double, écartés après la sélection
+        for row in table.top(final, 2 * limit):
+            if len(recommendations) >= limit:
+                break
+            book = table.books[row]
+            title = book.get('name')
+            key = title if getattr(type(title), '__hash__', None) is not None else row
+            if key in titles:
+                continue
+            titles.add(key)
+            book_data = dict(book)
+            book_data['score'] = float(final[row])
+            book_data['signals'] = {name: float(signals[name][row]) for name in SIGNALS}
+            recommendations.append(book_data)
+    return recommendations, similar_users_list
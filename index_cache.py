@@ -0,0 +1,232 @@
+import threading
+import time
+
+import numpy as np
+
+from artifacts import ARTIFACTS_REPUBLISH_DELAY
+from metrics import record_cache, span
+
+
+def replace_sparse_rows(matrix, n_rows, rows, values):
+    """
+    Retourne une copie CSR de `matrix` agrandie à n_rows lignes, dans laquelle chaque
+    ligne de `rows` est remplacée par la ligne correspondante de `values`.
+    """
+    from scipy.sparse import csr_matrix, diags
+
+    n_cols = max(matrix.shape[1], values.shape[1])
+    base = matrix.tocsr(copy=True)
+    base.resize((n_rows, n_cols))
+    keep = np.ones(n_rows)
+    keep[rows] = 0.0
+    base = diags(keep) @ base
+
+    values = values.tocsr(copy=True)
+    values.resize((len(rows), n_cols))
+    placement = csr_matrix((np.ones(len(rows)), (rows, np.arange(len(rows)))), shape=(n_rows, len(rows)))
+
+    result = (base + placement @ values).tocsr()
+    result.eliminate_zeros()
+    return result
+
+
+class SharedIndex:
+    """
+    Index dérivé partagé par le processus.
+    La collection source n'est relue qu'après expiration du TTL, et l'index
+    n'est reconstruit que si la version retournée par le chargeur a changé.
+    Si `update` est fourni, l'index existant est mis à jour au lieu d'être reconstruit.
+    Si `artifacts` (ArtifactStore) est fourni, les reconstructions passent par ses versions
+    publiées, partagées par tous les processus.
+    `name` identifie l'index dans les métriques de cache.
+    Un index mis à jour de façon incrémentale peut demander un réajustement complet
+    (propriété needs_rebuild, méthode rebuild_items) : il est construit dans un thread
+    en arrière-plan, les modifications reçues entre-temps lui sont appliquées, puis il
+    remplace l'index courant d'un seul coup.
+    Avec des artefacts, un index modifié par les écouteurs (tableaux copiés dans la
+    mémoire du processus) est reconstruit de la même façon après ARTIFACTS_REPUBLISH_DELAY
+    secondes, depuis l'état lu de la collection : il redevient une version publiée,
+    projetée et partagée par tous les processus.
+    """
+
+    def __init__(self, load, build, ttl, update=None, name='index', artifacts=None):
+        self.name = name
+        self.load = load
+        self.build = build
+        self.update = update
+        self.artifacts = artifacts
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._index = None
+        self._checked_at = 0.0
+        self._patched = False
+        self._storage = None
+        self._rebuild_thread = None
+        self._rebuild_changes = None
+
+    def _is_fresh(self, ttl):
+        return self._index is not None and time.monotonic() - self._checked_at < ttl
+
+    def current(self):
+        """Index courant, sans le rafraîchir (None s'il n'est pas construit)"""
+        return self._index
+
+    @property
+    def version(self):
+        """Version de l'index courant, sans le rafraîchir (None s'il n'est pas construit)"""
+        index = self._index
+        return None if index is None else index.version
+
+    def _build(self, items, version):
+        if self.artifacts is None:
+            return self.build(items, version)
+        return self.artifacts.build(items, version, self.build)
+
+    def get(self, storage, ttl=None):
+        """Retourne l'index courant, en le rafraîchissant si le TTL est expiré"""
+        ttl = self.ttl if ttl is None else ttl
+        if self._is_fresh(ttl):
+            record_cache(self.name, 'hit')
+            return self._index
+
+        with self._lock:
+            # Un autre thread a pu rafraîchir l'index pendant l'attente du verrou
+            if self._is_fresh(ttl):
+                record_cache(self.name, 'hit')
+                return self._index
+
+            self._storage = storage
+            with span('fetch'):
+                items, version = self.load(storage)
+            if self._index is not None and self._index.version == version:
+                record_cache(self.name, 'revalidated')
+            else:
+                with span('feature_build'):
+                    self._abandon_rebuild()
+                    self._patched = False
+                    if self._index is None:
+                        record_cache(self.name, 'miss')
+                        self._index = self._build(items, version)
+                    elif self.update is not None:
+                        record_cache(self.name, 'update')
+                        self._index = self.update(self._index, items, version)
+                    else:
+                        record_cache(self.name, 'stale')
+                        self._index = self._build(items, version)
+            self._checked_at = time.monotonic()
+            self._schedule_rebuild()
+            return self._index
+
+    def apply_changes(self, changes, previous_version, version):
+        """
+        Applique un lot de modifications (id, données ou None si supprimé) à l'index courant.
+        L'index n'est mis à jour que s'il reflète exactement la version précédente de la
+        collection et sait se mettre à jour (méthode apply_changes retournant le nouvel index) ;
+        sinon il est abandonné et sera reconstruit au prochain appel de get.
+        """
+        with self._lock:
+            index = self._index
+            if index is None:
+                return
+            patch = getattr(index, 'apply_changes', None)
+            patched = patch(changes) if patch is not None and index.version == previous_version else None
+            if patched is None:
+                record_cache(self.name, 'invalidated')
+                self._abandon_rebuild()
+                self._index = None
+                self._patched = False
+                self._checked_at = 0.0
+                return
+            patched.version = version
+            record_cache(self.name, 'patched')
+            self._index = patched
+            self._patched = True
+            if self._rebuild_changes is not None:
+                self._rebuild_changes.append((changes, previous_version))
+            self._schedule_rebuild()
+
+    def _abandon_rebuild(self):
+        # L'index courant est remplacé par une construction complète : le réajustement en cours est inutile
+        self._rebuild_changes = None
+
+    def _schedule_rebuild(self):
+        # Appelé avec le verrou tenu : un seul réajustement à la fois
+        if self._rebuild_thread is not None:
+            return
+        if getattr(self._index, 'needs_rebuild', False):
+            target, args = self._rebuild, (self._index,)
+        elif self._patched and self.artifacts is not None and self.artifacts.enabled and self._storage is not None:
+            target, args = self._republish, (self._storage,)
+        else:
+            return
+        self._rebuild_changes = []
+        self._rebuild_thread = threading.Thread(target=target, args=args, name=f'{self.name}-rebuild', daemon=True)
+        self._rebuild_thread.start()
+
+    def _swap(self, rebuilt, changes):
+        # Appelé avec le verrou tenu : rejoue les modifications reçues pendant la construction.
+        # Retourne vrai si l'index a été remplacé
+        for batch, _ in changes:
+            rebuilt = rebuilt.apply_changes(batch) if rebuilt is not None else None
+        if rebuilt is None:
+            return False
+        rebuilt.version = self._index.version
+        self._index = rebuilt
+        self._patched = bool(changes)
+        record_cache(self.name, 'rebuilt')
+        return True
+
+    def _rebuild(self, source):
+        swapped = False
+        try:
+            rebuilt = self._build(source.rebuild_items(), source.version)
+            with self._lock:
+                if self._rebuild_changes is not None:
+                    swapped = self._swap(rebuilt, self._rebuild_changes)
+        except Exception as e:
+            print(f"Erreur lors du réajustement de l'index {self.name}: {str(e)}")
+        finally:
+            self._finish_rebuild(swapped)
+
+    def _republish(self, storage):
+        swapped = False
+        try:
+            # Regrouper les modifications rapprochées en une seule construction
+            time.sleep(ARTIFACTS_REPUBLISH_DELAY)
+            items, version = self.load(storage)
+            rebuilt = self._build(items, version)
+            with self._lock:
+                changes = self._rebuild_changes
+                if changes is None:
+                    return
+                # Ne rejouer que les modifications postérieures à l'état lu
+                versions = [previous_version for _, previous_version in changes] + [self._index.version]
+                # (sinon, la prochaine modification relance la publication)
+                if version in versions:
+                    swapped = self._swap(rebuilt, changes[versions.index(version):])
+        except Exception as e:
+            print(f"Erreur lors de la republication de l'index {self.name}: {str(e)}")
+        finally:
+            self._finish_rebuild(swapped)
+
+    def _finish_rebuild(self, swapped):
+        with self._lock:
+            self._rebuild_thread = None
+            self._rebuild_changes = None
+            # Des modifications rejouées sur l'index publié demandent une nouvelle publication
+            if swapped and self.artifacts is not None and self.artifacts.enabled:
+                self._schedule_rebuild()
+
+    def wait_for_rebuild(self, timeout=None):
+        """Attend la fin du réajustement en arrière-plan en cours, s'il y en a un"""
+        thread = self._rebuild_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def invalidate(self):
+        """Force la relecture de la collection au prochain appel de get"""
+        with self._lock:
+            self._abandon_rebuild()
+            self._index = None
+            self._patched = False
+            self._checked_at = 0.0
@@ -0,0 +1,251 @@
+import bisect
+import contextvars
+import os
+import threading
+import time
+
+# Active les compteurs, histogrammes et mesures par étape (désactivé : coût quasi nul)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+
+# Bornes (en secondes) des histogrammes de latence
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Bornes des histogrammes de nombre de documents lus par requête
+DOCUMENT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricCounter:
+    """Compteur Prometheus avec étiquettes"""
+
+    type = 'counter'
+
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, value=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + value
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}'
+                for labels, value in values]
+
+
+class MetricHistogram:
+    """Histogramme Prometheus avec étiquettes et bornes fixes"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        # Nombre d'observations par intervalle ; les cumuls sont calculés au rendu
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(label_values, (None, 0.0))
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+            counts[position] += 1
+            self._values[label_values] = (counts, total + value)
+
+    def count(self, *label_values):
+        counts, total = self._values.get(label_values, ((), 0.0))
+        return sum(counts)
+
+    def render(self):
+        with self._lock:
+            values = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        lines = []
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = (('le', _format_value(float(bound))),)
+                lines.append(f'{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.label_names, labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """Ensemble des métriques exposées au format texte de Prometheus"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUEST_DURATION = registry.register(MetricHistogram(
+    'recommendation_request_duration_seconds', "Durée des requêtes HTTP",
+    ('method', 'route', 'status')))
+STAGE_DURATION = registry.register(MetricHistogram(
+    'recommendation_stage_duration_seconds', "Durée des étapes de traitement d'une requête",
+    ('route', 'stage')))
+REQUEST_DOCUMENTS_READ = registry.register(MetricHistogram(
+    'recommendation_request_documents_read', "Documents lus dans le stockage par requête",
+    ('route',), buckets=DOCUMENT_BUCKETS))
+DOCUMENTS_READ = registry.register(MetricCounter(
+    'recommendation_storage_documents_read_total', "Documents lus dans le stockage",
+    ('collection',)))
+DOCUMENTS_WRITTEN = registry.register(MetricCounter(
+    'recommendation_storage_documents_written_total', "Documents écrits dans le stockage",
+    ('collection',)))
+CACHE_REQUESTS = registry.register(MetricCounter(
+    'recommendation_cache_requests_total', "Accès aux caches et index partagés, par résultat",
+    ('cache', 'result')))
+DEGRADED_RESPONSES = registry.register(MetricCounter(
+    'recommendation_degraded_responses_total', "Réponses servies par un niveau dégradé, par niveau et par cause",
+    ('route', 'tier', 'reason')))
+
+
+class RequestTrace:
+    """Mesures d'une requête en cours : route, étapes et documents lus"""
+
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.stages = []
+        self.documents_read = 0
+
+
+_current_trace = contextvars.ContextVar('recommendation_request_trace', default=None)
+
+
+class _Span:
+    __slots__ = ('stage', 'started')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration = time.perf_counter() - self.started
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.stages.append((self.stage, duration))
+        STAGE_DURATION.observe(duration, trace.route if trace is not None else '', self.stage)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(stage):
+    """Mesure la durée d'une étape (fetch, feature_build, scoring, ranking, serialization...)"""
+    if not METRICS_ENABLED:
+        return _NULL_SPAN
+    return _Span(stage)
+
+
+def start_request(route):
+    """Commence la mesure d'une requête ; retourne le jeton à passer à finish_request"""
+    if not METRICS_ENABLED:
+        return None
+    return _current_trace.set(RequestTrace(route))
+
+
+def finish_request(token, method, status):
+    """Termine la mesure d'une requête et retourne sa trace (None si les métriques sont désactivées)"""
+    if token is None:
+        return None
+    trace = _current_trace.get()
+    _current_trace.reset(token)
+    if trace is None:
+        return None
+    REQUEST_DURATION.observe(time.perf_counter() - trace.started, method, trace.route, str(status))
+    REQUEST_DOCUMENTS_READ.observe(trace.documents_read, trace.route)
+    return trace
+
+
+def server_timing(trace):
+    """En-tête Server-Timing détaillant les étapes d'une requête, en millisecondes"""
+    return ', '.join(f'{stage};dur={duration * 1000:.2f}' for stage, duration in trace.stages)
+
+
+def record_documents_read(collection_name, count):
+    if not METRICS_ENABLED or not count:
+        return
+    DOCUMENTS_READ.inc(collection_name, value=count)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.documents_read += count
+
+
+def record_documents_written(collection_name, count=1):
+    if METRICS_ENABLED:
+        DOCUMENTS_WRITTEN.inc(collection_name, value=count)
+
+
+def record_cache(cache_name, result):
+    """Compte un accès à un cache : hit, miss, refresh, update..."""
+    if METRICS_ENABLED:
+        CACHE_REQUESTS.inc(cache_name, result)
+
+
+def record_degraded(tier, reason):
+    """Compte une réponse dégradée (niveau servi : precomputed, popular, none ; cause : deadline, overloaded)"""
+    if METRICS_ENABLED:
+        trace = _current_trace.get()
+        DEGRADED_RESPONSES.inc(trace.route if trace is not None else '', tier, reason)
+
+
+def render_metrics():
+    return registry.render()
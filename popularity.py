@@ -0,0 +1,205 @@
+import os
+import threading
+import time
+from collections import Counter, deque
+
+import numpy as np
+
+from book_features import get_book_feature_table
+from collection_cache import subscribe
+from index_cache import SharedIndex
+from user_features import load_users
+from user_history import Vocabulary
+
+# Durée (en secondes) entre deux relectures de BiblioUser pour mettre à jour les compteurs
+POPULARITY_TTL = float(os.getenv('POPULARITY_TTL', '300'))
+
+# Fenêtres glissantes de popularité (en secondes), en plus du total
+POPULARITY_WINDOWS = {
+    '24h': 24 * 3600,
+    '7d': 7 * 24 * 3600,
+}
+ALL_TIME = 'all'
+
+# Seul l'historique récent des utilisateurs compte pour la popularité
+POPULARITY_FIELDS = ('docRecent',)
+
+
+def recent_names(user_data):
+    """Compte les noms de documents de docRecent d'un utilisateur"""
+    names = Counter()
+    docs = user_data.get('docRecent', [])
+    if not isinstance(docs, list):
+        return names
+    for doc in docs:
+        if isinstance(doc, dict) and 'nameDoc' in doc:
+            try:
+                names[doc['nameDoc']] += 1
+            except TypeError:
+                continue
+    return names
+
+
+class PopularityIndex:
+    """
+    Compteurs de popularité des livres maintenus de façon incrémentale.
+    Le total reflète les docRecent actuels de tous les utilisateurs ; les fenêtres
+    glissantes comptent les consultations ajoutées aux historiques depuis moins
+    de 24h ou 7 jours (telles qu'observées par ce processus).
+    L'historique de chaque utilisateur est gardé sous forme de paires (code, nombre),
+    les noms de documents étant internés dans un vocabulaire commun.
+    """
+
+    def __init__(self, users=(), version=None, windows=None):
+        self.version = version
+        self.windows = POPULARITY_WINDOWS if windows is None else windows
+        self._lock = threading.RLock()
+        self.names = Vocabulary()
+        self.histories = {}
+        self.counts = Counter()
+        self.window_counts = {name: Counter() for name in self.windows}
+        self._events = {name: deque() for name in self.windows}
+
+        # L'état initial n'a pas de date de consultation : seul le total est alimenté
+        for user_id, user_data in users:
+            self.set_history(user_id, user_data, record_events=False)
+
+    def _record(self, book_name, count, now):
+        for name in self.windows:
+            self._events[name].append((now, book_name, count))
+            self.window_counts[name][book_name] += count
+
+    def _expire(self, now):
+        for name, seconds in self.windows.items():
+            events, counts = self._events[name], self.window_counts[name]
+            while events and events[0][0] <= now - seconds:
+                _, book_name, count = events.popleft()
+                counts[book_name] -= count
+                if counts[book_name] <= 0:
+                    del counts[book_name]
+
+    def set_history(self, user_id, user_data, record_events=True, now=None):
+        """Applique la différence entre l'historique connu d'un utilisateur et le nouveau"""
+        now = time.time() if now is None else now
+        current = recent_names(user_data)
+        with self._lock:
+            self._apply(user_id, current, record_events, now)
+
+    def history(self, user_id):
+        """Noms de documents comptés pour un utilisateur"""
+        pairs = self.histories.get(user_id, ())
+        return Counter({self.names[code]: int(count) for code, count in pairs})
+
+    def _apply(self, user_id, current, record_events, now):
+        previous = self.history(user_id)
+        for book_name, count in current.items():
+            added = count - previous.get(book_name, 0)
+            if added > 0:
+                self.counts[book_name] += added
+                if record_events:
+                    self._record(book_name, added, now)
+        for book_name, count in previous.items():
+            removed = count - current.get(book_name, 0)
+            if removed > 0:
+                self.counts[book_name] -= removed
+                if self.counts[book_name] <= 0:
+                    del self.counts[book_name]
+
+        if current:
+            self.histories[user_id] = np.array([(self.names.code(book_name), count)
+                                                for book_name, count in current.items()], dtype=np.int32)
+        else:
+            self.histories.pop(user_id, None)
+
+    def record_interactions(self, book_names, now=None):
+        """
+        Compte des consultations observées hors de docRecent (notes de l'historique de
+        lecture) dans les fenêtres glissantes ; le total reste celui des docRecent.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            for book_name, count in Counter(book_names).items():
+                self._record(book_name, count, now)
+
+    def remove_user(self, user_id):
+        """Retire la contribution d'un utilisateur supprimé"""
+        self.set_history(user_id, {}, record_events=False)
+
+    def apply_changes(self, changes):
+        """Applique un lot de modifications de BiblioUser (id, données ou None si supprimé)"""
+        now = time.time()
+        with self._lock:
+            for user_id, user_data in changes:
+                if user_data is None:
+                    self.remove_user(user_id)
+                else:
+                    self.set_history(user_id, user_data, now=now)
+        return self
+
+    def refresh(self, users, version=None):
+        """Met à jour les compteurs à partir d'une nouvelle lecture de tous les utilisateurs"""
+        now = time.time()
+        seen = set()
+        with self._lock:
+            for user_id, user_data in users:
+                seen.add(user_id)
+                self.set_history(user_id, user_data, now=now)
+            for user_id in [user_id for user_id in self.histories if user_id not in seen]:
+                self.remove_user(user_id)
+            self.version = version
+        return self
+
+    def most_common(self, n, window=ALL_TIME, now=None):
+        """Retourne les n livres les plus consultés sur la fenêtre demandée, sous forme de (nom, nombre)"""
+        with self._lock:
+            if window == ALL_TIME:
+                return self.counts.most_common(n)
+            self._expire(time.time() if now is None else now)
+            return self.window_counts[window].most_common(n)
+
+
+_popularity_index = SharedIndex(
+    load=lambda storage: load_users(storage, POPULARITY_FIELDS),
+    build=PopularityIndex,
+    update=lambda index, users, version: index.refresh(users, version),
+    ttl=POPULARITY_TTL,
+    name='popularity',
+)
+subscribe('BiblioUser', _popularity_index)
+
+
+def get_popularity_index(storage, ttl=None):
+    """
+    Retourne les compteurs de popularité partagés par le processus.
+    Après expiration du TTL, BiblioUser est relu et seules les différences
+    d'historique sont appliquées aux compteurs.
+    """
+    return _popularity_index.get(storage, ttl)
+
+
+def current_popularity_index():
+    """Compteurs partagés, sans relire BiblioUser (None s'ils ne sont pas construits)"""
+    return _popularity_index.current()
+
+
+def record_rated_books(storage, ratings_by_user):
+    """
+    Reporte un lot de notes écrites {utilisateur: {id du livre: note}} dans les
+    fenêtres glissantes des compteurs, s'ils sont construits.
+    """
+    index = _popularity_index.current()
+    if index is None:
+        return
+    table = get_book_feature_table(storage)
+    names = []
+    for ratings in ratings_by_user.values():
+        for book_id in ratings:
+            row = table.row_by_id.get(book_id)
+            if row is not None and table.active[row]:
+                names.append(table.books[row].get('name'))
+    index.record_interactions(name for name in names if isinstance(name, str))
+
+
+def invalidate_popularity_index():
+    """Force la reconstruction des compteurs au prochain appel de get_popularity_index"""
+    _popularity_index.invalidate()
@@ -0,0 +1,172 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from dotenv import load_dotenv
+
+# Charger les variables d'environnement (avant les modules qui lisent leur configuration)
+load_dotenv()
+
+from book_features import BookFeatureTable, load_books
+from collection_cache import get_document
+from metrics import record_cache
+from recommendations import recommend_books, recommend_from_similar_users
+from storage import RECOMMENDATIONS_COLLECTION, STORAGE_DATA_PATH, MemoryStorage, create_storage, project_fields
+from user_features import USER_FIELDS, UserFeatureStore, extract_user_preferences, load_users
+
+# Servir les recommandations précalculées quand elles sont à jour
+PRECOMPUTED_RECOMMENDATIONS = os.getenv('PRECOMPUTED_RECOMMENDATIONS', '1') == '1'
+
+# Âge maximum (en secondes) d'un précalcul avant de revenir au calcul à la demande
+PRECOMPUTED_MAX_AGE = float(os.getenv('PRECOMPUTED_MAX_AGE', str(24 * 3600)))
+
+# Nombre de recommandations gardées par utilisateur et par endpoint
+PRECOMPUTE_TOP_N = 10
+
+# Nombre d'utilisateurs traités par tâche du pool de processus
+PRECOMPUTE_CHUNK_SIZE = 500
+
+# Version du format des documents de BiblioRecommendations
+RECORD_FORMAT = 2
+
+
+def user_fingerprint(user_data):
+    """
+    Empreinte des champs USER_FIELDS d'un utilisateur, pour détecter une modification
+    depuis le précalcul (les autres champs n'influencent pas les recommandations).
+    """
+    encoded = json.dumps(project_fields(user_data, USER_FIELDS), sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+
+def build_record(user_id, user_data, store, table, computed_at, top_n=PRECOMPUTE_TOP_N):
+    """
+    Document compact des recommandations d'un utilisateur : ids et scores des livres
+    de /recommendations/user, et documents et utilisateurs de /recommendations/similar-users.
+    """
+    books, similar_users_count = recommend_books(user_id, extract_user_preferences(user_data), store, table,
+                                                 limit=top_n)
+    similar_docs, similar_users = recommend_from_similar_users(user_id, user_data, store, limit=top_n)
+    return {
+        'format': RECORD_FORMAT,
+        'computed_at': computed_at,
+        'user_hash': user_fingerprint(user_data),
+        'books': [{
+            'id': book['id'],
+            'score': book['score'],
+            'base_score': book['base_score'],
+            'similarity_bonus': book['similarity_bonus'],
+        } for book in books],
+        'similar_users_count': similar_users_count,
+        'similar_users': similar_users,
+        'similar_docs': similar_docs,
+    }
+
+
+# Index construits une fois par processus du pool
+_worker_indexes = None
+
+
+def _init_worker(users, users_version, books, books_version):
+    global _worker_indexes
+    _worker_indexes = (UserFeatureStore(users, users_version), BookFeatureTable(books, books_version))
+
+
+def _compute_chunk(chunk, computed_at, top_n):
+    store, table = _worker_indexes
+    return {user_id: build_record(user_id, user_data, store, table, computed_at, top_n)
+            for user_id, user_data in chunk}
+
+
+def precompute_recommendations(storage, workers=None, top_n=PRECOMPUTE_TOP_N, chunk_size=PRECOMPUTE_CHUNK_SIZE):
+    """
+    Calcule les recommandations de tous les utilisateurs et les écrit dans
+    BiblioRecommendations. Le calcul est réparti sur `workers` processus
+    (par défaut le nombre de processeurs) ; workers=1 calcule dans le processus courant.
+    Retourne le nombre d'utilisateurs traités.
+    """
+    users, users_version = load_users(storage)
+    books, books_version = load_books(storage)
+    computed_at = time.time()
+    chunks = [users[start:start + chunk_size] for start in range(0, len(users), chunk_size)]
+
+    if workers == 1:
+        _init_worker(users, users_version, books, books_version)
+        for chunk in chunks:
+            storage.put_many(RECOMMENDATIONS_COLLECTION, _compute_chunk(chunk, computed_at, top_n))
+        return len(users)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(users, users_version, books, books_version)) as pool:
+        futures = [pool.submit(_compute_chunk, chunk, computed_at, top_n) for chunk in chunks]
+        for future in futures:
+            storage.put_many(RECOMMENDATIONS_COLLECTION, future.result())
+    return len(users)
+
+
+def read_precomputed(storage, user_id):
+    """Document précalculé d'un utilisateur, lu sans vérification (None si le précalcul est désactivé)"""
+    if not PRECOMPUTED_RECOMMENDATIONS:
+        return None
+    return get_document(storage, RECOMMENDATIONS_COLLECTION, user_id)
+
+
+def get_precomputed(storage, user_id, user_data):
+    """
+    Retourne le précalcul d'un utilisateur s'il est utilisable : format connu,
+    âge inférieur à PRECOMPUTED_MAX_AGE et document utilisateur inchangé ; sinon None.
+    """
+    if not PRECOMPUTED_RECOMMENDATIONS:
+        return None
+    return check_precomputed(read_precomputed(storage, user_id), user_data)
+
+
+def check_precomputed(record, user_data):
+    """Retourne le précalcul lu `record` s'il est utilisable pour ce document utilisateur, sinon None"""
+    if not record or record.get('format') != RECORD_FORMAT:
+        record_cache('precomputed', 'miss')
+        return None
+    if time.time() - record.get('computed_at', 0) > PRECOMPUTED_MAX_AGE \
+            or record.get('user_hash') != user_fingerprint(user_data):
+        record_cache('precomputed', 'stale')
+        return None
+    record_cache('precomputed', 'hit')
+    return record
+
+
+def precomputed_books(record, table):
+    """
+    Livres recommandés d'un précalcul, complétés par leurs données actuelles du catalogue.
+    Retourne None si l'un d'eux n'existe plus.
+    """
+    books = []
+    for entry in record['books']:
+        row = table.row_by_id.get(entry['id'])
+        if row is None:
+            return None
+        book_data = dict(table.books[row])
+        book_data['score'] = entry['score']
+        book_data['base_score'] = entry['base_score']
+        book_data['similarity_bonus'] = entry['similarity_bonus']
+        books.append(book_data)
+    return books
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Précalcule les recommandations de tous les utilisateurs")
+    parser.add_argument('--workers', type=int, default=None, help="Nombre de processus (défaut : nombre de processeurs)")
+    parser.add_argument('--top-n', type=int, default=PRECOMPUTE_TOP_N)
+    parser.add_argument('--chunk-size', type=int, default=PRECOMPUTE_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    storage = create_storage()
+    count = precompute_recommendations(storage, workers=args.workers, top_n=args.top_n,
+                                       chunk_size=args.chunk_size)
+    # En mémoire, les résultats sont réécrits dans le fichier JSONL chargé
+    if isinstance(storage, MemoryStorage) and STORAGE_DATA_PATH:
+        storage.dump_jsonl(STORAGE_DATA_PATH)
+    print(f"Recommandations précalculées pour {count} utilisateurs en {time.perf_counter() - started:.1f} s")
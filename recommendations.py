@@ -0,0 +1,152 @@
+import os
+
+import numpy as np
+
+from metrics import span
+
+# Nombre d'utilisateurs dont les livres sont scorés ensemble par recommend_books_batch
+# (la matrice de scores compte jusqu'à 6 lignes par utilisateur et une colonne par livre)
+SCORING_CHUNK_SIZE = 8
+
+# Nombre maximum de cellules (lignes de préférences × livres) d'une matrice de scores :
+# sur un grand catalogue, le paquet est réduit pour borner la mémoire (au moins un utilisateur)
+SCORING_MAX_CELLS = int(os.getenv('SCORING_MAX_CELLS', '4000000'))
+
+# Lignes de la matrice de scores par utilisateur : ses préférences et ses 5 utilisateurs similaires
+SCORING_ROWS_PER_USER = 6
+
+
+def find_similar_users(user_id, target_preferences, store):
+    """
+    Trouve des utilisateurs similaires basés sur leurs préférences de lecture,
+    à partir des préférences extraites par le magasin partagé : la similarité est
+    la somme des minimums des nombres de consultations par catégorie et par type.
+    Chaque utilisateur similaire est donné avec sa ligne dans le magasin
+    (store.user_preferences(ligne) donne ses préférences).
+    """
+    if not target_preferences:
+        return []
+
+    with span('similar_users'):
+        scores = store.preference_similarities(target_preferences)
+        own = store.row_by_id.get(user_id)
+        if own is not None:
+            scores[own] = 0
+        rows = np.flatnonzero(scores > 0)
+        # Tri par similarité décroissante, ordre du magasin pour les ex-aequo
+        rows = rows[np.lexsort((rows, -scores[rows]))]
+        similar_users = [{
+            'user_id': store.ids[row],
+            'similarity': int(scores[row]),
+            'row': int(row)
+        } for row in rows]
+    return similar_users
+
+
+def recommend_books(user_id, user_preferences, store, table, limit=10):
+    """
+    Recommandations de livres d'un utilisateur : score de ses préférences plus un
+    bonus pondéré par la similarité de ses 5 utilisateurs les plus proches.
+    Retourne (livres recommandés avec leurs scores, nombre d'utilisateurs similaires).
+    """
+    for _, recommendations, similar_users_count in recommend_books_batch([(user_id, user_preferences)],
+                                                                         store, table, limit):
+        return recommendations, similar_users_count
+
+
+def preference_scores(preferences_list, similar_users, store, table):
+    """
+    Scores de tous les livres pour chaque jeu de préférences et ses utilisateurs similaires
+    (résultats de find_similar_users), en un seul appel à table.scores.
+    Retourne [(score de base, bonus de similarité, score final)] dans l'ordre de preferences_list.
+    """
+    contributors = [similar[:5] for similar in similar_users]
+    scores = table.scores(list(preferences_list)
+                          + [store.user_preferences(u['row']) for similar in contributors for u in similar])
+    offset = len(preferences_list)
+    ranked = []
+    for position, similar in enumerate(contributors):
+        base_scores = scores[position]
+        # Bonus basé sur les préférences des utilisateurs similaires
+        similarity_bonus = np.zeros(len(table))
+        for sim_scores, similar_user in zip(scores[offset:offset + len(similar)], similar):
+            similarity_bonus += (sim_scores * similar_user['similarity']) / 10
+        offset += len(similar)
+        ranked.append((base_scores, similarity_bonus, base_scores + similarity_bonus))
+    return ranked
+
+
+def scoring_chunk_size(books_count, chunk_size=SCORING_CHUNK_SIZE):
+    """Taille de paquet bornée pour que la matrice de scores reste sous SCORING_MAX_CELLS"""
+    if SCORING_MAX_CELLS <= 0:
+        return chunk_size
+    return max(1, min(chunk_size, SCORING_MAX_CELLS // (SCORING_ROWS_PER_USER * max(1, books_count))))
+
+
+def recommend_books_batch(users, store, table, limit=10, chunk_size=SCORING_CHUNK_SIZE):
+    """
+    Variante par lots de recommend_books pour une liste de (id, préférences) : les
+    livres sont scorés pour chunk_size utilisateurs et leurs utilisateurs similaires
+    par un seul appel à table.scores.
+    Génère (id, livres recommandés, nombre d'utilisateurs similaires) dans l'ordre de users.
+    """
+    chunk_size = scoring_chunk_size(len(table), chunk_size)
+    for start in range(0, len(users), chunk_size):
+        chunk = users[start:start + chunk_size]
+        similar_users = [find_similar_users(user_id, preferences, store) for user_id, preferences in chunk]
+
+        # Scorer tous les livres pour les utilisateurs du paquet et leurs 5 utilisateurs les plus similaires
+        with span('scoring'):
+            ranked = preference_scores([preferences for _, preferences in chunk], similar_users, store, table)
+
+        # Prendre les meilleurs livres par sélection partielle
+        for (user_id, _), similar, (base_scores, similarity_bonus, final_scores) in zip(chunk, similar_users, ranked):
+            with span('ranking'):
+                recommendations = []
+                for i in table.top(final_scores, limit):
+                    book_data = dict(table.books[i])
+                    book_data['score'] = float(final_scores[i])
+                    book_data['base_score'] = float(base_scores[i])
+                    book_data['similarity_bonus'] = float(similarity_bonus[i])
+                    recommendations.append(book_data)
+            yield user_id, recommendations, len(similar)
+
+
+def recommend_from_similar_users(user_id, user_data, store, limit=10):
+    """
+    Documents consultés par les 5 utilisateurs les plus similaires (similarité d'au
+    moins 30%) et pas encore vus par l'utilisateur, pondérés par la similarité.
+    Retourne (documents recommandés, [(id, similarité)] des utilisateurs similaires).
+    """
+    with span('scoring'):
+        similar_users = [{
+            'user_id': store.ids[row],
+            'similarity': similarity,
+            'recent_docs': store.recent_documents(row)
+        } for row, similarity in store.most_similar(user_id, user_data, threshold=30.0, limit=5)]
+
+    # Obtenir les recommandations des utilisateurs similaires
+    with span('ranking'):
+        recommendations = []
+        seen_docs = {str(doc.get('nameDoc', '')) for doc in user_data.get('docRecent', []) if isinstance(doc, dict)}
+
+        for similar_user in similar_users:
+            # Pondérer les recommandations par la similarité
+            weight = float(similar_user['similarity']) / 100.0
+            for doc in similar_user['recent_docs']:
+                doc_name = str(doc.get('nameDoc', ''))
+                if doc_name and doc_name not in seen_docs:
+                    doc_copy = doc.copy()  # Créer une copie pour ne pas modifier l'original
+                    doc_copy['recommendation_score'] = weight * 100.0
+                    doc_copy['recommended_by'] = similar_user['user_id']
+                    doc_copy['similarity_score'] = similar_user['similarity']
+                    recommendations.append(doc_copy)
+                    seen_docs.add(doc_name)
+
+        # Trier les recommandations par score et garder les meilleures
+        recommendations.sort(key=lambda x: x.get('recommendation_score', 0), reverse=True)
+
+    return recommendations[:limit], [{
+        'user_id': u['user_id'],
+        'similarity': u['similarity']
+    } for u in similar_users]
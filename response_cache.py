@@ -0,0 +1,70 @@
+import hashlib
+import os
+import threading
+from collections import namedtuple
+
+from cachetools import TTLCache
+
+from metrics import record_cache
+
+# Active le cache des réponses de /recommendations/popular et /recommendations/user
+RESPONSE_CACHE = os.getenv('RESPONSE_CACHE', '1') == '1'
+
+# Nombre maximum de réponses gardées en mémoire (les moins récemment servies sont évincées)
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '1024'))
+
+# Durée de vie (en secondes) d'une réponse en cache, même si les données n'ont pas changé
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '60'))
+
+# Durée (en secondes) pendant laquelle les clients peuvent réutiliser une réponse (Cache-Control max-age)
+RESPONSE_CACHE_MAX_AGE = int(os.getenv('RESPONSE_CACHE_MAX_AGE', '30'))
+
+CachedResponse = namedtuple('CachedResponse', ['body', 'etag'])
+
+
+def make_entry(body):
+    """Réponse à mettre en cache : corps JSON et ETag (empreinte du corps)"""
+    return CachedResponse(body, hashlib.sha1(body).hexdigest())
+
+
+class ResponseCache:
+    """
+    Cache LRU/TTL borné des corps de réponse JSON.
+    Les clés sont des tuples (route, id de l'utilisateur ou None, paramètres, version
+    des données) : une nouvelle version des collections donne une nouvelle clé, et
+    les réponses d'un utilisateur peuvent être retirées dès que son historique change.
+    """
+
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+        record_cache('response', 'miss' if entry is None else 'hit')
+        return entry
+
+    def put(self, key, body):
+        entry = make_entry(body)
+        with self._lock:
+            self._cache[key] = entry
+        return entry
+
+    def invalidate_user(self, user_id):
+        """Retire les réponses en cache d'un utilisateur"""
+        with self._lock:
+            for key in [key for key in self._cache.keys() if key[1] == user_id]:
+                self._cache.pop(key, None)
+                record_cache('response', 'invalidated')
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._cache)
+
+
+response_cache = ResponseCache()
@@ -1,21 +1,27 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
 import os
 
-# Configuration de l'émulateur Firestore
-os.environ["FIRESTORE_EMULATOR_HOST"] = "localhost:8080"
+from storage import STORAGE_BACKEND, STORAGE_DATA_PATH, FirestoreStorage, MemoryStorage
 
-# Chemin vers le fichier service-account-key.json
-current_dir = os.path.dirname(os.path.abspath(__file__))
-cred = credentials.Certificate(os.path.join(current_dir, 'user-based', 'service-account-key.json'))
 
-# Initialisation de Firebase Admin
-if not firebase_admin._apps:
-    firebase_admin.initialize_app(cred, {
-        'projectId': 'syst-recommandation'
-    })
+def get_emulator_storage():
+    """Connexion à l'émulateur Firestore"""
+    import firebase_admin
+    from firebase_admin import credentials, firestore
 
-db = firestore.client()
+    # Configuration de l'émulateur Firestore
+    os.environ["FIRESTORE_EMULATOR_HOST"] = "localhost:8080"
+
+    # Chemin vers le fichier service-account-key.json
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    cred = credentials.Certificate(os.path.join(current_dir, 'user-based', 'service-account-key.json'))
+
+    # Initialisation de Firebase Admin
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(cred, {
+            'projectId': 'syst-recommandation'
+        })
+
+    return FirestoreStorage(firestore.client())
 
 # Données de test pour les livres
 books = [
@@ -76,17 +82,17 @@ users = {
     }
 }
 
-def seed_database():
+def seed_database(storage):
     """Peuple la base de données avec les données de test"""
     try:
         # Ajout des livres
         for i, book in enumerate(books, 1):
-            db.collection('books').document(f'book{i}').set(book)
+            storage.put('books', f'book{i}', book)
             print(f"Livre ajouté: {book['title']}")
 
         # Ajout des utilisateurs
         for user_id, user_data in users.items():
-            db.collection('users').document(user_id).set(user_data)
+            storage.put('users', user_id, user_data)
             print(f"Utilisateur ajouté: {user_data['name']}")
 
         print("Base de données peuplée avec succès!")
@@ -95,4 +101,10 @@ def seed_database():
         print(f"Erreur lors du peuplement de la base de données: {e}")
 
 if __name__ == "__main__":
-    seed_database()
+    # STORAGE_BACKEND=memory écrit les données dans un fichier JSONL au lieu de l'émulateur
+    if STORAGE_BACKEND == 'memory':
+        storage = MemoryStorage()
+        seed_database(storage)
+        storage.dump_jsonl(STORAGE_DATA_PATH or 'seed_data.jsonl')
+    else:
+        seed_database(get_emulator_storage())
@@ -0,0 +1,415 @@
+import asyncio
+import copy
+import json
+import os
+import threading
+
+from metrics import record_documents_read, record_documents_written
+
+BOOKS_COLLECTION = 'BiblioInformatique'
+USERS_COLLECTION = 'BiblioUser'
+HISTORY_COLLECTION = 'users'
+RECOMMENDATIONS_COLLECTION = 'BiblioRecommendations'
+
+# Backend de stockage : 'firestore' (défaut) ou 'memory'
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'firestore')
+
+# Fichier JSONL chargé par le backend mémoire (optionnel)
+STORAGE_DATA_PATH = os.getenv('STORAGE_DATA_PATH')
+
+
+def project_fields(data, fields):
+    """Restreint un document à ses champs de premier niveau listés (tous si fields est None)"""
+    if fields is None or data is None:
+        return data
+    return {field: data[field] for field in fields if field in data}
+
+
+class Storage:
+    """
+    Interface d'accès aux livres, aux utilisateurs et à l'historique de lecture.
+    Les lectures de collection retournent des triplets (id, données, date de mise à jour).
+    Les lectures acceptent une liste `fields` de champs de premier niveau à récupérer
+    (projection select de Firestore) ; None lit les documents complets.
+    """
+
+    # Livres
+    def stream_books(self):
+        return self.stream(BOOKS_COLLECTION)
+
+    # Utilisateurs
+    def stream_users(self):
+        return self.stream(USERS_COLLECTION)
+
+    def get_user(self, user_id, fields=None):
+        """Retourne les données d'un utilisateur, ou None s'il n'existe pas"""
+        return self.get(USERS_COLLECTION, user_id, fields)
+
+    def get_users(self, user_ids, fields=None):
+        """Retourne {id: données} des utilisateurs existants parmi user_ids"""
+        return self.get_many(USERS_COLLECTION, user_ids, fields)
+
+    # Historique
+    def save_ratings(self, user_id, ratings):
+        """Fusionne des notes {id du livre: note} dans l'historique de lecture d'un utilisateur"""
+        raise NotImplementedError
+
+    def save_ratings_many(self, ratings_by_user):
+        """Fusionne les notes de plusieurs utilisateurs {utilisateur: {id du livre: note}}"""
+        for user_id, ratings in ratings_by_user.items():
+            self.save_ratings(user_id, ratings)
+
+    # Accès génériques
+    def stream(self, collection_name, fields=None):
+        raise NotImplementedError
+
+    def get(self, collection_name, document_id, fields=None):
+        """Retourne les données d'un document, ou None s'il n'existe pas"""
+        raise NotImplementedError
+
+    def get_many(self, collection_name, document_ids, fields=None):
+        """Retourne {id: données} des documents existants parmi document_ids"""
+        documents = {}
+        for document_id in document_ids:
+            data = self.get(collection_name, document_id, fields)
+            if data is not None:
+                documents[document_id] = data
+        return documents
+
+    def put(self, collection_name, document_id, data):
+        """Écrit (remplace) un document"""
+        raise NotImplementedError
+
+    def put_many(self, collection_name, documents):
+        """Écrit (remplace) plusieurs documents {id: données}"""
+        for document_id, data in documents.items():
+            self.put(collection_name, document_id, data)
+
+    def listen(self, collection_name, callback):
+        """
+        Écoute une collection : callback reçoit des lots de (id, données ou None si supprimé),
+        le premier lot contenant toute la collection. Retourne un objet avec unsubscribe() et is_active.
+        """
+        raise NotImplementedError
+
+
+def firestore_client_from_env():
+    """Initialise Firebase Admin à partir de GOOGLE_APPLICATION_CREDENTIALS_JSON et retourne le client Firestore"""
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    # Charger la clé Firebase depuis une variable d'environnement
+    firebase_key_json = os.getenv("GOOGLE_APPLICATION_CREDENTIALS_JSON")
+    if not firebase_key_json:
+        raise ValueError("La variable d'environnement GOOGLE_APPLICATION_CREDENTIALS_JSON est manquante.")
+
+    firebase_key = json.loads(firebase_key_json)
+    cred = credentials.Certificate(firebase_key)
+
+    # Initialisation de Firebase Admin
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(cred, {
+            'projectId': firebase_key['project_id']
+        })
+    return firestore.client()
+
+
+class FirestoreStorage(Storage):
+    """
+    Stockage sur Firestore.
+    Le client peut être fourni directement, ou créé par `client_factory` au premier accès.
+    """
+
+    def __init__(self, client=None, client_factory=None):
+        self._client = client
+        self._client_factory = client_factory
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._client_factory()
+        return self._client
+
+    @classmethod
+    def from_env(cls, lazy=False):
+        """
+        Stockage sur le projet Firebase de GOOGLE_APPLICATION_CREDENTIALS_JSON.
+        Avec lazy, Firebase Admin n'est importé et initialisé qu'à la première lecture ou écriture.
+        """
+        storage = cls(client_factory=firestore_client_from_env)
+        if not lazy:
+            storage.client
+        return storage
+
+    def stream(self, collection_name, fields=None):
+        query = self.client.collection(collection_name)
+        if fields is not None:
+            # Projection côté serveur : seuls les champs demandés sont transférés et désérialisés
+            query = query.select(list(fields))
+        count = 0
+        try:
+            for document in query.stream():
+                count += 1
+                yield document.id, document.to_dict(), getattr(document, 'update_time', None)
+        finally:
+            record_documents_read(collection_name, count)
+
+    def get(self, collection_name, document_id, fields=None):
+        document = self.client.collection(collection_name).document(document_id).get(
+            field_paths=None if fields is None else list(fields))
+        record_documents_read(collection_name, 1)
+        return document.to_dict() if document.exists else None
+
+    def get_many(self, collection_name, document_ids, fields=None):
+        # Une seule requête get_all pour tous les documents
+        collection = self.client.collection(collection_name)
+        references = [collection.document(document_id) for document_id in dict.fromkeys(document_ids)]
+        if not references:
+            return {}
+        documents = {document.id: document.to_dict()
+                     for document in self.client.get_all(references,
+                                                         field_paths=None if fields is None else list(fields))
+                     if document.exists}
+        record_documents_read(collection_name, len(references))
+        return documents
+
+    def save_ratings(self, user_id, ratings):
+        self.client.collection(HISTORY_COLLECTION).document(user_id).set({
+            'readingHistory': dict(ratings)
+        }, merge=True)
+        record_documents_written(HISTORY_COLLECTION)
+
+    def save_ratings_many(self, ratings_by_user):
+        # Écritures groupées par lots de 500, la limite de Firestore
+        collection = self.client.collection(HISTORY_COLLECTION)
+        items = list(ratings_by_user.items())
+        for start in range(0, len(items), 500):
+            batch = self.client.batch()
+            for user_id, ratings in items[start:start + 500]:
+                batch.set(collection.document(user_id), {'readingHistory': dict(ratings)}, merge=True)
+            batch.commit()
+            record_documents_written(HISTORY_COLLECTION, len(items[start:start + 500]))
+
+    def put(self, collection_name, document_id, data):
+        self.client.collection(collection_name).document(document_id).set(data)
+        record_documents_written(collection_name)
+
+    def put_many(self, collection_name, documents):
+        # Écritures groupées par lots de 500, la limite de Firestore
+        collection = self.client.collection(collection_name)
+        items = list(documents.items())
+        for start in range(0, len(items), 500):
+            batch = self.client.batch()
+            for document_id, data in items[start:start + 500]:
+                batch.set(collection.document(document_id), data)
+            batch.commit()
+            record_documents_written(collection_name, len(items[start:start + 500]))
+
+    def listen(self, collection_name, callback):
+        def on_snapshot(snapshots, changes, read_time):
+            # Firestore facture chaque document reçu par un écouteur comme une lecture
+            record_documents_read(collection_name, len(changes))
+            callback([(change.document.id, None if change.type.name == 'REMOVED' else change.document.to_dict())
+                      for change in changes])
+
+        return self.client.collection(collection_name).on_snapshot(on_snapshot)
+
+
+class _MemoryWatch:
+    def __init__(self, listeners, callback):
+        self._listeners = listeners
+        self._callback = callback
+        self.is_active = True
+
+    def unsubscribe(self):
+        self.is_active = False
+        if self._callback in self._listeners:
+            self._listeners.remove(self._callback)
+
+
+class MemoryStorage(Storage):
+    """
+    Stockage en mémoire, chargé depuis un fichier JSONL, pour les tests, les
+    mesures de performance et le profilage hors ligne.
+    Chaque ligne du fichier est un document : {"collection": ..., "id": ..., "data": {...}}.
+    """
+
+    def __init__(self, collections=None):
+        self._lock = threading.RLock()
+        self._collections = {}
+        self._listeners = {}
+        self._clock = 0
+        for collection_name, documents in (collections or {}).items():
+            for document_id, data in documents.items():
+                self.put(collection_name, document_id, data)
+
+    @classmethod
+    def from_jsonl(cls, path):
+        storage = cls()
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    document = json.loads(line)
+                    storage.put(document['collection'], document['id'], document['data'])
+        return storage
+
+    def dump_jsonl(self, path):
+        """Écrit toutes les collections dans un fichier JSONL relisible par from_jsonl"""
+        with self._lock, open(path, 'w', encoding='utf-8') as f:
+            for collection_name, documents in self._collections.items():
+                for document_id, (data, update_time) in sorted(documents.items()):
+                    f.write(json.dumps({'collection': collection_name, 'id': document_id, 'data': data},
+                                       ensure_ascii=False) + '\n')
+
+    def _write(self, collection_name, document_id, data):
+        with self._lock:
+            self._clock += 1
+            documents = self._collections.setdefault(collection_name, {})
+            if data is None:
+                documents.pop(document_id, None)
+            else:
+                documents[document_id] = (data, self._clock)
+            record_documents_written(collection_name)
+            # Notifier sous le verrou pour que les écouteurs reçoivent les écritures dans l'ordre
+            change = [(document_id, copy.deepcopy(data))]
+            for listener in list(self._listeners.get(collection_name, [])):
+                listener(change)
+
+    def stream(self, collection_name, fields=None):
+        # Comme Firestore, les documents sont lus par id croissant et copiés
+        with self._lock:
+            documents = sorted(self._collections.get(collection_name, {}).items())
+        count = 0
+        try:
+            for document_id, (data, update_time) in documents:
+                count += 1
+                yield document_id, copy.deepcopy(project_fields(data, fields)), update_time
+        finally:
+            record_documents_read(collection_name, count)
+
+    def get(self, collection_name, document_id, fields=None):
+        with self._lock:
+            document = self._collections.get(collection_name, {}).get(document_id)
+        record_documents_read(collection_name, 1)
+        return None if document is None else copy.deepcopy(project_fields(document[0], fields))
+
+    def get_many(self, collection_name, document_ids, fields=None):
+        document_ids = list(dict.fromkeys(document_ids))
+        with self._lock:
+            documents = self._collections.get(collection_name, {})
+            found = {document_id: copy.deepcopy(project_fields(documents[document_id][0], fields))
+                     for document_id in document_ids if document_id in documents}
+        record_documents_read(collection_name, len(document_ids))
+        return found
+
+    def save_ratings(self, user_id, ratings):
+        with self._lock:
+            document = self._collections.get(HISTORY_COLLECTION, {}).get(user_id)
+            data = copy.deepcopy(document[0]) if document else {}
+            data.setdefault('readingHistory', {}).update(ratings)
+            self._write(HISTORY_COLLECTION, user_id, data)
+
+    def put(self, collection_name, document_id, data):
+        self._write(collection_name, document_id, copy.deepcopy(data))
+
+    def delete(self, collection_name, document_id):
+        self._write(collection_name, document_id, None)
+
+    def listen(self, collection_name, callback):
+        with self._lock:
+            listeners = self._listeners.setdefault(collection_name, [])
+            listeners.append(callback)
+            # Le premier lot est livré sous le verrou pour précéder toute écriture ultérieure
+            callback([(document_id, data) for document_id, data, update_time in self.stream(collection_name)])
+        return _MemoryWatch(listeners, callback)
+
+
+class AsyncStorage:
+    """
+    Interface asynchrone des lectures de documents, pour le mode ASGI (asgi.py) :
+    les lectures indépendantes d'une requête sont lancées ensemble sur la boucle d'événements.
+    """
+
+    async def get_user(self, user_id, fields=None):
+        """Retourne les données d'un utilisateur, ou None s'il n'existe pas"""
+        return await self.get(USERS_COLLECTION, user_id, fields)
+
+    async def get_users(self, user_ids, fields=None):
+        """Retourne {id: données} des utilisateurs existants parmi user_ids"""
+        return await self.get_many(USERS_COLLECTION, user_ids, fields)
+
+    async def get(self, collection_name, document_id, fields=None):
+        """Retourne les données d'un document, ou None s'il n'existe pas"""
+        raise NotImplementedError
+
+    async def get_many(self, collection_name, document_ids, fields=None):
+        """Retourne {id: données} des documents existants parmi document_ids"""
+        raise NotImplementedError
+
+
+class AsyncFirestoreStorage(AsyncStorage):
+    """Lectures Firestore par le client asynchrone (AsyncClient) : aucun thread n'attend le réseau"""
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_env(cls):
+        """Client asynchrone de l'application Firebase initialisée par FirestoreStorage.from_env"""
+        from firebase_admin import firestore_async
+        return cls(firestore_async.client())
+
+    async def get(self, collection_name, document_id, fields=None):
+        document = await self.client.collection(collection_name).document(document_id).get(
+            field_paths=None if fields is None else list(fields))
+        record_documents_read(collection_name, 1)
+        return document.to_dict() if document.exists else None
+
+    async def get_many(self, collection_name, document_ids, fields=None):
+        # Une seule requête get_all pour tous les documents
+        collection = self.client.collection(collection_name)
+        references = [collection.document(document_id) for document_id in dict.fromkeys(document_ids)]
+        if not references:
+            return {}
+        documents = {}
+        async for document in self.client.get_all(references, field_paths=None if fields is None else list(fields)):
+            if document.exists:
+                documents[document.id] = document.to_dict()
+        record_documents_read(collection_name, len(references))
+        return documents
+
+
+class ThreadedAsyncStorage(AsyncStorage):
+    """Lectures asynchrones d'un stockage synchrone (mémoire), exécutées sur des threads"""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    async def get(self, collection_name, document_id, fields=None):
+        return await asyncio.to_thread(self.storage.get, collection_name, document_id, fields)
+
+    async def get_many(self, collection_name, document_ids, fields=None):
+        return await asyncio.to_thread(self.storage.get_many, collection_name, document_ids, fields)
+
+
+def create_async_storage(storage):
+    """Stockage asynchrone lisant les mêmes données que `storage`"""
+    if isinstance(storage, FirestoreStorage):
+        # Le client synchrone initialise l'application Firebase, même créé paresseusement
+        storage.client
+        return AsyncFirestoreStorage.from_env()
+    return ThreadedAsyncStorage(storage)
+
+
+def create_storage(lazy=False):
+    """Crée le stockage choisi par STORAGE_BACKEND (client Firestore créé au premier accès avec lazy)"""
+    if STORAGE_BACKEND == 'memory':
+        if STORAGE_DATA_PATH:
+            return MemoryStorage.from_jsonl(STORAGE_DATA_PATH)
+        return MemoryStorage()
+    if STORAGE_BACKEND == 'firestore':
+        return FirestoreStorage.from_env(lazy=lazy)
+    raise ValueError(f"Backend de stockage inconnu : {STORAGE_BACKEND}")
@@ -0,0 +1,148 @@
+import argparse
+
+import numpy as np
+
+from storage import BOOKS_COLLECTION, USERS_COLLECTION, MemoryStorage
+
+# Valeurs reprises de la forme des collections réelles
+CATEGORIES = [
+    'Informatique', 'Mathématiques', 'Physique', 'Chimie', 'Génie Civil',
+    'Génie Électrique', 'Génie Mécanique', 'Télécommunications', 'Économie', 'Gestion',
+]
+TYPES = ['livre', 'memoire', 'these', 'rapport', 'article']
+DEPARTEMENTS = ['GI', 'GC', 'GE', 'GM', 'GT', 'MSP', 'GIND']
+LEVELS = ['level1', 'level2', 'level3', 'level4', 'level5']
+
+# Vocabulaire des descriptions : quelques mots communs à tout le catalogue,
+# le reste propre à chaque catégorie pour que les livres proches se ressemblent
+COMMON_WORDS = (
+    "introduction cours méthodes pratique théorie analyse étude applications exercices "
+    "notions principes fondamentaux avancé manuel guide ouvrage édition chapitre"
+).split()
+CATEGORY_WORDS = {
+    'Informatique': "algorithme programmation python java réseau données base système logiciel compilateur "
+                    "sécurité graphe apprentissage web serveur",
+    'Mathématiques': "algèbre analyse matrice probabilité statistique intégrale équation topologie géométrie "
+                     "nombre fonction série optimisation",
+    'Physique': "mécanique quantique énergie onde optique thermodynamique électromagnétisme relativité "
+                "particule champ force mouvement",
+    'Chimie': "molécule réaction atome organique minérale liaison solution catalyse polymère acide "
+              "oxydation spectroscopie",
+    'Génie Civil': "béton structure pont bâtiment sol fondation charpente résistance matériaux route "
+                   "hydraulique topographie",
+    'Génie Électrique': "circuit courant tension moteur transformateur électronique puissance signal "
+                        "automatisme capteur machine réseau",
+    'Génie Mécanique': "turbine fluide transmission engrenage usinage thermique vibration conception "
+                       "fabrication robotique matériaux",
+    'Télécommunications': "antenne signal modulation fréquence transmission radio satellite fibre "
+                          "protocole réseau codage canal",
+    'Économie': "marché croissance monnaie inflation commerce développement politique budget investissement "
+                "emploi finance",
+    'Gestion': "entreprise management comptabilité marketing stratégie projet organisation ressources "
+               "qualité audit finance",
+}
+
+# Syllabes des mots rares (noms propres, termes techniques) : longue traîne du vocabulaire
+RARE_SYLLABLES = ['ba', 'ko', 'ri', 'tu', 'me', 'sa', 'lo', 'vi', 'da', 'ne', 'pu', 'gi', 'fo', 'ze', 'ma', 'te']
+RARE_VOCABULARY_SIZE = 50000
+
+
+def _rare_vocabulary():
+    size = len(RARE_SYLLABLES)
+    return np.array([''.join(RARE_SYLLABLES[(i // size ** power) % size] for power in range(4))
+                     for i in range(RARE_VOCABULARY_SIZE)])
+
+
+def _descriptions(rng, categories, words_per_desc, rare_words):
+    """
+    Descriptions générées à partir du vocabulaire commun et de celui de la catégorie,
+    complétées de quelques mots d'une longue traîne partagée par tout le catalogue.
+    """
+    vocabularies = {category: np.array(COMMON_WORDS + CATEGORY_WORDS[category].split())
+                    for category in CATEGORIES}
+    rare_vocabulary = _rare_vocabulary()
+    descriptions = []
+    lengths = rng.integers(words_per_desc // 2, words_per_desc * 3 // 2 + 1, size=len(categories))
+    for category, length in zip(categories, lengths):
+        vocabulary = vocabularies[category]
+        # Distribution de Zipf pour que quelques mots dominent, comme dans un vrai texte
+        ranks = np.minimum(rng.zipf(1.3, size=length), len(vocabulary)) - 1
+        rare = (rng.zipf(1.1, size=rare_words) - 1) % len(rare_vocabulary)
+        descriptions.append(' '.join(list(vocabulary[ranks]) + list(rare_vocabulary[rare])))
+    return descriptions
+
+
+def generate_books(n_books, seed=0, words_per_desc=30, rare_words=6):
+    """
+    Génère n_books documents de BiblioInformatique : {id: données}.
+    Les champs reprennent la forme réelle (name, desc, cathegorie, type, exemplaire, commentaire).
+    """
+    rng = np.random.default_rng(seed)
+    categories = [CATEGORIES[i] for i in rng.integers(0, len(CATEGORIES), size=n_books)]
+    types = rng.integers(0, len(TYPES), size=n_books)
+    copies = rng.integers(0, 5, size=n_books)
+    n_comments = rng.poisson(1.5, size=n_books)
+    descriptions = _descriptions(rng, categories, words_per_desc, rare_words)
+
+    books = {}
+    for i in range(n_books):
+        books[f'book{i:07d}'] = {
+            'name': f"{descriptions[i].split(' ', 1)[0].capitalize()} {categories[i]} {i}",
+            'desc': descriptions[i],
+            'cathegorie': categories[i],
+            'type': TYPES[types[i]],
+            'exemplaire': int(copies[i]),
+            'commentaire': [{'note': int(note), 'message': 'Commentaire'}
+                            for note in rng.integers(1, 6, size=n_comments[i])],
+        }
+    return books
+
+
+def generate_users(n_users, books, seed=0, history_size=8):
+    """
+    Génère n_users documents de BiblioUser : {email: données}.
+    Les consultations (docRecentRegarder, docRecent) suivent une loi de Zipf sur le
+    catalogue pour que quelques livres soient très populaires.
+    """
+    rng = np.random.default_rng(seed + 1)
+    book_list = list(books.values())
+    departements = rng.integers(0, len(DEPARTEMENTS), size=n_users)
+    levels = rng.integers(0, len(LEVELS), size=n_users)
+    history_sizes = rng.integers(0, 2 * history_size + 1, size=n_users)
+
+    users = {}
+    for i in range(n_users):
+        picks = (rng.zipf(1.2, size=history_sizes[i]) - 1) % max(len(book_list), 1)
+        history = [{
+            'nameDoc': book_list[j]['name'],
+            'cathegorieDoc': book_list[j]['cathegorie'],
+            'type': book_list[j]['type'],
+        } for j in picks]
+        users[f'user{i:07d}@example.com'] = {
+            'name': f'Utilisateur {i}',
+            'email': f'user{i:07d}@example.com',
+            'departement': DEPARTEMENTS[departements[i]],
+            'level': LEVELS[levels[i]],
+            'docRecentRegarder': history,
+            'docRecent': history[:5],
+        }
+    return users
+
+
+def generate_storage(n_books, n_users, seed=0):
+    """Stockage en mémoire peuplé d'un catalogue et d'utilisateurs synthétiques"""
+    books = generate_books(n_books, seed=seed)
+    users = generate_users(n_users, books, seed=seed)
+    return MemoryStorage({BOOKS_COLLECTION: books, USERS_COLLECTION: users})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Génère un jeu de données synthétique au format JSONL")
+    parser.add_argument('--books', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='synthetic_data.jsonl')
+    args = parser.parse_args()
+
+    generate_storage(args.books, args.users, seed=args.seed).dump_jsonl(args.output)
+    print(f"{args.books} livres et {args.users} utilisateurs écrits dans {args.output}")
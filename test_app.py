@@ -1,5 +1,18 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
 import pytest
+import app as app_module
+import deadline
 from app import app, calculate_user_similarity
+from collection_cache import invalidate_collection_caches
+from deadline import AdmissionControl
+from precompute import precompute_recommendations
+from response_cache import response_cache
+from synthetic_data import generate_storage
 
 @pytest.fixture
 def client():
@@ -37,7 +50,7 @@ def test_get_popular_books(client):
     """Test de la route des livres populaires"""
     response = client.get('/recommendations/popular')
     assert response.status_code == 200
-    assert 'books' in response.json
+    assert 'popular_books' in response.json
 
 def test_update_history(client):
     """Test de la mise à jour de l'historique"""
@@ -47,3 +60,229 @@ def test_update_history(client):
     }
     response = client.post('/user/user1/history', json=data)
     assert response.status_code in [200, 400]  # 400 si les données sont invalides
+
+def test_ready_reports_warm_indexes(client):
+    """/ready lance le préchauffage et répond 200 une fois tous les index construits"""
+    deadline = time.monotonic() + 30
+    response = client.get('/ready')
+    while response.status_code == 503 and time.monotonic() < deadline:
+        time.sleep(0.05)
+        response = client.get('/ready')
+    assert response.status_code == 200
+    assert response.json['ready'] is True
+    assert set(response.json['indexes']) == {'book_features', 'content_index', 'user_features', 'popularity'}
+
+def test_fast_startup_defers_heavy_imports():
+    """En démarrage rapide, l'import de l'application ne charge ni scikit-learn, ni SciPy, ni flasgger"""
+    code = "import sys, app; print(sorted(m for m in ('sklearn', 'scipy', 'flasgger') if m in sys.modules))"
+    env = {**os.environ, 'STORAGE_BACKEND': 'memory', 'FAST_STARTUP': '1', 'SWAGGER_UI': '0'}
+    completed = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert completed.stdout.strip().splitlines()[-1] == '[]'
+
+def test_similar_books_by_free_text(client):
+    """Recherche de livres similaires à partir d'un texte libre"""
+    response = client.post('/similarbooks', json={'query': 'programmation python', 'k': 3})
+    assert response.status_code in [200, 404]  # 404 si le catalogue est vide
+    if response.status_code == 200:
+        assert response.json['query'] == 'programmation python'
+        assert len(response.json['similar_books']) <= 3
+
+    response = client.post('/similarbooks', json={'k': 3})
+    assert response.status_code == 400
+
+@pytest.fixture
+def synthetic_client(monkeypatch):
+    storage = generate_storage(60, 40, seed=4)
+    monkeypatch.setattr(app_module, 'storage', storage)
+    invalidate_collection_caches(storage)
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+    invalidate_collection_caches(storage)
+
+def ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+def test_user_recommendations_batch_matches_single_route(synthetic_client):
+    """Chaque ligne du lot est la réponse de la route individuelle"""
+    user_ids = [f'user{i:07d}@example.com' for i in range(0, 40, 3)] + ['inconnu@example.com']
+    response = synthetic_client.post('/recommendations/user/batch', json={'user_ids': user_ids})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+
+    lines = ndjson(response)
+    assert [line.pop('user_id') for line in lines] == user_ids
+    assert lines[-1] == {'error': 'Utilisateur non trouvé'}
+    for user_id, line in zip(user_ids[:-1], lines):
+        assert line == synthetic_client.get(f'/recommendations/user/{user_id}').json
+
+def test_similar_users_batch_matches_single_route(synthetic_client):
+    """Chaque ligne du lot est la réponse de la route individuelle"""
+    user_ids = ['user0000002@example.com', 'inconnu@example.com', 'user0000011@example.com']
+    lines = ndjson(synthetic_client.post('/recommendations/similar-users/batch', json={'user_ids': user_ids}))
+    assert [line.pop('user_id') for line in lines] == user_ids
+    assert lines[1] == {'error': 'Utilisateur non trouvé'}
+    assert lines[0] == synthetic_client.get(f'/recommendations/similar-users/{user_ids[0]}').json
+    assert lines[2] == synthetic_client.get(f'/recommendations/similar-users/{user_ids[2]}').json
+
+def test_similar_books_batch_matches_single_route(synthetic_client):
+    """Les livres du lot sont cherchés par id, titre ou texte libre comme par la route individuelle"""
+    book = next(app_module.storage.stream_books())
+    books = [{'id': book[0]}, {'title': book[1]['name']}, {'title': 'Inconnu'}, {'query': 'algorithme python'}, {}]
+    lines = ndjson(synthetic_client.post('/similarbooks/batch', json={'books': books, 'k': 3}))
+    assert [line.pop('index') for line in lines] == list(range(len(books)))
+    for item, line in zip(books[:4], lines):
+        assert line == synthetic_client.post('/similarbooks', json={**item, 'k': 3}).json
+    assert 'error' in lines[4]
+
+def test_batch_validation(synthetic_client):
+    """Les listes vides ou trop longues et les paramètres invalides sont refusés"""
+    assert synthetic_client.post('/recommendations/user/batch', json={'user_ids': []}).status_code == 400
+    assert synthetic_client.post('/recommendations/similar-users/batch', json={}).status_code == 400
+    too_many = [{'id': str(i)} for i in range(app_module.MAX_BATCH_ITEMS + 1)]
+    assert synthetic_client.post('/similarbooks/batch', json={'books': too_many}).status_code == 400
+    assert synthetic_client.post('/similarbooks/batch', json={'books': [{'id': 'x'}], 'k': 0}).status_code == 400
+
+def test_fields_parameter_slims_payloads(synthetic_client):
+    """Le paramètre fields ne garde que les champs demandés des documents retournés"""
+    user_id = 'user0000003@example.com'
+    full = synthetic_client.get(f'/recommendations/user/{user_id}').json
+    slim = synthetic_client.get(f'/recommendations/user/{user_id}?fields=id,score').json
+    assert slim['recommendations'] == [{'id': book['id'], 'score': book['score']} for book in full['recommendations']]
+    assert slim['user_preferences'] == full['user_preferences']
+
+    book_id = next(app_module.storage.stream_books())[0]
+    response = synthetic_client.post('/similarbooks?fields=name', json={'id': book_id, 'k': 3}).json
+    assert set(response['base_book']) == {'name'}
+    assert all(set(book) == {'name'} for book in response['similar_books'])
+
+def test_hybrid_recommendations_blend_signals(synthetic_client):
+    """Les quatre signaux sont mélangés ; livres déjà lus exclus et titres sans doublon"""
+    user_id = 'user0000003@example.com'
+    response = synthetic_client.get(f'/recommendations/hybrid/{user_id}?limit=8')
+    assert response.status_code == 200
+    recommendations = response.json['recommendations']
+    assert 0 < len(recommendations) <= 8
+    names = [book['name'] for book in recommendations]
+    assert len(set(names)) == len(names)
+
+    user_data = app_module.storage.get_user(user_id)
+    read = {doc['nameDoc'] for field in ('docRecent', 'docRecentRegarder') for doc in user_data[field]}
+    assert not read & set(names)
+    weights = response.json['weights']
+    for book in recommendations:
+        assert all(0.0 <= value <= 1.0 for value in book['signals'].values())
+        assert book['score'] == pytest.approx(sum(weights[name] * value for name, value in book['signals'].items()))
+    scores = [book['score'] for book in recommendations]
+    assert scores == sorted(scores, reverse=True)
+
+    # Avec le seul signal de popularité, les scores suivent /recommendations/popular (livres non lus)
+    only_popularity = 'content:0,preference:0,similar_users:0,popularity:1'
+    hybrid = synthetic_client.get(f'/recommendations/hybrid/{user_id}?weights={only_popularity}&limit=3').json
+    popular = synthetic_client.get('/recommendations/popular').json['popular_books']
+    counts = [book['popularity_score'] / popular[0]['popularity_score'] for book in popular if book['name'] not in read]
+    assert [book['score'] for book in hybrid['recommendations']] == pytest.approx(counts[:3])
+
+def test_hybrid_recommendations_validation(synthetic_client):
+    """Poids, limite et fenêtre invalides sont refusés ; un utilisateur inconnu donne 404"""
+    user_id = 'user0000003@example.com'
+    assert synthetic_client.get(f'/recommendations/hybrid/{user_id}?weights=auteur:1').status_code == 400
+    assert synthetic_client.get(f'/recommendations/hybrid/{user_id}?weights=content:-1').status_code == 400
+    assert synthetic_client.get(f'/recommendations/hybrid/{user_id}?limit=0').status_code == 400
+    assert synthetic_client.get(f'/recommendations/hybrid/{user_id}?window=1h').status_code == 400
+    assert synthetic_client.get('/recommendations/hybrid/inconnu@example.com').status_code == 404
+
+def test_slow_scoring_degrades_to_cheaper_tier(synthetic_client, monkeypatch):
+    """Un calcul plus long que le budget laisse place au précalcul périmé, sinon aux livres populaires"""
+    monkeypatch.setattr(deadline, 'REQUEST_BUDGET_MS', 200)
+    monkeypatch.setattr(deadline, 'DEGRADED_RESERVE_MS', 0)
+    recommend_books = app_module.recommend_books
+    def slow_recommend_books(*args):
+        time.sleep(0.5)
+        return recommend_books(*args)
+    monkeypatch.setattr(app_module, 'recommend_books', slow_recommend_books)
+    response_cache.clear()
+    synthetic_client.get('/recommendations/popular')
+
+    user_id = 'user0000003@example.com'
+    started = time.perf_counter()
+    response = synthetic_client.get(f'/recommendations/user/{user_id}')
+    assert time.perf_counter() - started < 0.45
+    assert response.status_code == 200 and response.headers['Cache-Control'] == 'no-store'
+    assert response.json['degraded'] == {'tier': 'popular', 'reason': 'deadline'}
+    user_data = app_module.storage.get_user(user_id)
+    read = {doc['nameDoc'] for field in ('docRecent', 'docRecentRegarder') for doc in user_data[field]}
+    names = [book['name'] for book in response.json['recommendations']]
+    assert names and not read & set(names)
+
+    # Un précalcul périmé (utilisateur modifié depuis) reste meilleur que la popularité
+    precompute_recommendations(app_module.storage, workers=1)
+    app_module.storage.put('BiblioUser', user_id, {**user_data, 'level': 'Autre'})
+    response = synthetic_client.get(f'/recommendations/user/{user_id}')
+    assert response.json['degraded'] == {'tier': 'precomputed', 'reason': 'deadline'}
+    assert len(response.json['recommendations']) == 10
+
+def test_admission_control_sheds_load(synthetic_client, monkeypatch):
+    """Au-delà de la profondeur de file, les requêtes sont délestées : niveau dégradé ou 503"""
+    admission = AdmissionControl(limit=1)
+    monkeypatch.setattr(app_module, 'user_admission', admission)
+    path = '/recommendations/user/user0000003@example.com'
+    with admission.admit() as admitted:
+        assert admitted
+        # Aucun index construit : rien à servir sans calcul
+        response = synthetic_client.get(path)
+        assert response.status_code == 503 and response.headers['Retry-After'] == '1'
+
+        synthetic_client.get('/recommendations/popular')
+        response = synthetic_client.get(path)
+        assert response.status_code == 200
+        assert response.json['degraded'] == {'tier': 'popular', 'reason': 'overloaded'}
+
+    assert admission.depth == 0
+    assert 'degraded' not in synthetic_client.get(path).json
+
+def test_concurrent_requests_beyond_queue_depth_are_shed(synthetic_client, monkeypatch):
+    """Des requêtes simultanées sur des threads : au plus `limit` sont calculées, les autres délestées"""
+    from concurrent.futures import ThreadPoolExecutor
+    admission = AdmissionControl(limit=2, max_wait=0)
+    monkeypatch.setattr(app_module, 'user_admission', admission)
+    depths = []
+    recommend_books = app_module.recommend_books
+    def slow_recommend_books(*args):
+        depths.append(admission.depth)
+        time.sleep(0.3)
+        return recommend_books(*args)
+    monkeypatch.setattr(app_module, 'recommend_books', slow_recommend_books)
+    response_cache.clear()
+    synthetic_client.get('/recommendations/popular')
+
+    def get(user_id):
+        with app.test_client() as client:
+            return client.get(f'/recommendations/user/{user_id}').json
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        responses = list(pool.map(get, [f'user{i:07d}@example.com' for i in range(6)]))
+
+    shed = [response for response in responses if 'degraded' in response]
+    assert len(shed) >= 4 and all(response['degraded']['reason'] == 'overloaded' for response in shed)
+    assert depths and max(depths) <= 2 and admission.depth == 0
+
+def test_requests_queued_too_long_by_the_router_are_shed(synthetic_client):
+    """Un worker synchrone ne voit qu'une requête : l'attente annoncée par X-Request-Start suffit à délester"""
+    synthetic_client.get('/recommendations/popular')
+    path = '/recommendations/user/user0000003@example.com'
+    queued = synthetic_client.get(path, headers={'X-Request-Start': f't={time.time() - 5:.3f}'})
+    assert queued.json['degraded'] == {'tier': 'popular', 'reason': 'overloaded'}
+    fresh = synthetic_client.get(path, headers={'X-Request-Start': f't={time.time() - 0.01:.3f}'})
+    assert 'degraded' not in fresh.json
+
+def test_apispec_lists_fields_parameter_of_batch_routes(client):
+    """Le paramètre fields des endpoints /batch est décrit parmi leurs paramètres, pas dans produces"""
+    if not app_module.SWAGGER_UI:
+        pytest.skip("Spécification désactivée (SWAGGER_UI=0)")
+    paths = client.get('/apispec.json').json['paths']
+    for path in ('/similarbooks/batch', '/recommendations/similar-users/batch', '/recommendations/user/batch'):
+        operation = paths[path]['post']
+        assert operation['produces'] == ['application/x-ndjson']
+        assert {'in': 'query', 'name': 'fields'}.items() <= next(
+            parameter for parameter in operation['parameters'] if parameter['name'] == 'fields').items()
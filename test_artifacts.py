@@ -0,0 +1,133 @@
+import os
+
+import pytest
+
+import content_index
+import index_cache
+import user_features
+from artifacts import ArtifactStore
+from content_index import ContentIndex
+from index_cache import SharedIndex
+from synthetic_data import generate_books, generate_users
+from user_features import UserFeatureStore
+
+
+def is_mapped(array):
+    # Les tableaux projetés depuis un artefact sont en lecture seule et ne possèdent pas leurs données
+    return not array.flags.writeable and not array.flags.owndata
+
+
+@pytest.fixture
+def catalog():
+    books = generate_books(300, seed=1)
+    return [{"id": book_id, **book_data} for book_id, book_data in sorted(books.items())]
+
+
+@pytest.fixture
+def users(catalog):
+    books = {book['id']: {key: value for key, value in book.items() if key != 'id'} for book in catalog}
+    return sorted(generate_users(200, books, seed=1).items())
+
+
+class CountingBuild:
+    def __init__(self, index_class):
+        self.index_class = index_class
+        self.calls = 0
+
+    def __call__(self, items, version):
+        self.calls += 1
+        return self.index_class(items, version)
+
+
+def test_content_index_is_shared_through_artifacts(tmp_path, catalog, monkeypatch):
+    """Un second processus projette l'index publié au lieu de réajuster le TF-IDF"""
+    monkeypatch.setattr(content_index, 'CONTENT_INVERTED_MIN_BOOKS', 100)
+    build = CountingBuild(ContentIndex)
+    first = ArtifactStore('content_index', ContentIndex, directory=str(tmp_path)).build(catalog, 'v1', build)
+    second = ArtifactStore('content_index', ContentIndex, directory=str(tmp_path)).build(catalog, 'v2', build)
+    assert build.calls == 1
+    assert second.version == 'v2'
+    assert is_mapped(second.matrix.data) and is_mapped(second.inverted_index()[0].data)
+
+    fresh = ContentIndex(catalog)
+    for row in (0, 7, 150):
+        assert second.similar(row, k=5) == pytest.approx(fresh.similar(row, k=5))
+    assert first.similar_to_text('python algorithme', k=3) == pytest.approx(fresh.similar_to_text('python algorithme', k=3))
+
+    # Les modifications incrémentales remplacent les tableaux projetés sans les écrire
+    patched = second.apply_changes([(catalog[0]['id'], {**catalog[0], 'desc': 'réseaux neuronaux'})])
+    assert patched is not None and patched.matrix.data.flags.writeable
+
+
+def test_user_feature_store_is_shared_through_artifacts(tmp_path, users, monkeypatch):
+    """Le magasin projeté, index LSH compris, donne les mêmes utilisateurs similaires"""
+    monkeypatch.setattr(user_features, 'USER_LSH_MIN_USERS', 50)
+    build = CountingBuild(UserFeatureStore)
+    ArtifactStore('user_features', UserFeatureStore, directory=str(tmp_path)).build(users, 'v1', build)
+    store = ArtifactStore('user_features', UserFeatureStore, directory=str(tmp_path)).build(users, 'v1', build)
+    assert build.calls == 1
+    assert is_mapped(store.pairs.indices) and is_mapped(store.type_histograms) and store.lsh is not None
+
+    fresh = UserFeatureStore(users)
+    for user_id, user_data in users[:20]:
+        for exact in (True, False):
+            assert store.most_similar(user_id, user_data, exact=exact) == \
+                fresh.most_similar(user_id, user_data, exact=exact)
+    assert [store.user_preferences(row) for row in range(len(store))] == \
+        [fresh.user_preferences(row) for row in range(len(fresh))]
+
+    user_id, user_data = users[3]
+    patched = store.apply_changes([(user_id, {**user_data, 'departement': 'Autre'})])
+    assert patched.most_similar(user_id, user_data) == fresh.apply_changes(
+        [(user_id, {**user_data, 'departement': 'Autre'})]).most_similar(user_id, user_data)
+
+
+def test_new_versions_are_published_atomically_and_old_ones_pruned(tmp_path, catalog):
+    """Chaque catalogue a sa version ; seules les plus récentes restent sur disque"""
+    store = ArtifactStore('content_index', ContentIndex, directory=str(tmp_path), keep=2)
+    for size in (100, 150, 200, 250):
+        index = store.build(catalog[:size], None, ContentIndex)
+        assert len(index.ids) == size
+    versions = store.versions()
+    assert len(versions) == 2
+    # Aucun répertoire de préparation ne reste visible
+    assert sorted(os.listdir(store.root)) == sorted(versions + ['.lock'])
+
+
+def test_shared_index_builds_through_artifacts(tmp_path, catalog):
+    """Les reconstructions d'un index partagé passent par les artefacts ; sans répertoire, rien ne change"""
+    artifacts = ArtifactStore('content_index', ContentIndex, directory=str(tmp_path))
+    shared = SharedIndex(load=lambda storage: (catalog, 'v1'), build=ContentIndex, ttl=60, artifacts=artifacts)
+    assert is_mapped(shared.get(None).matrix.data)
+
+    artifacts.directory = ''
+    shared.invalidate()
+    assert shared.get(None).matrix.data.flags.writeable
+
+
+def test_patched_indexes_are_republished_and_mapped_again(tmp_path, catalog, users, monkeypatch):
+    """Après une modification des écouteurs, l'index est reconstruit par les artefacts et de nouveau projeté"""
+    monkeypatch.setattr(index_cache, 'ARTIFACTS_REPUBLISH_DELAY', 0)
+    edited_user = (users[3][0], {**users[3][1], 'departement': 'Autre'})
+    edited_book = {**catalog[0], 'desc': 'réseaux neuronaux'}
+    for name, index_class, items, edited, change, array in (
+            ('user_features', UserFeatureStore, users, {3: edited_user}, edited_user,
+             lambda index: index.type_histograms),
+            ('content_index', ContentIndex, catalog, {0: edited_book}, (edited_book['id'], edited_book),
+             lambda index: index.matrix.data)):
+        state = {'items': items, 'version': 'v1'}
+        shared = SharedIndex(load=lambda storage: (state['items'], state['version']), build=index_class, ttl=60,
+                             artifacts=ArtifactStore(name, index_class, directory=str(tmp_path)))
+        assert is_mapped(array(shared.get(object())))
+
+        # La collection lue reflète la modification reçue par l'écouteur
+        state['items'] = [edited.get(position, item) for position, item in enumerate(items)]
+        state['version'] = 'v2'
+        shared.apply_changes([change], 'v1', 'v2')
+        assert not is_mapped(array(shared.current()))
+        shared.wait_for_rebuild(10)
+
+        republished = shared.current()
+        assert republished.version == 'v2' and is_mapped(array(republished))
+        # Toujours projeté après expiration du TTL : la version n'a pas changé
+        assert shared.get(object(), ttl=0) is republished
@@ -0,0 +1,126 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+import app as app_module
+import asgi
+from app import app
+from collection_cache import invalidate_collection_caches
+from response_cache import response_cache
+from storage import BOOKS_COLLECTION, USERS_COLLECTION, MemoryStorage
+from synthetic_data import generate_books, generate_storage, generate_users
+
+
+class SlowStorage(MemoryStorage):
+    """Stockage mémoire dont chaque lecture de document attend comme un aller-retour réseau"""
+
+    delay = 0.2
+
+    def get(self, collection_name, document_id, fields=None):
+        time.sleep(self.delay)
+        return super().get(collection_name, document_id, fields)
+
+
+async def request(path, method='GET', headers=(), body=b''):
+    """Envoie une requête à l'application ASGI ; retourne (statut, en-têtes, corps)"""
+    path, _, query = path.partition('?')
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query.encode(), 'root_path': '',
+             'scheme': 'http', 'http_version': '1.1', 'server': ('testserver', 80),
+             'headers': [(name.lower().encode(), value.encode()) for name, value in headers]}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await asgi.app(scope, receive, send)
+    start = messages[0]
+    return (start['status'], {name.decode(): value.decode() for name, value in start['headers']},
+            b''.join(message.get('body', b'') for message in messages[1:]))
+
+
+def call(*args, **kwargs):
+    return asyncio.run(request(*args, **kwargs))
+
+
+@pytest.fixture
+def synthetic_storage(monkeypatch):
+    storage = generate_storage(60, 40, seed=4)
+    monkeypatch.setattr(app_module, 'storage', storage)
+    invalidate_collection_caches(storage)
+    app.config['TESTING'] = True
+    yield storage
+    invalidate_collection_caches(storage)
+
+
+def test_async_routes_match_flask_routes(synthetic_storage):
+    """Les routes asynchrones répondent exactement comme les routes Flask"""
+    paths = ['/recommendations/user/user0000003@example.com', '/recommendations/similar-users/user0000005@example.com',
+             '/recommendations/popular', '/recommendations/popular?window=7d&fields=name',
+             '/recommendations/user/inconnu@example.com', '/recommendations/popular?window=1h']
+    with app.test_client() as client:
+        for path in paths:
+            status, headers, body = call(path)
+            response_cache.clear()
+            expected = client.get(path)
+            assert (status, body) == (expected.status_code, expected.get_data()), path
+            assert headers.get('etag') == expected.headers.get('ETag')
+
+
+def test_async_routes_conditional_requests(synthetic_storage):
+    """L'ETag d'une réponse asynchrone permet une réponse 304"""
+    status, headers, body = call('/recommendations/popular')
+    assert status == 200 and headers['cache-control'].startswith('public')
+    status, _, body = call('/recommendations/popular', headers=[('If-None-Match', headers['etag'])])
+    assert (status, body) == (304, b'')
+
+
+def test_other_routes_are_served_by_flask(synthetic_storage):
+    """Les routes sans version asynchrone passent par l'application Flask, réponses diffusées comprises"""
+    status, _, body = call('/test')
+    assert (status, json.loads(body)) == (200, {"message": "API fonctionne!"})
+
+    user_ids = ['user0000002@example.com', 'inconnu@example.com']
+    status, headers, body = call('/recommendations/user/batch', method='POST',
+                                 headers=[('Content-Type', 'application/json')],
+                                 body=json.dumps({'user_ids': user_ids}).encode())
+    assert status == 200 and headers['content-type'] == 'application/x-ndjson'
+    assert [json.loads(line)['user_id'] for line in body.splitlines()] == user_ids
+
+
+def test_native_routes_start_deferred_warm_up(synthetic_storage, monkeypatch):
+    """En démarrage rapide, une route asynchrone lance le préchauffage comme une route Flask"""
+    started = []
+    monkeypatch.setattr(app_module, 'start_warm_up', lambda: started.append(True))
+    monkeypatch.setattr(app_module, 'FAST_STARTUP', True)
+    status, _, _ = call('/recommendations/popular')
+    assert status == 200 and started
+
+    started.clear()
+    monkeypatch.setattr(app_module, 'FAST_STARTUP', False)
+    call('/recommendations/popular?window=7d')
+    assert not started
+
+
+def test_concurrent_requests_overlap_their_reads(monkeypatch):
+    """Les lectures des requêtes simultanées ne s'attendent pas les unes les autres"""
+    books = generate_books(30, seed=2)
+    storage = SlowStorage({BOOKS_COLLECTION: books, USERS_COLLECTION: generate_users(20, books, seed=2)})
+    monkeypatch.setattr(app_module, 'storage', storage)
+    invalidate_collection_caches(storage)
+    user_ids = [f'user{i:07d}@example.com' for i in range(8)]
+
+    async def requests():
+        return await asyncio.gather(*(request(f'/recommendations/similar-users/{user_id}') for user_id in user_ids))
+
+    started = time.perf_counter()
+    responses = asyncio.run(requests())
+    elapsed = time.perf_counter() - started
+    invalidate_collection_caches(app_module.storage)
+
+    assert [status for status, _, _ in responses] == [200] * len(user_ids)
+    assert elapsed < len(user_ids) * SlowStorage.delay / 2
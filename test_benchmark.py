@@ -0,0 +1,43 @@
+import json
+
+import app as app_module
+from benchmark import compare, main, percentile
+
+
+def test_percentile_interpolates():
+    """Les percentiles sont interpolés entre les valeurs triées"""
+    values = [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert percentile(values, 50) == 3.0
+    assert percentile(values, 90) == 4.6
+    assert percentile([], 50) is None
+
+
+def test_compare_reports_regressions():
+    """Seules les latences au-delà de la tolérance sont signalées"""
+    def results(p50):
+        return {'runs': [{'books': 10, 'users': 10, 'endpoints': {'popular': {'p50_ms': p50, 'p95_ms': 1.0}}}]}
+
+    assert compare(results(1.1), results(1.0), tolerance=0.2) == []
+    regressions = compare(results(1.5), results(1.0), tolerance=0.2)
+    assert [(r['endpoint'], r['metric']) for r in regressions] == [('popular', 'p50_ms')]
+
+    slower_import = {**results(1.0), 'import_ms': {'fast': 300.0}}
+    regressions = compare(slower_import, {**results(1.0), 'import_ms': {'fast': 150.0}}, tolerance=0.2)
+    assert [(r['endpoint'], r['metric']) for r in regressions] == [('import:fast', 'import_ms')]
+
+
+def test_main_writes_results(tmp_path, monkeypatch):
+    """Une mesure réduite écrit un fichier de résultats lisible"""
+    # La mesure remplace le stockage de l'application : le restaurer après le test
+    monkeypatch.setattr(app_module, 'storage', app_module.storage)
+    output = tmp_path / 'results.json'
+    assert main(['--books', '30', '--users', '20', '--requests', '3', '--import-runs', '1',
+                 '--output', str(output)]) == 0
+    results = json.loads(output.read_text())
+    assert set(results['import_ms']) == {'default', 'fast'}
+    assert results['import_ms']['fast'] <= results['import_budget_ms']
+    endpoints = results['runs'][0]['endpoints']
+    assert set(endpoints) == {'similarbooks', 'similar_users', 'user_recommendations', 'popular', 'hybrid'}
+    assert all(measures['p50_ms'] is not None for measures in endpoints.values())
+    assert all(set(measures['status_codes']) == {'200'} for measures in endpoints.values())
+    assert 0.0 <= results['runs'][0]['similar_users_recall']['recall'] <= 1.0
@@ -0,0 +1,60 @@
+from collections import Counter
+
+import pytest
+import recommendations
+from book_features import BookFeatureTable, average_rating
+from recommendations import recommend_books_batch, scoring_chunk_size
+from user_features import UserFeatureStore, extract_user_preferences
+
+BOOKS = [
+    {'id': 'b1', 'cathegorie': 'Info', 'type': 'livre', 'exemplaire': 2,
+     'commentaire': [{'note': 4}, {'note': 2}, 'invalide']},
+    {'id': 'b2', 'cathegorie': 'Maths', 'type': 'memoire', 'exemplaire': 0},
+    {'id': 'b3', 'type': 'livre', 'exemplaire': 'inconnu', 'commentaire': []},
+]
+
+
+def preferences(categories, types):
+    return {'categories': Counter(categories), 'types': Counter(types)}
+
+
+def test_average_rating_ignores_invalid_comments():
+    """La note moyenne ne tient compte que des commentaires sous forme de dictionnaire"""
+    assert average_rating(BOOKS[0]) == 3.0
+    assert average_rating(BOOKS[1]) is None
+    assert average_rating(BOOKS[2]) is None
+
+
+def test_scores_follow_calculate_book_score_weights():
+    """Chaque ligne de la matrice applique la pondération catégorie ×3, type ×2, note ×4, disponibilité +1"""
+    table = BookFeatureTable(BOOKS)
+    scores = table.scores([
+        preferences({'Info': 2}, {'livre': 1}),
+        preferences({'Physique': 5}, {'memoire': 3}),
+    ])
+    assert scores.shape == (2, 3)
+    assert list(scores[0]) == pytest.approx([2 * 3 + 1 * 2 + 3.0 * 4 + 1, 0, 1 * 2])
+    assert list(scores[1]) == pytest.approx([3.0 * 4 + 1, 3 * 2, 0])
+
+
+def test_batch_scoring_chunks_are_capped_by_catalog_size(monkeypatch):
+    """Sur un grand catalogue, les paquets de recommend_books_batch sont réduits sans changer les résultats"""
+    def doc(categorie, type_):
+        return {'cathegorieDoc': categorie, 'type': type_}
+
+    users = [(f'u{i}', {'docRecentRegarder': [doc('Info', 'livre')] * (i % 3 + 1) + [doc('Maths', 'memoire')] * i})
+             for i in range(5)]
+    store = UserFeatureStore(users)
+    table = BookFeatureTable(BOOKS)
+    batch = [(user_id, extract_user_preferences(data)) for user_id, data in users]
+    expected = list(recommend_books_batch(batch, store, table))
+
+    rows = []
+    scores = table.scores
+    monkeypatch.setattr(table, 'scores', lambda preferences_list: rows.append(len(preferences_list))
+                        or scores(preferences_list))
+    monkeypatch.setattr(recommendations, 'SCORING_MAX_CELLS', 2 * 6 * len(table))
+    assert scoring_chunk_size(len(table)) == 2
+    assert scoring_chunk_size(10 ** 9) == 1
+    assert list(recommend_books_batch(batch, store, table)) == expected
+    assert len(rows) == 3 and max(rows) <= 2 * 6
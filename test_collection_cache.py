@@ -0,0 +1,60 @@
+import content_index
+from collection_cache import CollectionCache
+from content_index import ContentIndex
+from index_cache import SharedIndex
+from storage import MemoryStorage
+
+BOOKS = {
+    'b1': {'name': 'Python', 'desc': 'python programming language'},
+    'b2': {'name': 'Java', 'desc': 'java programming language'},
+    'b3': {'name': 'Cuisine', 'desc': 'french cooking recipes'},
+}
+
+
+def make_cache(storage, index=None, **kwargs):
+    cache = CollectionCache('BiblioInformatique', **kwargs)
+    if index is not None:
+        cache.subscribers.append(index)
+    cache.start(storage)
+    return cache
+
+
+def test_initial_snapshot_loads_collection():
+    """Le premier instantané charge toute la collection et rend le cache utilisable"""
+    cache = make_cache(MemoryStorage({'BiblioInformatique': BOOKS}))
+    assert cache.usable()
+    assert [doc_id for doc_id, data in cache.items()] == ['b1', 'b2', 'b3']
+
+
+def test_changes_patch_subscribed_index(monkeypatch):
+    """Les modifications suivantes mettent à jour l'index abonné sans le reconstruire"""
+    monkeypatch.setattr(content_index, 'CONTENT_REFIT_RATIO', 1.0)
+    monkeypatch.setattr(content_index, 'CONTENT_IDF_TOLERANCE', float('inf'))
+    storage = MemoryStorage({'BiblioInformatique': BOOKS})
+    index = SharedIndex(load=None, build=ContentIndex, ttl=60)
+    cache = make_cache(storage, index)
+    index.load = lambda storage: ([{'id': doc_id, **data} for doc_id, data in cache.items()], cache.version)
+    first = index.get(storage)
+
+    storage.put('BiblioInformatique', 'b4', {'name': 'Python 2', 'desc': 'python programming'})
+    storage.delete('BiblioInformatique', 'b2')
+    patched = index.get(storage)
+    assert patched is not first
+    assert patched.version == cache.version
+    assert patched.find(title='python 2') == 3
+    assert patched.find(book_id='b2') is None
+    assert [patched.ids[row] for row, score in patched.similar(0, k=3)] == ['b4', 'b3']
+
+
+def test_disconnected_listener_falls_back_after_staleness_bound():
+    """Un écouteur déconnecté n'est plus servi au-delà de la borne de fraîcheur"""
+    cache = make_cache(MemoryStorage({'BiblioInformatique': BOOKS}), max_staleness=0.0)
+    cache._watch.is_active = False
+    assert not cache.usable()
+
+
+def test_memory_limit_disables_cache():
+    """Au-delà du nombre maximum de documents, le cache est abandonné"""
+    cache = make_cache(MemoryStorage({'BiblioInformatique': BOOKS}), max_documents=2)
+    assert cache.over_limit
+    assert not cache.usable()
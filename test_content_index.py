@@ -0,0 +1,251 @@
+import numpy as np
+import pytest
+from sklearn.metrics.pairwise import cosine_similarity
+import content_index
+from content_index import ContentIndex, get_content_index, invalidate_content_index, top_k_indices
+from storage import MemoryStorage
+
+
+class CountingStorage(MemoryStorage):
+    def __init__(self, books):
+        super().__init__({'BiblioInformatique': books})
+        self.stream_calls = 0
+
+    def stream(self, collection_name, fields=None):
+        self.stream_calls += 1
+        return super().stream(collection_name, fields)
+
+
+BOOKS = {
+    'b1': {'name': 'Python avancé', 'desc': 'python programming language advanced'},
+    'b2': {'name': 'Python débutant', 'desc': 'python programming for beginners'},
+    'b3': {'name': 'Cuisine', 'desc': 'french cooking recipes'},
+    'b4': {'desc': 'document sans nom'},
+}
+
+
+@pytest.fixture(autouse=True)
+def reset_index():
+    invalidate_content_index()
+    yield
+    invalidate_content_index()
+
+
+def test_content_index_rows():
+    """Les livres sans nom sont ignorés et chaque id a sa ligne"""
+    books, version = content_index.load_catalog(CountingStorage(BOOKS))
+    index = ContentIndex(books, version)
+    assert len(index) == 3
+    assert index.matrix.shape[0] == 3
+    assert index.row_of('b2') == 1
+    assert index.row_of('b4') is None
+
+
+def test_get_content_index_is_cached():
+    """L'index n'est pas relu tant que le TTL n'est pas expiré"""
+    storage = CountingStorage(BOOKS)
+    first = get_content_index(storage, ttl=60)
+    second = get_content_index(storage, ttl=60)
+    assert first is second
+    assert storage.stream_calls == 1
+
+
+def test_get_content_index_refits_only_on_new_version():
+    """Après expiration du TTL, le modèle n'est réajusté que si le catalogue a changé"""
+    storage = CountingStorage(BOOKS)
+    first = get_content_index(storage, ttl=0)
+    assert get_content_index(storage, ttl=0) is first
+
+    storage.put('BiblioInformatique', 'b5', {'name': 'Java', 'desc': 'java programming'})
+    refreshed = get_content_index(storage, ttl=0)
+    assert refreshed is not first
+    assert refreshed.row_of('b5') == 3
+
+
+def test_top_k_indices_breaks_ties_by_index():
+    """La sélection partielle donne le même ordre qu'un tri stable décroissant"""
+    scores = np.array([0.1, 0.5, 0.5, 0.9, 0.0, 0.5])
+    assert list(top_k_indices(scores, 3)) == [3, 1, 2]
+    assert list(top_k_indices(scores, 10)) == [3, 1, 2, 5, 0, 4]
+
+
+def test_similar_matches_full_cosine_similarity():
+    """Le score d'une seule ligne donne le même classement que la matrice N×N complète"""
+    books, version = content_index.load_catalog(CountingStorage(BOOKS))
+    index = ContentIndex(books, version)
+    expected = cosine_similarity(index.matrix)[0]
+
+    results = index.similar(0, k=2)
+    assert [row for row, score in results] == [1, 2]
+    assert results[0][1] == pytest.approx(expected[1])
+
+    # Le seuil minimum écarte les livres sans terme commun
+    assert [row for row, score in index.similar(0, k=2, min_score=0.01)] == [1]
+
+
+def test_similar_batch_matches_single_row():
+    """La variante par lots retourne les mêmes résultats que les appels individuels"""
+    books, version = content_index.load_catalog(CountingStorage(BOOKS))
+    index = ContentIndex(books, version)
+    assert index.similar_batch([0, 1, 2], k=2) == [index.similar(row, k=2) for row in [0, 1, 2]]
+    # Livres sans terme commun (scores nuls) et seuil minimum
+    assert index.similar_batch([1, 2], k=3) == [index.similar(row, k=3) for row in [1, 2]]
+    assert index.similar_batch([0, 2], k=3, min_score=0.01) == [[(1, index.similar(0, k=1)[0][1])], []]
+
+
+def test_similar_batch_stays_sparse_on_large_catalogs(monkeypatch):
+    """Sur un grand catalogue, les lots passent par l'index inversé, sans bloc dense lignes × catalogue"""
+    from synthetic_data import generate_books
+    books = [{'id': book_id, **book} for book_id, book in sorted(generate_books(400, seed=5).items())]
+    index = ContentIndex(books)
+    expected = index.similar_batch(range(0, 400, 9), k=5)
+    monkeypatch.setattr(content_index, 'CONTENT_INVERTED_MIN_BOOKS', 100)
+    assert [[row for row, _ in result] for result in index.similar_batch(range(0, 400, 9), k=5)] == \
+        [[row for row, _ in result] for result in expected]
+
+
+def test_find_by_id_and_normalized_title():
+    """Les livres sont retrouvés par id ou par titre sans casse ni accents"""
+    books, version = content_index.load_catalog(CountingStorage(BOOKS))
+    index = ContentIndex(books, version)
+    assert index.find(book_id='b3') == 2
+    assert index.find(title='  PYTHON   debutant ') == 1
+    assert index.find(title='Inconnu') is None
+
+
+def test_duplicate_titles_keep_every_row():
+    """Un titre partagé est indexé sur toutes ses lignes, la première étant retenue"""
+    books = [{'id': 'a', 'name': 'Réseaux', 'desc': 'network'},
+             {'id': 'b', 'name': 'reseaux', 'desc': 'tcp network'}]
+    index = ContentIndex(books)
+    assert index.rows_for_title('RÉSEAUX') == [0, 1]
+    assert index.find(title='Reseaux') == 0
+    assert index.find(book_id='b') == 1
+
+
+def test_search_titles_prefix_then_fuzzy():
+    """La recherche retourne d'abord les préfixes puis les titres approchants"""
+    books, version = content_index.load_catalog(CountingStorage(BOOKS))
+    index = ContentIndex(books, version)
+    assert index.search_titles('pyth') == [0, 1]
+    assert index.search_titles('cuisnie') == [2]
+    assert index.search_titles('') == []
+
+
+def test_fuzzy_title_search_compares_a_shortlist(monkeypatch):
+    """difflib ne compare que les titres partageant le plus de trigrammes, tenus à jour par les modifications"""
+    from synthetic_data import generate_books
+    books = [{'id': book_id, **book} for book_id, book in sorted(generate_books(2000, seed=6).items())]
+    index = ContentIndex(books)
+    compared = []
+    get_close_matches = content_index.difflib.get_close_matches
+    def recording_get_close_matches(word, possibilities, *args, **kwargs):
+        compared.append(len(possibilities))
+        return get_close_matches(word, possibilities, *args, **kwargs)
+    monkeypatch.setattr(content_index.difflib, 'get_close_matches', recording_get_close_matches)
+
+    title = content_index.normalize_title(books[42]['name'])
+    typo = title[:3] + title[4] + title[3] + title[5:]
+    assert 42 in index.search_titles(typo, limit=5)
+    assert compared and max(compared) <= content_index.TITLE_FUZZY_CANDIDATES
+
+    # Un titre modifié est retrouvé par l'index mis à jour ; l'index d'origine garde l'ancien
+    patched = index.apply_changes([(books[42]['id'], {**books[42], 'name': 'Réseaux neuronaux profonds'})])
+    assert patched.search_titles('reseaux neuronaus profonds') == [42]
+    assert 42 in index.search_titles(typo, limit=5)
+    assert 42 not in patched.search_titles(typo, limit=5)
+
+
+def test_inverted_index_matches_full_scan(monkeypatch):
+    """La recherche par l'index inversé donne le même top k que le parcours complet"""
+    from synthetic_data import generate_books
+    books = [{'id': book_id, **data} for book_id, data in generate_books(400, seed=3).items()]
+    index = ContentIndex(books)
+    rows = [0, 7, 123, 399]
+
+    monkeypatch.setattr(content_index, 'CONTENT_INVERTED_MIN_BOOKS', 10 ** 9)
+    expected = [index.similar(row, k=5) for row in rows] + [index.similar(5, k=3, min_score=0.2)]
+    monkeypatch.setattr(content_index, 'CONTENT_INVERTED_MIN_BOOKS', 0)
+    results = [index.similar(row, k=5) for row in rows] + [index.similar(5, k=3, min_score=0.2)]
+
+    for result, reference in zip(results, expected):
+        assert [row for row, score in result] == [row for row, score in reference]
+        assert [score for row, score in result] == pytest.approx([score for row, score in reference])
+
+
+def test_similar_to_text(monkeypatch):
+    """Un texte libre est comparé aux descriptions, par l'index inversé ou non"""
+    books, version = content_index.load_catalog(CountingStorage(BOOKS))
+    index = ContentIndex(books, version)
+    assert [row for row, score in index.similar_to_text('cooking recipes', k=1)] == [2]
+    assert index.similar_to_text('inconnu', k=2, min_score=0.01) == []
+
+    # Moins de livres partagent un terme que k : les livres de score nul complètent le top k
+    assert [row for row, score in index.similar_to_text('cooking', k=2)] == [2, 0]
+    monkeypatch.setattr(content_index, 'CONTENT_INVERTED_MIN_BOOKS', 0)
+    assert [row for row, score in index.similar_to_text('cooking', k=2)] == [2, 0]
+    assert [row for row, score in index.similar_to_text('python beginners', k=2)] == [1, 0]
+
+
+def edit_catalog(books, rng):
+    """Modifie, ajoute et supprime quelques livres ; retourne le lot de modifications"""
+    changes = [(book['id'], {**book, 'desc': book['desc'] + ' neural networks'})
+               for book in rng.sample(books[:100], 3)]
+    changes += [(f'new{i}', {'name': f'Nouveau {i}', 'desc': 'graph databases and query engines'}) for i in range(2)]
+    changes += [(book['id'], None) for book in books[100:102]]
+    return changes
+
+
+@pytest.fixture
+def catalog():
+    from synthetic_data import generate_books
+    return [{"id": book_id, **book_data} for book_id, book_data in sorted(generate_books(300, seed=3).items())]
+
+
+def test_incremental_changes_stay_within_tolerance_of_refit(catalog):
+    """Seules les lignes modifiées et les df changent ; les similarités restent proches d'un réajustement"""
+    import random
+    index = ContentIndex(catalog)
+    patched = index.apply_changes(edit_catalog(catalog, random.Random(0)))
+    assert index.matrix.shape[0] == 300 and 'graph' not in index.terms
+
+    reference = ContentIndex(patched.rebuild_items())
+    assert {term: patched.df[column] for term, column in patched.terms.items() if patched.df[column]} == \
+        {term: reference.df[column] for term, column in reference.terms.items()}
+    assert patched.idf_drift > 0.0 and patched.patched_rows == 7
+    assert content_index.refit_error(patched) < 0.01
+
+    # Les nouveaux termes servent aussi aux recherches en texte libre
+    new_row = patched.row_of('new0')
+    assert patched.similar_to_text('graph query', k=2)[0][0] in (new_row, new_row + 1)
+
+
+def test_drift_beyond_tolerance_triggers_background_rebuild(catalog, monkeypatch):
+    """Au-delà de la tolérance, le réajustement complet remplace l'index en arrière-plan,
+    modifications reçues pendant la construction comprises"""
+    import threading
+    from index_cache import SharedIndex
+    monkeypatch.setattr(content_index, 'CONTENT_IDF_TOLERANCE', 0.0)
+    release, builds = threading.Event(), []
+
+    def build(books, version):
+        builds.append(len(books))
+        if len(builds) > 1:
+            release.wait(5)
+        return ContentIndex(books, version)
+
+    shared = SharedIndex(load=lambda storage: (catalog, 'v1'), build=build, ttl=60)
+    first = shared.get(None)
+    shared.apply_changes([('new', {'name': 'Nouveau', 'desc': 'graph databases'})], 'v1', 'v2')
+    assert shared.current().needs_rebuild
+    # Modification reçue pendant le réajustement
+    shared.apply_changes([(catalog[0]['id'], None)], 'v2', 'v3')
+    release.set()
+    shared.wait_for_rebuild(5)
+
+    rebuilt = shared.current()
+    assert builds == [300, 301]
+    assert rebuilt is not first and rebuilt.version == 'v3'
+    assert rebuilt.row_of(catalog[0]['id']) is None and rebuilt.row_of('new') == 300
+    # Seule la suppression rejouée reste à réajuster
+    assert rebuilt.patched_rows == 1 and content_index.refit_error(rebuilt) < 0.01
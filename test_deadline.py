@@ -0,0 +1,52 @@
+import asyncio
+import time
+
+import pytest
+
+from deadline import AdmissionControl, Deadline, DeadlineExceeded, queue_time
+
+
+def test_queue_time_reads_router_timestamps():
+    """X-Request-Start est accepté en secondes, millisecondes ou microsecondes ; les valeurs incohérentes sont ignorées"""
+    now = 1_800_000_000.0
+    assert queue_time(f't={now - 0.25:.3f}', now) == pytest.approx(0.25)
+    assert queue_time(str(int((now - 0.5) * 1000)), now) == pytest.approx(0.5)
+    assert queue_time(f't={int((now - 1) * 1e6)}', now) == pytest.approx(1.0)
+    assert queue_time(None, now) == 0.0
+    assert queue_time('abc', now) == 0.0
+    assert queue_time(str(now + 5), now) == 0.0
+    assert queue_time(str(now - 3600), now) == 0.0
+
+
+def test_deadline_abandons_slow_stages():
+    """Une étape plus longue que le temps restant lève DeadlineExceeded sans attendre sa fin"""
+    deadline = Deadline(0.1)
+    assert deadline.call(sum, [1, 2, 3]) == 6
+
+    started = time.perf_counter()
+    with pytest.raises(DeadlineExceeded):
+        deadline.call(time.sleep, 0.5)
+    assert time.perf_counter() - started < 0.3
+    assert deadline.remaining() == 0.0
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(deadline.wait(asyncio.sleep(0.5)))
+
+    # Une attente déjà passée dans la file est décomptée du budget ; sans budget, pas d'échéance
+    assert Deadline(1.0, waited=0.8).remaining() <= 0.2
+    assert Deadline(None).remaining() == float('inf')
+
+
+def test_admission_control_limits_queue_depth():
+    """Au-delà des limites de profondeur et d'attente, les requêtes ne sont pas admises ; chaque sortie libère une place"""
+    admission = AdmissionControl(limit=2)
+    with admission.admit() as first, admission.admit() as second, admission.admit() as third:
+        assert (first, second, third) == (True, True, False)
+        assert admission.depth == 2
+    assert admission.depth == 0
+    with AdmissionControl(limit=0).admit() as admitted:
+        assert admitted
+
+    # Une requête restée trop longtemps dans la file du routeur est délestée, même seule
+    admission = AdmissionControl(limit=0, max_wait=1.0)
+    with admission.admit(waited=0.5) as admitted, admission.admit(waited=2.0) as late:
+        assert admitted and not late
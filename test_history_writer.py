@@ -0,0 +1,135 @@
+import glob
+import os
+import time
+
+import pytest
+
+import app as app_module
+import history_writer
+from collection_cache import invalidate_collection_caches
+from history_writer import HistoryWriter
+from popularity import get_popularity_index
+from storage import MemoryStorage
+from synthetic_data import generate_storage
+
+
+class RecordingStorage(MemoryStorage):
+    def __init__(self, fail=False):
+        super().__init__()
+        self.batches = []
+        self.fail = fail
+
+    def save_ratings_many(self, ratings_by_user):
+        if self.fail:
+            raise IOError("Firestore indisponible")
+        self.batches.append(ratings_by_user)
+        super().save_ratings_many(ratings_by_user)
+
+
+def history(storage, user_id):
+    document = storage.get('users', user_id)
+    return document and document['readingHistory']
+
+
+def test_ratings_are_coalesced_and_written_in_one_batch(tmp_path):
+    """Les notes d'un utilisateur sont regroupées, la dernière note d'un livre l'emporte"""
+    storage = RecordingStorage()
+    writer = HistoryWriter(storage, log_dir=str(tmp_path), flush_interval=60)
+    writer.submit('u1', {'b1': 3})
+    writer.submit('u1', {'b1': 5, 'b2': 1})
+    writer.submit('u2', {'b1': 2})
+    assert history(storage, 'u1') is None
+
+    assert writer.flush() == 2
+    assert storage.batches == [{'u1': {'b1': 5, 'b2': 1}, 'u2': {'b1': 2}}]
+    assert history(storage, 'u1') == {'b1': 5, 'b2': 1}
+    writer.close()
+    assert glob.glob(os.path.join(str(tmp_path), '*.log')) == []
+
+
+def test_size_threshold_triggers_background_flush(tmp_path):
+    """Le lot est écrit dès que flush_size utilisateurs sont en attente"""
+    storage = RecordingStorage()
+    writer = HistoryWriter(storage, log_dir=str(tmp_path), flush_size=2, flush_interval=60)
+    writer.submit('u1', {'b1': 3})
+    writer.submit('u2', {'b1': 4})
+    for _ in range(200):
+        if storage.batches:
+            break
+        time.sleep(0.01)
+    assert storage.batches == [{'u1': {'b1': 3}, 'u2': {'b1': 4}}]
+    writer.close()
+
+
+def test_acknowledged_ratings_survive_a_crash(tmp_path):
+    """Les notes journalisées d'un écrivain arrêté sont reprises par le suivant"""
+    writer = HistoryWriter(RecordingStorage(), log_dir=str(tmp_path), flush_interval=60)
+    writer.submit('u1', {'b1': 4})
+    writer.submit('u1', {'b2': 2})
+    # Arrêt brutal : le journal est fermé (verrou relâché) sans écriture en base
+    writer._segment[1].close()
+
+    storage = RecordingStorage()
+    recovered = HistoryWriter(storage, log_dir=str(tmp_path), flush_interval=60)
+    assert recovered.pending_count() == 1
+    recovered.flush()
+    assert history(storage, 'u1') == {'b1': 4, 'b2': 2}
+    recovered.close()
+    assert glob.glob(os.path.join(str(tmp_path), '*.log')) == []
+
+
+def test_failed_flush_keeps_ratings_pending(tmp_path):
+    """Après un échec d'écriture, les notes restent en attente sans écraser les plus récentes"""
+    storage = RecordingStorage(fail=True)
+    writer = HistoryWriter(storage, log_dir=str(tmp_path), flush_interval=60)
+    writer.submit('u1', {'b1': 1, 'b2': 1})
+    with pytest.raises(IOError):
+        writer.flush()
+    writer.submit('u1', {'b1': 5})
+
+    storage.fail = False
+    writer.flush()
+    assert history(storage, 'u1') == {'b1': 5, 'b2': 1}
+    writer.close()
+
+
+@pytest.mark.skipif(history_writer.fcntl is None, reason="pas de verrou de fichier sur cette plateforme")
+def test_writers_sharing_a_log_dir_never_share_a_segment(tmp_path, monkeypatch):
+    """Un écrivain n'ajoute jamais ses notes au journal verrouillé par un autre"""
+    # Noms de journaux identiques pour les deux écrivains
+    monkeypatch.setattr(history_writer.time, 'time_ns', lambda: 0)
+    storage = RecordingStorage()
+    first = HistoryWriter(storage, log_dir=str(tmp_path), flush_interval=60)
+    second = HistoryWriter(storage, log_dir=str(tmp_path), flush_interval=60)
+    assert second._segment[0] != first._segment[0]
+
+    first.submit('u1', {'b1': 3})
+    second.submit('u2', {'b2': 4})
+    first.close()
+    # Les notes du second écrivain restent dans son journal, pas dans celui supprimé par le premier
+    assert storage.batches == [{'u1': {'b1': 3}}]
+    with open(second._segment[0], encoding='utf-8') as file:
+        assert '"u2"' in file.read()
+    second.close()
+    assert storage.batches[-1] == {'u2': {'b2': 4}}
+
+
+def test_history_route_accepts_bulk_payloads(monkeypatch):
+    """Le corps peut contenir une liste de notes ; les livres notés alimentent la popularité"""
+    storage = generate_storage(30, 20, seed=6)
+    monkeypatch.setattr(app_module, 'storage', storage)
+    invalidate_collection_caches(storage)
+    monkeypatch.setattr(history_writer, 'HISTORY_FLUSH_INTERVAL', 60.0)
+    popularity = get_popularity_index(storage)
+    client = app_module.app.test_client()
+
+    book_ids = [book_id for book_id, _, _ in storage.stream_books()][:2]
+    payload = {'history': [{'bookId': book_ids[0], 'rating': 2}, {'bookId': book_ids[1], 'rating': 4},
+                           {'bookId': book_ids[0], 'rating': 5}]}
+    assert client.post('/user/u1/history', json=payload).status_code == 200
+    assert client.post('/user/u1/history', json={'history': [{'bookId': 'b', 'rating': 9}]}).status_code == 400
+
+    history_writer.get_history_writer(storage).flush()
+    assert history(storage, 'u1') == {book_ids[0]: 5, book_ids[1]: 4}
+    names = [storage.get('BiblioInformatique', book_id)['name'] for book_id in book_ids]
+    assert all(popularity.window_counts['24h'][name] >= 1 for name in names)
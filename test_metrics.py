@@ -0,0 +1,51 @@
+import pytest
+
+import metrics
+from app import app
+from metrics import MetricCounter, MetricHistogram, Registry
+
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+
+def test_histogram_renders_cumulative_buckets():
+    """Les intervalles de l'histogramme sont cumulés au format Prometheus"""
+    histogram = MetricHistogram('latency_seconds', 'Latence', ('route',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        histogram.observe(value, '/a')
+    registry = Registry()
+    registry.register(histogram)
+    text = registry.render()
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{route="/a",le="1.0"} 3' in text
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 4' in text
+    assert 'latency_seconds_count{route="/a"} 4' in text
+
+
+def test_counter_escapes_label_values():
+    """Les valeurs d'étiquettes sont échappées"""
+    counter = MetricCounter('reads_total', 'Lectures', ('collection',))
+    counter.inc('a"b', value=3)
+    assert counter.render() == ['reads_total{collection="a\\"b"} 3']
+
+
+def test_disabled_span_is_shared_no_op(monkeypatch):
+    """Désactivées, les mesures ne créent aucun objet et n'enregistrent rien"""
+    monkeypatch.setattr(metrics, 'METRICS_ENABLED', False)
+    assert metrics.span('scoring') is metrics.span('ranking')
+    assert metrics.start_request('/x') is None
+
+
+def test_metrics_endpoint_reports_routes_and_stages(client):
+    """L'endpoint /metrics expose les latences par route et par étape"""
+    response = client.get('/recommendations/popular')
+    assert 'serialization' in response.headers['Server-Timing']
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'recommendation_request_duration_seconds_count{method="GET",route="/recommendations/popular",status="200"}' in text
+    assert 'recommendation_stage_duration_seconds_count{route="/recommendations/popular",stage="serialization"}' in text
+    assert 'recommendation_cache_requests_total{cache="popularity"' in text
@@ -0,0 +1,56 @@
+from popularity import PopularityIndex
+
+
+def user(*names):
+    return {'docRecent': [{'nameDoc': name} for name in names]}
+
+
+USERS = [
+    ('u1', user('Python', 'Java')),
+    ('u2', user('Java', 'Java', 'C')),
+    ('u3', {'docRecent': ['invalide', {'type': 'livre'}]}),
+]
+
+
+def test_initial_counts_match_full_scan():
+    """Le total compte chaque occurrence de docRecent, ex-aequo dans l'ordre de lecture"""
+    index = PopularityIndex(USERS)
+    assert index.most_common(10) == [('Java', 3), ('Python', 1), ('C', 1)]
+    # L'état initial n'alimente pas les fenêtres glissantes
+    assert index.most_common(10, window='24h') == []
+
+
+def test_history_changes_update_counts_incrementally():
+    """Seules les différences d'historique modifient les compteurs"""
+    index = PopularityIndex(USERS)
+    index.set_history('u1', user('Python', 'C', 'C'), now=1000.0)
+    assert index.most_common(2) == [('C', 3), ('Java', 2)]
+    assert index.most_common(10, window='24h', now=1000.0) == [('C', 2)]
+
+    index.remove_user('u2')
+    assert index.most_common(10) == [('C', 2), ('Python', 1)]
+
+
+def test_windows_expire_old_events():
+    """Les consultations sortent de la fenêtre 24h mais restent dans la fenêtre 7 jours"""
+    index = PopularityIndex()
+    index.set_history('u1', user('Python'), now=0.0)
+    index.set_history('u2', user('Java'), now=20 * 3600.0)
+    assert index.most_common(10, window='24h', now=25 * 3600.0) == [('Java', 1)]
+    assert index.most_common(10, window='7d', now=25 * 3600.0) == [('Python', 1), ('Java', 1)]
+
+
+def test_refresh_removes_missing_users():
+    """Une relecture complète retire les utilisateurs disparus"""
+    index = PopularityIndex(USERS)
+    index.refresh([('u1', user('Python', 'Java'))], version='v2')
+    assert index.most_common(10) == [('Python', 1), ('Java', 1)]
+    assert index.version == 'v2'
+
+
+def test_histories_share_interned_names():
+    """Chaque nom de document n'est gardé qu'une fois, les historiques n'en gardent que le code"""
+    index = PopularityIndex(USERS)
+    assert index.names.values == ['Python', 'Java', 'C']
+    assert index.histories['u2'].tolist() == [[1, 2], [2, 1]]
+    assert index.history('u2') == {'Java': 2, 'C': 1}
@@ -0,0 +1,74 @@
+import pytest
+
+import app as app_module
+import precompute
+from collection_cache import invalidate_collection_caches
+from precompute import get_precomputed, precompute_recommendations
+from storage import RECOMMENDATIONS_COLLECTION
+from synthetic_data import generate_storage
+
+USER_ID = 'user0000001@example.com'
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    storage = generate_storage(60, 40, seed=2)
+    monkeypatch.setattr(app_module, 'storage', storage)
+    # Repartir d'index construits sur ce stockage
+    invalidate_collection_caches(storage)
+    return storage
+
+
+def responses(client):
+    return (client.get(f'/recommendations/user/{USER_ID}').json,
+            client.get(f'/recommendations/similar-users/{USER_ID}').json)
+
+
+def test_precomputed_responses_match_live_computation(storage, monkeypatch):
+    """Les routes servent le précalcul, identique au calcul à la demande"""
+    client = app_module.app.test_client()
+    live = responses(client)
+    assert precompute_recommendations(storage, workers=1) == 40
+    assert get_precomputed(storage, USER_ID, storage.get_user(USER_ID)) is not None
+
+    # Sans calcul à la demande possible, seules les listes précalculées peuvent répondre
+    monkeypatch.setattr(app_module, 'recommend_books', None)
+    monkeypatch.setattr(app_module, 'recommend_from_similar_users', None)
+    assert responses(client) == live
+
+
+def test_changed_user_falls_back_to_live_computation(storage):
+    """Un utilisateur modifié depuis le précalcul est recalculé à la demande"""
+    precompute_recommendations(storage, workers=1)
+    user_data = storage.get_user(USER_ID)
+    user_data['docRecentRegarder'] = []
+    storage.put('BiblioUser', USER_ID, user_data)
+    assert get_precomputed(storage, USER_ID, user_data) is None
+
+
+def test_unrelated_user_fields_keep_precomputation(storage):
+    """Modifier un champ qui n'influence pas les recommandations garde le précalcul"""
+    precompute_recommendations(storage, workers=1)
+    user_data = storage.get_user(USER_ID)
+    user_data['name'] = 'Nouveau nom'
+    storage.put('BiblioUser', USER_ID, user_data)
+    assert get_precomputed(storage, USER_ID, user_data) is not None
+
+
+def test_expired_precomputation_is_ignored(storage, monkeypatch):
+    """Un précalcul plus ancien que PRECOMPUTED_MAX_AGE n'est plus servi"""
+    precompute_recommendations(storage, workers=1)
+    monkeypatch.setattr(precompute, 'PRECOMPUTED_MAX_AGE', -1.0)
+    assert get_precomputed(storage, USER_ID, storage.get_user(USER_ID)) is None
+
+
+def test_process_pool_matches_single_process(storage):
+    """Le pool de processus produit les mêmes listes que le calcul dans le processus courant"""
+    def records():
+        return {user_id: {key: value for key, value in data.items() if key != 'computed_at'}
+                for user_id, data, _ in storage.stream(RECOMMENDATIONS_COLLECTION)}
+
+    precompute_recommendations(storage, workers=1)
+    single = records()
+    precompute_recommendations(storage, workers=2, chunk_size=7)
+    assert records() == single
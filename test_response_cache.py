@@ -0,0 +1,77 @@
+import app as app_module
+from collection_cache import invalidate_collection_caches
+from response_cache import ResponseCache
+from synthetic_data import generate_storage
+
+import pytest
+
+USER_ID = 'user0000005@example.com'
+
+
+@pytest.fixture
+def client(monkeypatch):
+    storage = generate_storage(50, 30, seed=5)
+    monkeypatch.setattr(app_module, 'storage', storage)
+    invalidate_collection_caches(storage)
+    with app_module.app.test_client() as client:
+        yield client
+    invalidate_collection_caches(storage)
+
+
+def test_lru_eviction_and_user_invalidation():
+    """Le cache est borné et les réponses d'un utilisateur sont retirées ensemble"""
+    cache = ResponseCache(maxsize=2, ttl=60)
+    cache.put(('user', 'a', (), 1), b'1')
+    cache.put(('user', 'b', (), 1), b'2')
+    cache.get(('user', 'a', (), 1))
+    cache.put(('popular', None, (), 1), b'3')
+    assert cache.get(('user', 'b', (), 1)) is None
+    assert cache.get(('user', 'a', (), 1)).body == b'1'
+
+    cache.invalidate_user('a')
+    assert cache.get(('user', 'a', (), 1)) is None
+    assert len(cache) == 1
+
+
+def test_cached_response_and_conditional_request(client, monkeypatch):
+    """La deuxième requête est servie par le cache ; un ETag connu donne 304"""
+    first = client.get(f'/recommendations/user/{USER_ID}')
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'].startswith('private')
+
+    # Sans calcul possible, seule une réponse en cache peut être servie
+    monkeypatch.setattr(app_module, 'recommend_books', None)
+    monkeypatch.setattr(app_module, 'read_precomputed', None)
+    second = client.get(f'/recommendations/user/{USER_ID}')
+    assert second.get_data() == first.get_data()
+    assert second.headers['ETag'] == first.headers['ETag']
+
+    conditional = client.get(f'/recommendations/user/{USER_ID}', headers={'If-None-Match': first.headers['ETag']})
+    assert conditional.status_code == 304
+    assert conditional.get_data() == b''
+
+
+def test_history_write_invalidates_the_user(client, monkeypatch):
+    """Une écriture dans l'historique retire les réponses en cache de l'utilisateur"""
+    client.get(f'/recommendations/user/{USER_ID}')
+    assert client.post(f'/user/{USER_ID}/history', json={'bookId': 'book0000001', 'rating': 4}).status_code == 200
+
+    calls = []
+    recommend_books = app_module.recommend_books
+    monkeypatch.setattr(app_module, 'recommend_books', lambda *args: calls.append(args) or recommend_books(*args))
+    assert client.get(f'/recommendations/user/{USER_ID}').status_code == 200
+    assert len(calls) == 1
+
+
+def test_data_version_is_part_of_the_key(client):
+    """Un changement du catalogue donne une nouvelle clé : la réponse est recalculée"""
+    first = client.get('/recommendations/popular')
+    assert first.headers['Cache-Control'].startswith('public')
+    book = first.json['popular_books'][0]
+
+    # Renommer le livre le plus populaire le retire de la liste (recherche par nom)
+    data = {key: value for key, value in book.items() if key not in ('id', 'popularity_score')}
+    app_module.storage.put('BiblioInformatique', book['id'], {**data, 'name': 'Renommé'})
+    second = client.get('/recommendations/popular')
+    assert second.headers['ETag'] != first.headers['ETag']
+    assert book['id'] not in [other['id'] for other in second.json['popular_books']]
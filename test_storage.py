@@ -0,0 +1,50 @@
+from storage import FirestoreStorage, MemoryStorage
+
+
+def test_memory_storage_round_trip(tmp_path):
+    """Le stockage mémoire se sauvegarde et se recharge en JSONL"""
+    storage = MemoryStorage({'BiblioUser': {'u1': {'departement': 'GI'}}})
+    storage.save_ratings('u1', {'b1': 4})
+    storage.save_ratings('u1', {'b2': 5})
+
+    path = tmp_path / 'data.jsonl'
+    storage.dump_jsonl(path)
+    loaded = MemoryStorage.from_jsonl(path)
+
+    assert loaded.get_user('u1') == {'departement': 'GI'}
+    assert loaded.get_user('inconnu') is None
+    assert [doc_id for doc_id, data, update_time in loaded.stream('users')] == ['u1']
+    assert next(loaded.stream('users'))[1] == {'readingHistory': {'b1': 4, 'b2': 5}}
+    assert loaded.get_users(['inconnu', 'u1', 'u1']) == {'u1': {'departement': 'GI'}}
+
+
+def test_memory_storage_field_projection():
+    """Les lectures ne retournent que les champs demandés"""
+    storage = MemoryStorage({'BiblioUser': {'u1': {'departement': 'GI', 'level': 'level2', 'name': 'A'}}})
+    assert storage.get_user('u1', ['level', 'absent']) == {'level': 'level2'}
+    assert storage.get_users(['u1'], ['name']) == {'u1': {'name': 'A'}}
+    assert [data for _, data, _ in storage.stream('BiblioUser', ['departement'])] == [{'departement': 'GI'}]
+    assert storage.get_user('u1') == {'departement': 'GI', 'level': 'level2', 'name': 'A'}
+
+
+def test_firestore_client_is_created_on_first_use():
+    """Le client Firestore n'est créé qu'au premier accès, une seule fois"""
+    clients = []
+    storage = FirestoreStorage(client_factory=lambda: clients.append(object()) or clients[-1])
+    assert clients == []
+    assert storage.client is storage.client is clients[0]
+    assert len(clients) == 1
+
+
+def test_memory_storage_listeners_receive_changes():
+    """Les écouteurs reçoivent toute la collection puis chaque écriture"""
+    storage = MemoryStorage({'BiblioInformatique': {'b1': {'name': 'Python'}}})
+    batches = []
+    watch = storage.listen('BiblioInformatique', batches.append)
+    storage.put('BiblioInformatique', 'b2', {'name': 'Java'})
+    storage.delete('BiblioInformatique', 'b1')
+    watch.unsubscribe()
+    storage.put('BiblioInformatique', 'b3', {'name': 'C'})
+
+    assert batches == [[('b1', {'name': 'Python'})], [('b2', {'name': 'Java'})], [('b1', None)]]
+    assert not watch.is_active
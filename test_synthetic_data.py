@@ -0,0 +1,29 @@
+from synthetic_data import CATEGORIES, TYPES, generate_books, generate_storage, generate_users
+
+
+def test_books_have_real_field_shapes():
+    """Les livres générés ont les champs de BiblioInformatique"""
+    books = generate_books(50, seed=1)
+    assert len(books) == 50
+    for book in books.values():
+        assert book['name'] and book['desc']
+        assert book['cathegorie'] in CATEGORIES
+        assert book['type'] in TYPES
+        assert all(1 <= comment['note'] <= 5 for comment in book['commentaire'])
+
+
+def test_users_consult_existing_books():
+    """Les consultations des utilisateurs désignent des livres du catalogue"""
+    books = generate_books(50, seed=1)
+    users = generate_users(30, books, seed=1)
+    names = {book['name'] for book in books.values()}
+    for user in users.values():
+        assert user['docRecent'] == user['docRecentRegarder'][:5]
+        assert all(doc['nameDoc'] in names for doc in user['docRecentRegarder'])
+
+
+def test_generation_is_deterministic():
+    """Une même graine produit le même jeu de données"""
+    first = list(generate_storage(20, 10, seed=3).stream_users())
+    second = list(generate_storage(20, 10, seed=3).stream_users())
+    assert [data for _, data, _ in first] == [data for _, data, _ in second]
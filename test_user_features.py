@@ -0,0 +1,89 @@
+import pytest
+from user_features import UserFeatureStore, extract_user_preferences
+
+
+def doc(categorie, type_):
+    return {'cathegorieDoc': categorie, 'type': type_}
+
+
+USERS = [
+    ('alice', {'departement': 'GI', 'level': 'level3',
+               'docRecentRegarder': [doc('Info', 'livre'), doc('Maths', 'livre')],
+               'docRecent': [{'nameDoc': 'Python'}]}),
+    ('bob', {'departement': 'GI', 'level': 'level3',
+             'docRecentRegarder': [doc('Info', 'livre'), doc('Info', 'livre'), doc('Physique', 'memoire')]}),
+    ('carol', {'departement': 'GC', 'level': '3',
+               'docRecentRegarder': [doc('Info', 'livre')]}),
+    ('dave', {'departement': '', 'level': 'level1', 'docRecentRegarder': []}),
+    ('eve', {'departement': 'GI', 'level': 4, 'docRecentRegarder': [doc('Info', 'livre')]}),
+]
+
+
+def test_similarities_follow_weighted_criteria():
+    """Les scores vectorisés suivent la pondération 40/20/25/15 de calculate_user_similarity"""
+    store = UserFeatureStore(USERS)
+    scores = store.similarities(USERS[0][1])
+
+    # alice : identique à elle-même
+    assert scores[0] == pytest.approx(100.0)
+    # bob : département + niveau + 1 paire commune sur 2 + types min 2 / max 3
+    assert scores[1] == pytest.approx(40 + 20 + 25 * 1 / 2 + 15 * 2 / 3)
+    # carol : "3" et "level3" sont le même niveau
+    assert scores[2] == pytest.approx(20 + 25 * 1 / 2 + 15 * 1 / 2)
+    # dave : aucun critère commun
+    assert scores[3] == 0.0
+    # eve : niveau non textuel, le calcul échoue et le score est nul
+    assert scores[4] == 0.0
+
+
+def test_most_similar_excludes_user_and_applies_threshold():
+    """L'utilisateur cible est exclu et seuls les scores au-dessus du seuil sont gardés"""
+    store = UserFeatureStore(USERS)
+    results = store.most_similar('alice', USERS[0][1], threshold=30.0)
+    assert [store.ids[row] for row, score in results] == ['bob', 'carol']
+    assert store.recent_documents(0) == [{'nameDoc': 'Python'}]
+
+
+def test_unknown_target_history_counts_in_denominators():
+    """Les paires et types inconnus du magasin comptent dans les dénominateurs"""
+    store = UserFeatureStore(USERS)
+    target = {'docRecentRegarder': [doc('Info', 'livre'), doc('Chimie', 'these')]}
+    scores = store.similarities(target)
+    # carol : 1 paire commune sur 2, types min 1 / max 2
+    assert scores[2] == pytest.approx(25 * 1 / 2 + 15 * 1 / 2)
+
+
+def test_preferences_extracted_from_streamed_documents():
+    """Les préférences sont calculées à la construction, sans relire chaque document"""
+    store = UserFeatureStore(USERS)
+    alice = store.user_preferences(store.row_by_id['alice'])
+    assert alice['categories'] == {'Info': 1, 'Maths': 1}
+    assert alice['types'] == {'livre': 2}
+    assert extract_user_preferences({'docRecentRegarder': [doc('Info', 'these')]})['types'] == {'these': 1}
+    # Un historique mal formé ne bloque pas la construction du magasin
+    broken = UserFeatureStore([('x', {'docRecentRegarder': None})])
+    assert broken.user_preferences(0) is None
+
+
+def test_histories_are_interned_codes():
+    """Les documents et valeurs répétés ne sont gardés qu'une fois ; les historiques sont des codes"""
+    python = {'nameDoc': 'Python', 'cathegorieDoc': 'Info', 'type': 'livre'}
+    users = [(f'u{i}', {'docRecent': [dict(python), 'invalide'], 'docRecentRegarder': [dict(python)] * (i + 1)})
+             for i in range(3)]
+    store = UserFeatureStore(users)
+    assert len(store.documents) == len(store.categories) == len(store.preference_types) == 1
+    assert store.recent.values.tolist() == [0, 0, 0]
+    assert store.recent_documents(2) == [python]
+    assert store.user_preferences(1) == {'categories': {'Info': 2}, 'types': {'livre': 2}}
+
+    # Somme des minimums des consultations par catégorie et par type
+    target = extract_user_preferences({'docRecentRegarder': [python, python]})
+    assert store.preference_similarities(target).tolist() == [2, 4, 4]
+
+    # Une modification ne réécrit que la ligne concernée et complète les vocabulaires
+    patched = store.apply_changes([('u1', {'docRecent': [{'nameDoc': 'Java'}], 'docRecentRegarder': []}),
+                                   ('u3', {'docRecent': [python]})])
+    assert [patched.recent_documents(row) for row in range(4)] == [[python], [{'nameDoc': 'Java'}], [python], [python]]
+    assert patched.user_preferences(1) == {'categories': {}, 'types': {}}
+    assert patched.user_preferences(2) == store.user_preferences(2)
+    assert len(store.documents) == 1 and store.recent_documents(1) == [python]
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from user_features import UserFeatureStore
+from user_lsh import MinHashLSH
+
+
+def history(*pairs):
+    return [{'nameDoc': f'{category}-{doc_type}', 'cathegorieDoc': category, 'type': doc_type}
+            for category, doc_type in pairs]
+
+
+def make_users(n):
+    rng = np.random.default_rng(0)
+    users = []
+    for i in range(n):
+        pairs = {(f'c{rng.integers(0, 6)}', f't{rng.integers(0, 4)}') for _ in range(rng.integers(1, 6))}
+        users.append((f'u{i}', {
+            'departement': ['GI', 'GC', 'GE'][i % 3],
+            'level': f'level{i % 4}',
+            'docRecentRegarder': history(*sorted(pairs)),
+        }))
+    return users
+
+
+def test_identical_history_is_a_candidate():
+    """Un utilisateur de même historique et même partition est toujours candidat"""
+    users = make_users(300)
+    store = UserFeatureStore(users)
+    departement, level, docs = users[7][1]['departement'], users[7][1]['level'], users[7][1]['docRecentRegarder']
+    rows = store.candidates({'departement': departement, 'level': level, 'docRecentRegarder': docs},
+                            min_candidates=1)
+    assert 7 in rows
+
+
+def test_lsh_search_matches_exact_scan_with_enough_candidates():
+    """Avec assez de candidats, la recherche approchée retrouve le résultat exact"""
+    users = make_users(300)
+    store = UserFeatureStore(users)
+    for user_id, user_data in users[:20]:
+        exact = store.most_similar(user_id, user_data, limit=5, exact=True)
+        approximate = store.most_similar(user_id, user_data, limit=5, exact=False)
+        assert [score for _, score in approximate] == [score for _, score in exact]
+
+
+def test_patched_users_are_indexed_incrementally():
+    """Un utilisateur ajouté après la construction de l'index devient candidat"""
+    users = make_users(200)
+    store = UserFeatureStore(users)
+    lsh = store.candidate_index()
+    new_user = {'departement': 'GI', 'level': 'level0', 'docRecentRegarder': history(('rare', 'these'))}
+    patched = store.apply_changes([('new', new_user)])
+    assert patched.lsh is lsh
+    rows = patched.candidates(new_user, min_candidates=1)
+    assert patched.row_by_id['new'] in rows
+    # L'ancienne version du magasin ignore les lignes qu'elle ne connaît pas
+    assert all(row < len(store) for row in store.candidates(new_user, min_candidates=1))
+
+
+def test_bands_must_divide_permutations():
+    with pytest.raises(ValueError):
+        MinHashLSH(UserFeatureStore([]), permutations=10, bands=4)
@@ -0,0 +1,477 @@
+import copy
+import os
+import threading
+from collections import Counter
+
+import numpy as np
+
+from artifacts import ArtifactStore, sparse_arrays, sparse_matrix
+from collection_cache import read_collection, subscribe
+from index_cache import SharedIndex, replace_sparse_rows
+from user_history import RaggedArray, Vocabulary, document_key
+from user_lsh import USER_LSH_MIN_CANDIDATES, USER_LSH_MIN_USERS, MinHashLSH
+
+# Durée (en secondes) pendant laquelle les caractéristiques utilisateurs sont servies sans relire BiblioUser
+USER_FEATURES_TTL = float(os.getenv('USER_FEATURES_TTL', '300'))
+
+# Champs de BiblioUser lus par les calculs de similarité et de recommandation
+USER_FIELDS = ('departement', 'level', 'docRecentRegarder', 'docRecent')
+
+# Pondération des critères de calculate_user_similarity
+DEPARTEMENT_WEIGHT = 40.0
+LEVEL_WEIGHT = 20.0
+HISTORY_WEIGHT = 25.0
+TYPES_WEIGHT = 15.0
+
+
+def _code(vocabulary, value):
+    """Retourne le code entier d'une valeur, en l'ajoutant au vocabulaire si besoin"""
+    code = vocabulary.get(value)
+    if code is None:
+        code = vocabulary[value] = len(vocabulary)
+    return code
+
+
+def extract_user_features(user_data):
+    """
+    Extrait les caractéristiques d'un utilisateur avec les mêmes règles que
+    calculate_user_similarity. Retourne (département, niveau, paires, types)
+    ou None si les données ne permettent pas le calcul (score nul).
+    """
+    try:
+        departement = user_data.get('departement', '')
+        # Le département sert de clé de dictionnaire : une valeur non hachable ne correspond à personne
+        if getattr(type(departement), '__hash__', None) is None:
+            departement = ''
+        level = user_data.get('level', '').replace('level', '') if user_data.get('level') else ''
+
+        recent_docs = [doc for doc in user_data.get('docRecentRegarder', []) if isinstance(doc, dict)]
+        pairs = {(str(doc.get('cathegorieDoc', '')), str(doc.get('type', ''))) for doc in recent_docs}
+        types = {}
+        for doc in recent_docs:
+            doc_type = str(doc.get('type', ''))
+            types[doc_type] = types.get(doc_type, 0) + 1
+
+        return departement, level, pairs, types
+    except Exception:
+        return None
+
+
+def extract_user_preferences(user_data):
+    """Préférences d'un utilisateur (catégories et types consultés) extraites de son document"""
+    preferences = {
+        'categories': Counter(),
+        'types': Counter()
+    }
+
+    # Analyse des documents récemment regardés
+    if 'docRecentRegarder' in user_data:
+        for doc in user_data['docRecentRegarder']:
+            if 'cathegorieDoc' in doc:
+                preferences['categories'][doc['cathegorieDoc']] += 1
+            if 'type' in doc:
+                preferences['types'][doc['type']] += 1
+
+    return preferences
+
+
+def _stored_preferences(user_data):
+    try:
+        return extract_user_preferences(user_data)
+    except Exception:
+        # Historique mal formé : l'utilisateur n'a pas de préférences exploitables
+        return None
+
+
+def _encode_counter(counter, vocabulary):
+    # Paires (code, nombre) dans l'ordre du compteur
+    return [(vocabulary.code(value), count) for value, count in counter.items()]
+
+
+def _decode_counter(pairs, vocabulary):
+    return Counter({vocabulary[code]: int(count) for code, count in pairs})
+
+
+class UserFeatureStore:
+    """
+    Caractéristiques de tous les utilisateurs sous forme de tableaux :
+    département et niveau encodés, incidence creuse des paires (catégorie, type)
+    et histogrammes des types consultés. Les préférences de chaque utilisateur
+    sont extraites au passage pour éviter une lecture par utilisateur.
+    Les historiques ne gardent pas les documents de BiblioUser : catégories, types
+    et documents de docRecent sont internés dans des vocabulaires, et chaque
+    utilisateur n'a que leurs codes dans des tableaux CSR (offsets et valeurs).
+    Au-delà de USER_LSH_MIN_USERS utilisateurs, un index MinHash/LSH limite
+    le calcul exact des scores à un ensemble de candidats.
+    """
+
+    def __init__(self, users, version=None):
+        self.version = version
+        self.ids = []
+        self.row_by_id = {}
+        self.documents = Vocabulary(key=document_key)
+        self.categories = Vocabulary()
+        self.preference_types = Vocabulary()
+        self.departement_codes = {}
+        self.level_codes = {}
+        self.pair_codes = {}
+        self.type_codes = {}
+
+        # SciPy n'est importé qu'à la première construction : le démarrage n'en paie pas le coût
+        from scipy.sparse import csr_matrix
+
+        self.departements = np.empty(0, dtype=np.int64)
+        self.levels = np.empty(0, dtype=np.int64)
+        self.valid = np.empty(0, dtype=bool)
+        self.recent = RaggedArray.empty()
+        self.has_preferences = np.empty(0, dtype=bool)
+        self.category_counts = RaggedArray.empty(2)
+        self.type_counts = RaggedArray.empty(2)
+        self.pairs = csr_matrix((0, 0))
+        self.type_histograms = np.zeros((0, 0))
+        self.lsh = None
+        self._lsh_lock = threading.Lock()
+        self._patch(users)
+
+    def _patch(self, changes):
+        """
+        Écrit les caractéristiques des utilisateurs modifiés (id, données ou None si supprimé).
+        Les nouveaux utilisateurs sont ajoutés en fin de tableau ; un utilisateur supprimé
+        garde sa ligne, marquée invalide, jusqu'à la prochaine reconstruction.
+        Les tableaux sont remplacés et non modifiés en place. Retourne les lignes écrites.
+        """
+        from scipy.sparse import csr_matrix
+
+        n_before = len(self.ids)
+        rows, encoded = [], []
+        recent, stored, category_pairs, type_pairs = [], [], [], []
+        for user_id, user_data in dict(changes).items():
+            row = self.row_by_id.get(user_id)
+            if row is None:
+                if user_data is None:
+                    continue
+                row = len(self.ids)
+                self.ids.append(user_id)
+                self.row_by_id[user_id] = row
+            elif user_data is None:
+                del self.row_by_id[user_id]
+
+            rows.append(row)
+            preferences = None if user_data is None else _stored_preferences(user_data)
+            stored.append(preferences is not None)
+            category_pairs.append(_encode_counter(preferences['categories'], self.categories) if preferences else [])
+            type_pairs.append(_encode_counter(preferences['types'], self.preference_types) if preferences else [])
+            if user_data is None:
+                recent.append([])
+                encoded.append(None)
+                continue
+
+            docs = user_data.get('docRecent', [])
+            recent.append([self.documents.code(doc) for doc in docs if isinstance(doc, dict)]
+                          if isinstance(docs, list) else [])
+            encoded.append(extract_user_features(user_data))
+
+        n_users = len(self.ids)
+        departements = np.concatenate([self.departements, np.full(n_users - n_before, -1, dtype=np.int64)])
+        levels = np.concatenate([self.levels, np.full(n_users - n_before, -1, dtype=np.int64)])
+        valid = np.concatenate([self.valid, np.zeros(n_users - n_before, dtype=bool)])
+        has_preferences = np.concatenate([self.has_preferences, np.zeros(n_users - n_before, dtype=bool)])
+        has_preferences[rows] = stored
+
+        pair_rows, pair_cols = [], []
+        type_rows, type_cols, type_counts = [], [], []
+        for row, features in zip(rows, encoded):
+            valid[row] = features is not None
+            if features is None:
+                departements[row] = -1
+                levels[row] = -1
+                continue
+
+            departement, level, pairs, types = features
+            departements[row] = _code(self.departement_codes, departement) if departement else -1
+            levels[row] = _code(self.level_codes, level) if level else -1
+            for pair in pairs:
+                pair_rows.append(row)
+                pair_cols.append(_code(self.pair_codes, pair))
+            for doc_type, count in types.items():
+                type_rows.append(row)
+                type_cols.append(_code(self.type_codes, doc_type))
+                type_counts.append(count)
+
+        self.departements = departements
+        self.levels = levels
+        self.valid = valid
+        self.has_preferences = has_preferences
+        self.recent = self.recent.replace(n_users, rows, recent)
+        self.category_counts = self.category_counts.replace(n_users, rows, category_pairs)
+        self.type_counts = self.type_counts.replace(n_users, rows, type_pairs)
+
+        # Remplacer les lignes modifiées de la matrice d'incidence des paires
+        positions = {row: position for position, row in enumerate(rows)}
+        values = csr_matrix((np.ones(len(pair_rows)), ([positions[row] for row in pair_rows], pair_cols)),
+                            shape=(len(rows), len(self.pair_codes)))
+        self.pairs = replace_sparse_rows(self.pairs, n_users, rows, values)
+        self.pair_sizes = np.diff(self.pairs.indptr)
+
+        type_histograms = np.zeros((n_users, len(self.type_codes)))
+        type_histograms[:n_before, :self.type_histograms.shape[1]] = self.type_histograms
+        type_histograms[rows] = 0.0
+        np.add.at(type_histograms, (type_rows, type_cols), type_counts)
+        self.type_histograms = type_histograms
+        self.type_totals = type_histograms.sum(axis=1)
+        return rows
+
+    def apply_changes(self, changes):
+        """Retourne un nouveau magasin intégrant un lot de modifications de BiblioUser"""
+        patched = copy.copy(self)
+        patched.ids = list(self.ids)
+        patched.row_by_id = dict(self.row_by_id)
+        patched.documents = self.documents.copy()
+        patched.categories = self.categories.copy()
+        patched.preference_types = self.preference_types.copy()
+        patched.departement_codes = dict(self.departement_codes)
+        patched.level_codes = dict(self.level_codes)
+        patched.pair_codes = dict(self.pair_codes)
+        patched.type_codes = dict(self.type_codes)
+        rows = patched._patch(changes)
+
+        # L'index LSH est partagé entre versions et complété ; reconstruit s'il a trop grossi
+        if patched.lsh is not None:
+            if patched.lsh.stale:
+                patched.lsh = None
+            else:
+                patched.lsh.add(patched, rows)
+        return patched
+
+    def to_artifact(self):
+        """
+        Tableaux et méta du magasin pour ArtifactStore : tableaux des caractéristiques et
+        des historiques, vocabulaires et, au-delà de USER_LSH_MIN_USERS utilisateurs, index LSH construit d'avance.
+        """
+        arrays = {'departements': self.departements, 'levels': self.levels, 'valid': self.valid,
+                  'pair_sizes': self.pair_sizes, 'type_histograms': self.type_histograms,
+                  'type_totals': self.type_totals, **sparse_arrays('pairs', self.pairs),
+                  'has_preferences': self.has_preferences}
+        for name in ('recent', 'category_counts', 'type_counts'):
+            arrays[f'{name}_offsets'] = getattr(self, name).offsets
+            arrays[f'{name}_values'] = getattr(self, name).values
+        meta = {'departement_codes': self.departement_codes, 'level_codes': self.level_codes,
+                'pair_codes': self.pair_codes, 'type_codes': self.type_codes, 'pairs_shape': self.pairs.shape,
+                'documents': self.documents.values, 'categories': self.categories.values,
+                'preference_types': self.preference_types.values, 'lsh': None}
+        if len(self.ids) >= USER_LSH_MIN_USERS:
+            lsh_arrays, meta['lsh'] = self.candidate_index().to_artifact()
+            arrays.update(lsh_arrays)
+        return arrays, meta
+
+    @classmethod
+    def from_artifact(cls, users, version, arrays, meta):
+        """
+        Magasin des utilisateurs `users` dont les tableaux sont lus (projetés en mémoire)
+        depuis un artefact : les documents ne sont pas réanalysés.
+        """
+        store = cls.__new__(cls)
+        store.version = version
+        store.ids = [user_id for user_id, user_data in users]
+        store.row_by_id = {user_id: row for row, user_id in enumerate(store.ids)}
+        store.documents = Vocabulary(meta['documents'], key=document_key)
+        store.categories = Vocabulary(meta['categories'])
+        store.preference_types = Vocabulary(meta['preference_types'])
+        store.has_preferences = arrays['has_preferences']
+        for name in ('recent', 'category_counts', 'type_counts'):
+            setattr(store, name, RaggedArray(arrays[f'{name}_offsets'], arrays[f'{name}_values']))
+        store.departement_codes = meta['departement_codes']
+        store.level_codes = meta['level_codes']
+        store.pair_codes = meta['pair_codes']
+        store.type_codes = meta['type_codes']
+
+        store.departements = arrays['departements']
+        store.levels = arrays['levels']
+        store.valid = arrays['valid']
+        store.pairs = sparse_matrix(arrays, 'pairs', meta['pairs_shape'])
+        store.pair_sizes = arrays['pair_sizes']
+        store.type_histograms = arrays['type_histograms']
+        store.type_totals = arrays['type_totals']
+        store.lsh = None if meta['lsh'] is None else MinHashLSH.from_artifact(arrays, meta['lsh'])
+        store._lsh_lock = threading.Lock()
+        return store
+
+    def __len__(self):
+        return len(self.ids)
+
+    def recent_documents(self, row):
+        """Documents de docRecent d'un utilisateur (partagés par le vocabulaire : à copier avant modification)"""
+        return [self.documents[code] for code in self.recent[row]]
+
+    def user_preferences(self, row):
+        """Préférences d'un utilisateur telles que les donne extract_user_preferences, ou None"""
+        if not self.has_preferences[row]:
+            return None
+        return {'categories': _decode_counter(self.category_counts[row], self.categories),
+                'types': _decode_counter(self.type_counts[row], self.preference_types)}
+
+    def preference_similarities(self, preferences):
+        """
+        Somme, pour chaque utilisateur, des minimums entre ses nombres de consultations
+        et ceux de `preferences` sur les catégories puis les types (entiers).
+        Les utilisateurs sans préférences exploitables ont un score nul.
+        """
+        from scipy.sparse import csr_matrix
+
+        n_users = len(self.ids)
+        scores = np.zeros(n_users, dtype=np.int64)
+        for counter, vocabulary, counts in ((preferences['categories'], self.categories, self.category_counts),
+                                            (preferences['types'], self.preference_types, self.type_counts)):
+            codes, targets = [], []
+            for value, count in counter.items():
+                code = vocabulary.get(value)
+                if code is not None:
+                    codes.append(code)
+                    targets.append(count)
+            if not codes:
+                continue
+            # Les tableaux CSR des préférences forment directement une matrice creuse utilisateurs × valeurs
+            matrix = csr_matrix((counts.values[:, 1], counts.values[:, 0], counts.offsets),
+                                shape=(n_users, len(vocabulary)))
+            scores += np.minimum(matrix[:, codes].toarray(), targets).sum(axis=1).astype(np.int64)
+        scores[~self.has_preferences] = 0
+        return scores
+
+    def candidate_index(self):
+        """Index MinHash/LSH des utilisateurs, construit au premier appel"""
+        if self.lsh is None:
+            with self._lsh_lock:
+                if self.lsh is None:
+                    self.lsh = MinHashLSH(self)
+        return self.lsh
+
+    def candidates(self, user_data, min_candidates=USER_LSH_MIN_CANDIDATES):
+        """Lignes candidates de l'index LSH pour un utilisateur, ou None si ses données sont invalides"""
+        features = extract_user_features(user_data)
+        if features is None:
+            return None
+        departement, level, pairs, types = features
+        departement_code = self.departement_codes.get(departement, -1) if departement else -1
+        level_code = self.level_codes.get(level, -1) if level else -1
+        pair_codes = [self.pair_codes[pair] for pair in pairs if pair in self.pair_codes]
+        rows = self.candidate_index().candidates(departement_code, level_code, pair_codes, min_candidates)
+        # L'index partagé peut contenir des lignes ajoutées par une version plus récente du magasin
+        return rows[rows < len(self.ids)]
+
+    def similarities(self, user_data, rows=None):
+        """
+        Calcule en une passe vectorisée le score de calculate_user_similarity
+        entre un utilisateur et tous les utilisateurs du magasin, ou seulement
+        ceux des lignes données (scores dans l'ordre de `rows`).
+        """
+        if rows is None:
+            departements, levels, valid = self.departements, self.levels, self.valid
+            user_pairs, pair_sizes = self.pairs, self.pair_sizes
+            type_histograms, type_totals = self.type_histograms, self.type_totals
+        else:
+            departements, levels, valid = self.departements[rows], self.levels[rows], self.valid[rows]
+            user_pairs, pair_sizes = self.pairs[rows], self.pair_sizes[rows]
+            type_histograms, type_totals = self.type_histograms[rows], self.type_totals[rows]
+
+        n_users = len(departements)
+        scores = np.zeros(n_users)
+        features = extract_user_features(user_data)
+        if features is None or n_users == 0:
+            return scores
+        departement, level, pairs, types = features
+
+        # 1. Même département (40 points)
+        code = self.departement_codes.get(departement) if departement else None
+        if code is not None:
+            scores += DEPARTEMENT_WEIGHT * (departements == code)
+
+        # 2. Même niveau d'études (20 points)
+        code = self.level_codes.get(level) if level else None
+        if code is not None:
+            scores += LEVEL_WEIGHT * (levels == code)
+
+        # 3. Historique de consultation récent (25 points)
+        if pairs:
+            target = np.zeros(len(self.pair_codes))
+            for pair in pairs:
+                code = self.pair_codes.get(pair)
+                if code is not None:
+                    target[code] = 1.0
+            common = user_pairs @ target
+            largest = np.maximum(pair_sizes, len(pairs))
+            overlap = np.divide(common, largest, out=np.zeros(n_users), where=pair_sizes > 0)
+            scores += HISTORY_WEIGHT * overlap
+
+        # 4. Types de documents similaires (15 points) : somme des min / somme des max
+        target_total = float(sum(types.values()))
+        target_types = np.zeros(len(self.type_codes))
+        for doc_type, count in types.items():
+            code = self.type_codes.get(doc_type)
+            if code is not None:
+                target_types[code] = count
+        common = np.minimum(type_histograms, target_types).sum(axis=1)
+        union = type_totals + target_total - common
+        has_types = union > 0
+        type_similarity = np.divide(common, np.maximum(1.0, union), out=np.zeros(n_users), where=has_types)
+        scores += TYPES_WEIGHT * type_similarity
+
+        # Les utilisateurs dont les données sont invalides ont un score nul
+        scores[~valid] = 0.0
+        return scores
+
+    def most_similar(self, user_id, user_data, threshold=30.0, limit=None, exact=None):
+        """
+        Retourne les utilisateurs dont le score dépasse le seuil, triés par score
+        décroissant (ordre de lecture pour les ex-aequo), sous forme de (ligne, score).
+        Par défaut, la recherche est exacte en dessous de USER_LSH_MIN_USERS utilisateurs
+        et limitée aux candidats de l'index LSH au-delà.
+        """
+        if exact is None:
+            exact = len(self.ids) < USER_LSH_MIN_USERS
+        rows = None if exact else self.candidates(user_data)
+        if rows is None:
+            rows = np.arange(len(self.ids))
+            scores = self.similarities(user_data)
+        else:
+            scores = self.similarities(user_data, rows)
+
+        own = self.row_by_id.get(user_id)
+        if own is not None:
+            scores[rows == own] = -np.inf
+        selected = np.flatnonzero(scores > threshold)
+        order = np.lexsort((rows[selected], -scores[selected]))
+        selected = selected[order]
+        if limit is not None:
+            selected = selected[:limit]
+        return [(int(rows[position]), float(scores[position])) for position in selected]
+
+
+def load_users(storage, fields=USER_FIELDS):
+    """Lit les champs `fields` de la collection BiblioUser et retourne ([(id, données)], version)"""
+    items, version = read_collection(storage, 'BiblioUser', fields)
+    users = [(user_id, user_data) for user_id, user_data in items if isinstance(user_data, dict)]
+    return users, version
+
+
+_user_feature_store = SharedIndex(load=load_users, build=UserFeatureStore, ttl=USER_FEATURES_TTL,
+                                  name='user_features', artifacts=ArtifactStore('user_features', UserFeatureStore))
+subscribe('BiblioUser', _user_feature_store)
+
+
+def get_user_feature_store(storage, ttl=None):
+    """
+    Retourne le magasin de caractéristiques utilisateurs partagé par le processus.
+    BiblioUser n'est relu qu'après expiration du TTL, et les tableaux ne sont
+    reconstruits que si la version de la collection a changé.
+    """
+    return _user_feature_store.get(storage, ttl)
+
+
+def user_feature_store_version():
+    """Version du magasin partagé, sans relire BiblioUser (None s'il n'est pas construit)"""
+    return _user_feature_store.version
+
+
+def invalidate_user_feature_store():
+    """Force la relecture de BiblioUser au prochain appel de get_user_feature_store"""
+    _user_feature_store.invalidate()
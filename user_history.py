@@ -0,0 +1,120 @@
+import itertools
+
+import numpy as np
+
+
+def document_key(doc):
+    """
+    Clé d'internement d'un document d'historique : ses champs dans l'ordre, avec le
+    type de chaque valeur (1, 1.0 et True restent des documents distincts).
+    """
+    try:
+        key = tuple((name, type(value), value) for name, value in doc.items())
+        hash(key)
+        return key
+    except TypeError:
+        # Valeur non hachable (liste, dictionnaire) : le texte du document sert de clé
+        return ('repr', repr(doc))
+
+
+class Vocabulary:
+    """
+    Valeurs distinctes (catégories, types, documents) numérotées dans l'ordre d'apparition.
+    Chaque valeur n'est gardée qu'une fois ; les historiques ne stockent que son code.
+    Le dictionnaire des codes est reconstruit à la demande pour un vocabulaire lu
+    depuis un artefact.
+    """
+
+    def __init__(self, values=(), key=None):
+        self.values = list(values)
+        self.key = key
+        self._codes = None
+
+    def _key(self, value):
+        return value if self.key is None else self.key(value)
+
+    @property
+    def codes(self):
+        if self._codes is None:
+            codes = {}
+            for code, value in enumerate(self.values):
+                codes.setdefault(self._key(value), code)
+            self._codes = codes
+        return self._codes
+
+    def code(self, value):
+        """Retourne le code d'une valeur, en l'ajoutant au vocabulaire si besoin"""
+        codes = self.codes
+        key = value if self.key is None else self.key(value)
+        code = codes.get(key)
+        if code is None:
+            code = codes[key] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def get(self, value, default=None):
+        return self.codes.get(self._key(value), default)
+
+    def copy(self):
+        vocabulary = Vocabulary(self.values, self.key)
+        vocabulary._codes = None if self._codes is None else dict(self._codes)
+        return vocabulary
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, code):
+        return self.values[code]
+
+
+class RaggedArray:
+    """
+    Listes de codes de longueur variable par ligne, au format CSR : offsets (n + 1)
+    et valeurs concaténées (une ligne par élément, une ou plusieurs colonnes).
+    """
+
+    def __init__(self, offsets, values):
+        self.offsets = offsets
+        self.values = values
+
+    @classmethod
+    def empty(cls, columns=None, dtype=np.int32):
+        shape = (0,) if columns is None else (0, columns)
+        return cls(np.zeros(1, dtype=np.int64), np.empty(shape, dtype=dtype))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        return self.values[self.offsets[row]:self.offsets[row + 1]]
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def replace(self, n_rows, rows, new_rows):
+        """
+        Retourne un tableau de n_rows lignes (les lignes ajoutées sont vides) où les
+        lignes `rows` sont remplacées par les listes `new_rows`.
+        """
+        old_lengths = self.lengths()
+        lengths = np.zeros(n_rows, dtype=np.int64)
+        lengths[:len(old_lengths)] = old_lengths
+        rows = np.asarray(rows, dtype=np.int64)
+        new_lengths = np.array([len(values) for values in new_rows], dtype=np.int64)
+        lengths[rows] = new_lengths
+        offsets = np.zeros(n_rows + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        columns = self.values.shape[1:]
+        values = np.empty((int(offsets[-1]),) + columns, dtype=self.values.dtype)
+        # Recopier d'un bloc les valeurs des lignes inchangées à leur nouvelle position
+        owners = np.repeat(np.arange(len(old_lengths)), old_lengths)
+        kept = ~np.isin(owners, rows)
+        positions = np.flatnonzero(kept)
+        values[offsets[owners[kept]] + positions - self.offsets[owners[kept]]] = self.values[positions]
+
+        # Puis les nouvelles listes, converties en un seul tableau
+        added = np.array(list(itertools.chain.from_iterable(new_rows)), dtype=self.values.dtype)
+        starts = np.repeat(offsets[rows] - np.cumsum(new_lengths) + new_lengths, new_lengths)
+        values[starts + np.arange(len(added))] = added.reshape((-1,) + columns)
+        return RaggedArray(offsets, values)
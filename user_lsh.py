@@ -0,0 +1,238 @@
+import os
+import threading
+
+import numpy as np
+
+# Nombre de fonctions de hachage MinHash par signature
+USER_LSH_PERMUTATIONS = int(os.getenv('USER_LSH_PERMUTATIONS', '64'))
+
+# Nombre de bandes LSH (doit diviser USER_LSH_PERMUTATIONS) : plus de bandes, meilleur rappel
+USER_LSH_BANDS = int(os.getenv('USER_LSH_BANDS', '32'))
+
+# Nombre minimum de candidats avant d'arrêter l'exploration des partitions voisines
+USER_LSH_MIN_CANDIDATES = int(os.getenv('USER_LSH_MIN_CANDIDATES', '500'))
+
+# En dessous de ce nombre d'utilisateurs, la recherche reste un parcours exact
+USER_LSH_MIN_USERS = int(os.getenv('USER_LSH_MIN_USERS', '5000'))
+
+# Part d'utilisateurs ajoutés incrémentalement au-delà de laquelle l'index est reconstruit
+USER_LSH_REBUILD_RATIO = 0.5
+
+# Nombre premier de Mersenne 2^31 - 1 : (a * x + b) tient dans un entier 64 bits
+_PRIME = np.uint64((1 << 31) - 1)
+_NO_SIGNATURE = _PRIME
+
+# Nombre de lignes dont les signatures sont calculées ensemble
+_SIGNATURE_CHUNK = 4096
+
+
+def _partition_hash(departement, level):
+    with np.errstate(over='ignore'):
+        return (np.uint64(departement + 2) * np.uint64(0x9E3779B97F4A7C15)
+                + np.uint64(level + 2) * np.uint64(0xC2B2AE3D27D4EB4F))
+
+
+class MinHashLSH:
+    """
+    Index approché des utilisateurs sur leurs ensembles de paires (catégorie, type)
+    consultées : signatures MinHash découpées en bandes, chaque bande étant rangée
+    dans une table par partition (département, niveau).
+    Les utilisateurs qui partagent une bande avec l'utilisateur cherché sont les
+    candidats dont le score exact est ensuite calculé.
+    """
+
+    def __init__(self, store, permutations=USER_LSH_PERMUTATIONS, bands=USER_LSH_BANDS, seed=0):
+        if permutations % bands:
+            raise ValueError("Le nombre de bandes doit diviser le nombre de permutations.")
+        self.permutations = permutations
+        self.bands = bands
+        self.rows_per_band = permutations // bands
+
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, int(_PRIME), size=permutations).astype(np.uint64)
+        self._b = rng.integers(0, int(_PRIME), size=permutations).astype(np.uint64)
+        self._band_multipliers = rng.integers(1, 1 << 63, size=self.rows_per_band).astype(np.uint64) | np.uint64(1)
+
+        rows = np.flatnonzero(store.valid)
+        self.size = len(rows)
+        self.added = 0
+        partitions = np.stack([store.departements[rows], store.levels[rows]], axis=1)
+
+        # Membres de chaque partition, par ligne croissante
+        self.members = {}
+        if len(rows):
+            keys, inverse = np.unique(partitions, axis=0, return_inverse=True)
+            for position, (departement, level) in enumerate(keys):
+                self.members[(int(departement), int(level))] = rows[inverse.ravel() == position]
+        self._extra_members = {}
+
+        # Tables de bandes : clés triées et lignes correspondantes, une paire de tableaux par bande
+        keys = self._band_keys(self.signatures(store, rows), partitions)
+        has_signature = store.pair_sizes[rows] > 0
+        self._keys, self._rows = [], []
+        for band in range(bands):
+            band_keys, band_rows = keys[has_signature, band], rows[has_signature]
+            order = np.argsort(band_keys, kind='stable')
+            self._keys.append(band_keys[order])
+            self._rows.append(band_rows[order])
+        self._extra_buckets = {}
+        # Protège les entrées ajoutées incrémentalement, lues par les recherches concurrentes
+        self._lock = threading.Lock()
+
+    def to_artifact(self):
+        """Tableaux et méta de l'index (sans entrées ajoutées), pour les artefacts du magasin"""
+        partitions = sorted(self.members)
+        members = [self.members[partition] for partition in partitions]
+        arrays = {
+            'lsh_a': self._a,
+            'lsh_b': self._b,
+            'lsh_band_multipliers': self._band_multipliers,
+            'lsh_keys': np.stack(self._keys),
+            'lsh_rows': np.stack(self._rows),
+            'lsh_partitions': np.asarray(partitions, dtype=np.int64).reshape(len(partitions), 2),
+            'lsh_member_offsets': np.cumsum([0] + [len(rows) for rows in members]),
+            'lsh_members': np.concatenate(members) if members else np.empty(0, dtype=np.intp),
+        }
+        return arrays, {'permutations': self.permutations, 'bands': self.bands, 'size': self.size}
+
+    @classmethod
+    def from_artifact(cls, arrays, meta):
+        """Index dont les tables de bandes et les partitions sont lues depuis un artefact"""
+        lsh = cls.__new__(cls)
+        lsh.permutations = meta['permutations']
+        lsh.bands = meta['bands']
+        lsh.rows_per_band = lsh.permutations // lsh.bands
+        lsh._a = arrays['lsh_a']
+        lsh._b = arrays['lsh_b']
+        lsh._band_multipliers = arrays['lsh_band_multipliers']
+        lsh.size = meta['size']
+        lsh.added = 0
+
+        offsets, members = arrays['lsh_member_offsets'], arrays['lsh_members']
+        lsh.members = {(int(departement), int(level)): members[offsets[position]:offsets[position + 1]]
+                       for position, (departement, level) in enumerate(arrays['lsh_partitions'])}
+        lsh._extra_members = {}
+        lsh._keys = list(arrays['lsh_keys'])
+        lsh._rows = list(arrays['lsh_rows'])
+        lsh._extra_buckets = {}
+        lsh._lock = threading.Lock()
+        return lsh
+
+    def signatures(self, store, rows):
+        """Signatures MinHash (lignes × permutations) des ensembles de paires des lignes données"""
+        signatures = np.full((len(rows), self.permutations), _NO_SIGNATURE, dtype=np.uint64)
+        for start in range(0, len(rows), _SIGNATURE_CHUNK):
+            chunk = store.pairs[rows[start:start + _SIGNATURE_CHUNK]]
+            non_empty = np.diff(chunk.indptr) > 0
+            if not chunk.nnz:
+                continue
+            hashes = (chunk.indices.astype(np.uint64)[:, None] * self._a + self._b) % _PRIME
+            minima = np.minimum.reduceat(hashes, chunk.indptr[:-1][non_empty], axis=0)
+            signatures[start + np.flatnonzero(non_empty)] = minima
+        return signatures
+
+    def signature_of(self, pair_codes):
+        """Signature MinHash d'un ensemble de codes de paires"""
+        codes = np.asarray(sorted(pair_codes), dtype=np.uint64)
+        if not len(codes):
+            return None
+        return ((codes[:, None] * self._a + self._b) % _PRIME).min(axis=0)
+
+    def _raw_band_keys(self, signatures):
+        """Clé de chaque bande des signatures (lignes × bandes)"""
+        with np.errstate(over='ignore'):
+            bands = signatures.reshape(len(signatures), self.bands, self.rows_per_band)
+            return (bands * self._band_multipliers).sum(axis=2, dtype=np.uint64)
+
+    def _band_keys(self, signatures, partitions):
+        """Clé de chaque bande (lignes × bandes), combinée à la partition de la ligne"""
+        partition_keys = _partition_hash(partitions[:, 0].astype(np.int64), partitions[:, 1].astype(np.int64))
+        return self._raw_band_keys(signatures) ^ partition_keys[:, None]
+
+    def add(self, store, rows):
+        """
+        Indexe des lignes ajoutées ou modifiées depuis la construction. Les anciennes
+        entrées des lignes modifiées restent : elles ne donnent que des candidats en trop,
+        écartés par le calcul exact des scores.
+        """
+        rows = np.asarray([row for row in rows if store.valid[row]], dtype=np.intp)
+        self.added += len(rows)
+        if not len(rows):
+            return
+        partitions = np.stack([store.departements[rows], store.levels[rows]], axis=1)
+        keys = self._band_keys(self.signatures(store, rows), partitions)
+        has_signature = store.pair_sizes[rows] > 0
+        with self._lock:
+            self._add_entries(rows, partitions, keys, has_signature)
+
+    def _add_entries(self, rows, partitions, keys, has_signature):
+        for position, row in enumerate(rows):
+            partition = (int(partitions[position, 0]), int(partitions[position, 1]))
+            self._extra_members.setdefault(partition, []).append(int(row))
+            if has_signature[position]:
+                for band in range(self.bands):
+                    self._extra_buckets.setdefault((band, int(keys[position, band])), []).append(int(row))
+
+    @property
+    def stale(self):
+        """Indique si assez de lignes ont été ajoutées pour justifier une reconstruction"""
+        return self.added > USER_LSH_REBUILD_RATIO * max(self.size, 1)
+
+    def _probe_order(self, departement, level):
+        """Partitions à explorer, des plus proches aux plus lointaines, par groupes"""
+        partitions = set(self.members) | set(self._extra_members)
+        same = [(departement, level)]
+        same_departement = sorted(p for p in partitions if departement >= 0 and p[0] == departement and p[1] != level)
+        same_level = sorted(p for p in partitions if level >= 0 and p[1] == level and p[0] != departement)
+        seen = set(same) | set(same_departement) | set(same_level)
+        others = sorted(p for p in partitions if p not in seen)
+        return [same, same_departement, same_level, others]
+
+    def _partition_members(self, partition):
+        members = self.members.get(partition, np.empty(0, dtype=np.intp))
+        extra = self._extra_members.get(partition)
+        return np.concatenate([members, extra]) if extra else members
+
+    def _bucket(self, band, key):
+        keys, rows = self._keys[band], self._rows[band]
+        start, end = np.searchsorted(keys, key, side='left'), np.searchsorted(keys, key, side='right')
+        extra = self._extra_buckets.get((band, int(key)))
+        return np.concatenate([rows[start:end], extra]) if extra else rows[start:end]
+
+    def candidates(self, departement, level, pair_codes, min_candidates=USER_LSH_MIN_CANDIDATES):
+        """
+        Lignes candidates pour un utilisateur (codes de département et de niveau, -1 si
+        absents, et codes de ses paires). Les partitions sont explorées par groupes
+        (même département et niveau, même département, même niveau, autres) jusqu'à
+        réunir min_candidates lignes. Tous les membres de la partition de l'utilisateur
+        sont candidats si elle en compte moins de min_candidates ; sans historique, les
+        premiers membres des partitions servent de candidats.
+        """
+        signature = self.signature_of(pair_codes)
+        keys = None if signature is None else self._raw_band_keys(signature[None, :])[0]
+
+        with self._lock:
+            return self._collect(departement, level, keys, min_candidates)
+
+    def _collect(self, departement, level, keys, min_candidates):
+        found, count = [], 0
+        for group_index, group in enumerate(self._probe_order(departement, level)):
+            for partition in group:
+                members = self._partition_members(partition)
+                if group_index == 0 and len(members) <= min_candidates:
+                    # Partition de l'utilisateur assez petite : tous ses membres sont candidats
+                    rows = members
+                elif keys is None:
+                    # Sans historique, les membres d'une partition sont ex-aequo : les premiers suffisent
+                    rows = members[:min_candidates]
+                else:
+                    partition_key = _partition_hash(np.int64(partition[0]), np.int64(partition[1]))
+                    rows = [self._bucket(band, keys[band] ^ partition_key) for band in range(self.bands)]
+                    rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.intp)
+                found.append(rows)
+                count += len(rows)
+            if count >= min_candidates:
+                break
+        if not found:
+            return np.empty(0, dtype=np.intp)
+        return np.unique(np.concatenate(found).astype(np.intp))